@@ -0,0 +1,76 @@
+"""
+Benchmark of serial vs batched embedding of document chunks.
+
+A local fake embedder simulates the latency of the embedding API (a fixed
+round-trip cost plus a small cost per text), so the numbers show how much of
+the ingestion time is spent on HTTP round-trips.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_batched_embedding
+"""
+import time
+import threading
+
+from src.gen_ai.rag.doc_processing import iter_embedded_vectors
+
+
+class FakeEmbedder:
+    """Embedding model stand-in with a configurable per-request latency."""
+
+    def __init__(self, 
+                 round_trip_seconds=0.02, 
+                 per_text_seconds=0.0002, 
+                 dimension=1536):
+        self.round_trip_seconds = round_trip_seconds
+        self.per_text_seconds = per_text_seconds
+        self.dimension = dimension
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, texts):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.round_trip_seconds + self.per_text_seconds * len(texts))
+        return [[float(len(text))] * self.dimension for text in texts]
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+    def embed_documents(self, texts):
+        return self._embed(texts)
+
+
+def run_benchmark(num_chunks=1000):
+    chunk_docs = [f"chunk number {i} " * 20 for i in range(num_chunks)]
+    
+    embedder = FakeEmbedder()
+    start = time.perf_counter()
+    serial_vectors = [embedder.embed_query(chunk) for chunk in chunk_docs]
+    serial_seconds = time.perf_counter() - start
+    print(f"serial embed_query:   {num_chunks / serial_seconds:10.1f} chunks/s "
+          f"({embedder.requests} requests, {serial_seconds:.2f}s)")
+    
+    for batch_size, max_concurrent_batches in [(16, 1), (64, 1), (64, 4), (64, 8), (128, 8)]:
+        embedder = FakeEmbedder()
+        start = time.perf_counter()
+        # the embedding stage of ingestion, as it runs between chunking and upserting
+        batched_vectors = [vector["values"] for vector in iter_embedded_vectors(
+            username="tenant",
+            new_chunks=(
+                {"id": f"doc#{i}", "doc_key": "doc", "text": chunk, "page": 1, "start": 0, "end": 0}
+                for i, chunk in enumerate(chunk_docs)
+            ),
+            embedding_model=embedder,
+            batch_size=batch_size,
+            max_concurrent_batches=max_concurrent_batches)]
+        batched_seconds = time.perf_counter() - start
+        
+        assert batched_vectors == serial_vectors
+        
+        print(f"batch={batch_size:<4} concurrency={max_concurrent_batches:<2} "
+              f"{num_chunks / batched_seconds:10.1f} chunks/s "
+              f"({embedder.requests} requests, {batched_seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,120 @@
+"""
+Load test of the semantic search query path with many concurrent requests in one worker.
+
+Local fakes simulate the latency of the embedding and chat completion APIs,
+and the chunks are stored in a local vector store and document store, so the
+numbers show how many requests a single event loop serves at once. With
+`blocking` fakes, the API calls block the event loop the way synchronous
+calls did before the query path was made asynchronous.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_concurrent_queries
+"""
+import asyncio
+import tempfile
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.language_models import FakeListChatModel
+
+from src.gen_ai.rag.chat_processing import generate_semantic_search_response
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+class SlowChatModel(FakeListChatModel):
+    """Chat model stand-in that answers after a fixed latency."""
+
+    latency_seconds: float = 0.5
+    blocking: bool = False
+
+    async def _agenerate(self,
+                         messages: List[Any],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Any = None,
+                         **kwargs: Any):
+        if self.blocking:
+            time.sleep(self.latency_seconds)
+        else:
+            await asyncio.sleep(self.latency_seconds)
+        return self._generate(messages, stop=stop)
+
+
+class SlowEmbedder:
+    """Embedding model stand-in that answers after a fixed latency."""
+
+    def __init__(self, dimension, latency_seconds=0.1, blocking=False):
+        self.dimension = dimension
+        self.latency_seconds = latency_seconds
+        self.blocking = blocking
+        self.rng = np.random.default_rng(1)
+
+    async def aembed_query(self, text):
+        if self.blocking:
+            time.sleep(self.latency_seconds)
+        else:
+            await asyncio.sleep(self.latency_seconds)
+        return self.rng.normal(size=self.dimension).tolist()
+
+
+async def run_load(concurrency, num_requests, llm, embedding_model, vector_store, document_store):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(i):
+        async with semaphore:
+            await generate_semantic_search_response(
+                llm=llm,
+                embedding_model=embedding_model,
+                standalone_query=f"question number {i}",
+                username="tenant",
+                history_messages=[],
+                doc_key="tenant/doc.pdf",
+                top_k=3,
+                pinecone_index=vector_store,
+                document_store=document_store)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(num_requests)))
+    return time.perf_counter() - start
+
+
+def run_benchmark(num_chunks=1000, dimension=1536, concurrency_levels=(1, 4, 16, 64), requests_per_level=2, max_blocking_concurrency=16):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(num_chunks, dimension)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as path:
+        vector_store = LocalVectorStore(f"{path}/vectors")
+        document_store = DocumentStore(f"{path}/documents.sqlite3")
+
+        chunks = [
+            {"id": f"tenant/doc.pdf#{i}", "doc_key": "tenant/doc.pdf", "text": f"passage {i} " * 40, "page": 1, "start": 0, "end": 0}
+            for i in range(num_chunks)
+        ]
+        document_store.put_many(chunks)
+
+        for start in range(0, num_chunks, 100):
+            vector_store.upsert([
+                {"id": chunks[i]["id"], "values": values[i].tolist(), "metadata": {"username": "tenant", "doc_key": "tenant/doc.pdf", "page": 1}}
+                for i in range(start, min(start + 100, num_chunks))
+            ])
+
+        for blocking in (True, False):
+            llm = SlowChatModel(responses=["answer"], blocking=blocking)
+            embedding_model = SlowEmbedder(dimension, blocking=blocking)
+
+            print("blocking API calls:" if blocking else "async API calls:")
+
+            for concurrency in concurrency_levels:
+                # blocking requests run one after the other, higher levels would only take longer
+                if blocking and concurrency > max_blocking_concurrency:
+                    continue
+                
+                num_requests = concurrency * requests_per_level
+                seconds = asyncio.run(run_load(concurrency, num_requests, llm, embedding_model, vector_store, document_store))
+                print(f"  concurrency {concurrency:4d}: {num_requests / seconds:8.1f} requests/s, "
+                      f"mean latency {seconds / requests_per_level * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    run_benchmark()
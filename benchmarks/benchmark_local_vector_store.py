@@ -0,0 +1,52 @@
+"""
+Benchmark of single-document top-k queries on the local vector store.
+
+A document of random ada-002 sized embeddings is stored in a temporary
+directory, then queried with the same filter the retrieval code uses.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_local_vector_store
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+def run_benchmark(num_chunks=3000, dimension=1536, num_queries=1000, top_k=8):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(num_chunks, dimension)).astype(np.float32)
+    queries = rng.normal(size=(num_queries, dimension)).astype(np.float32)
+    
+    with tempfile.TemporaryDirectory() as path:
+        vector_store = LocalVectorStore(path)
+        
+        for start in range(0, num_chunks, 100):
+            vector_store.upsert([
+                {"id": f"tenant/doc.pdf#{i}", "values": values[i].tolist(), "metadata": {"username": "tenant", "doc_key": "tenant/doc.pdf", "page": i}}
+                for i in range(start, min(start + 100, num_chunks))
+            ])
+        
+        latencies = []
+        
+        for query in queries:
+            query_vector = query.tolist()
+            start = time.perf_counter()
+            vector_store.query(
+                vector=query_vector,
+                filter={"username": {"$eq": "tenant"}, "doc_key": "tenant/doc.pdf"},
+                top_k=top_k,
+                include_metadata=True)
+            latencies.append(time.perf_counter() - start)
+    
+    latencies = np.asarray(latencies) * 1000
+    
+    print(f"{num_chunks} chunks x {dimension} dimensions, top_k={top_k}")
+    print(f"query latency: p50 {np.percentile(latencies, 50):.3f} ms, "
+          f"p99 {np.percentile(latencies, 99):.3f} ms, mean {latencies.mean():.3f} ms")
+
+
+if __name__ == "__main__":
+    run_benchmark()
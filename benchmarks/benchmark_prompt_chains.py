@@ -0,0 +1,106 @@
+"""
+Microbenchmark of the per-request overhead of the prompt chains, outside the LLM call.
+
+"before" builds the chain the way every request used to: the history as a
+LangChain ChatMessageHistory, a PromptTemplate parsed from the template and a
+new LLMChain, or a new prompt | llm | StrOutputParser() pipeline for streamed
+responses. "after" takes the prebuilt chain from the chain registry and
+formats the history as text directly. Both run against a chat model stand-in
+that answers at once, so the numbers are the overhead around the LLM call.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_prompt_chains
+"""
+import asyncio
+import time
+
+from langchain.chains import LLMChain
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from src.gen_ai.rag.chain_registry import ChainRegistry
+from src.gen_ai.rag.prompt_budget import assemble_chat_history
+from src.gen_ai.rag.prompt_template import PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE
+from src.models.requests import SingleChatMessageRequest
+
+
+def make_history(num_messages):
+    return [
+        SingleChatMessageRequest(role="user" if i % 2 == 0 else "assistant",
+                                 content=f"message number {i} about the course material " * 5,
+                                 timestamp="2023-07-17T12:34:56")
+        for i in range(num_messages)
+    ]
+
+
+async def before(llm, history, context):
+    chat_history = ChatMessageHistory()
+    for message in history:
+        if message.role == "user":
+            chat_history.add_user_message(message.content)
+        else:
+            chat_history.add_ai_message(message.content)
+
+    chain = LLMChain(llm=llm, prompt=PromptTemplate.from_template(PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE))
+    response = await chain.ainvoke({"context": context, "chat_history": chat_history, "question": "why?"}, return_only_outputs=True)
+    return response["text"]
+
+
+async def before_streamed(llm, history, context):
+    chat_history = ChatMessageHistory()
+    for message in history:
+        if message.role == "user":
+            chat_history.add_user_message(message.content)
+        else:
+            chat_history.add_ai_message(message.content)
+
+    chain = PromptTemplate.from_template(PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE) | llm | StrOutputParser()
+    return "".join([token async for token in chain.astream({"context": context, "chat_history": chat_history, "question": "why?"})])
+
+
+async def after(registry, llm, history, context):
+    chat_history, _, _ = assemble_chat_history(history)
+    chain = registry.chain(PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE, llm)
+    return await chain.ainvoke({"context": context, "chat_history": chat_history, "question": "why?"})
+
+
+async def after_streamed(registry, llm, history, context):
+    chat_history, _, _ = assemble_chat_history(history)
+    chain = registry.chain(PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE, llm)
+    return "".join([token async for token in chain.astream({"context": context, "chat_history": chat_history, "question": "why?"})])
+
+
+async def measure(run, num_requests):
+    # warm up once, then time the requests
+    await run()
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        await run()
+    return (time.perf_counter() - start) / num_requests
+
+
+def run_benchmark(history_lengths=(0, 10, 50), num_requests=300):
+    llm = FakeListChatModel(responses=["answer"])
+    registry = ChainRegistry()
+    registry.prepare(llm)
+    context = "\n\n".join(f"passage {i} " * 60 for i in range(8))
+
+    for streamed in (False, True):
+        print("streamed responses:" if streamed else "complete responses:")
+
+        for num_messages in history_lengths:
+            history = make_history(num_messages)
+            if streamed:
+                before_seconds = asyncio.run(measure(lambda: before_streamed(llm, history, context), num_requests))
+                after_seconds = asyncio.run(measure(lambda: after_streamed(registry, llm, history, context), num_requests))
+            else:
+                before_seconds = asyncio.run(measure(lambda: before(llm, history, context), num_requests))
+                after_seconds = asyncio.run(measure(lambda: after(registry, llm, history, context), num_requests))
+            print(f"  history of {num_messages:3d} messages: before {before_seconds * 1e6:8.0f} us/request, "
+                  f"after {after_seconds * 1e6:8.0f} us/request")
+
+
+if __name__ == "__main__":
+    run_benchmark()
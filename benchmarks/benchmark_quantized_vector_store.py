@@ -0,0 +1,133 @@
+"""
+Benchmark of recall@k, latency and memory of the quantized local vector store.
+
+Embeddings of one document are clustered around its topics, so the synthetic
+vectors are drawn around a few hundred random topic centers, and queries are
+perturbed copies of stored vectors. Recall@k is the share of the exact top k
+(found without quantization) returned by each quantized setting.
+
+Most tenants hold many short documents rather than one long one, so the total
+memory and recall are also measured over many partitions of a few hundred
+chunks, where the codebooks of product quantization would outweigh its codes.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_quantized_vector_store
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+def generate_vectors(num_vectors, dimension, num_topics=200, noise=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(num_topics, dimension))
+    vectors = topics[rng.integers(num_topics, size=num_vectors)] + noise * rng.normal(size=(num_vectors, dimension))
+    return vectors.astype(np.float32)
+
+
+def run_benchmark(num_chunks=3000, dimension=1536, num_queries=200, top_k=8):
+    rng = np.random.default_rng(1)
+    values = generate_vectors(num_chunks, dimension)
+    queries = values[rng.integers(num_chunks, size=num_queries)] + 0.8 * rng.normal(size=(num_queries, dimension)).astype(np.float32)
+    query_filter = {"username": {"$eq": "tenant"}, "doc_key": "tenant/doc.pdf"}
+    
+    with tempfile.TemporaryDirectory() as path:
+        LocalVectorStore(path).upsert([
+            {"id": f"tenant/doc.pdf#{i}", "values": values[i].tolist(), "metadata": {"username": "tenant", "doc_key": "tenant/doc.pdf"}}
+            for i in range(num_chunks)
+        ])
+        
+        exact_results = None
+        
+        print(f"{num_chunks} chunks x {dimension} dimensions, top_k={top_k}")
+        print(f"float32 vectors: {values.nbytes / num_chunks:.0f} bytes per vector")
+        
+        for quantization, rescore_factor in [("none", 1), ("int8", 1), ("int8", 10), ("pq", 1), ("pq", 10), ("pq", 20)]:
+            vector_store = LocalVectorStore(path, quantization=quantization, rescore_factor=rescore_factor)
+            
+            # The compressed vectors are built by the first query
+            start = time.perf_counter()
+            vector_store.query(vector=queries[0].tolist(), filter=query_filter, top_k=top_k)
+            build_seconds = time.perf_counter() - start
+            
+            results = []
+            latencies = []
+            
+            for query in queries:
+                query_vector = query.tolist()
+                start = time.perf_counter()
+                matches = vector_store.query(vector=query_vector, filter=query_filter, top_k=top_k)["matches"]
+                latencies.append(time.perf_counter() - start)
+                results.append({match["id"] for match in matches})
+            
+            if exact_results is None:
+                exact_results = results
+            
+            recall = np.mean([len(result & exact) / len(exact) for result, exact in zip(results, exact_results)])
+            quantized = next(iter(vector_store._partitions.values())).quantized
+            bytes_per_vector = quantized.nbytes / num_chunks if quantized is not None else values.nbytes / num_chunks
+            
+            print(f"{quantization:<5} rescore x{rescore_factor:<3} recall@{top_k} {recall:.3f}  "
+                  f"p50 {np.percentile(latencies, 50) * 1000:.3f} ms  "
+                  f"{bytes_per_vector:7.0f} bytes per vector in memory  "
+                  f"(first query {build_seconds:.2f}s)")
+
+
+def run_many_documents_benchmark(num_documents=100, min_chunks=100, max_chunks=600, dimension=1536, num_queries=200, top_k=8):
+    rng = np.random.default_rng(2)
+    num_chunks = rng.integers(min_chunks, max_chunks, size=num_documents)
+    documents = [generate_vectors(int(n), dimension, seed=seed) for seed, n in enumerate(num_chunks)]
+    # every document is queried, so every partition is compressed
+    query_documents = np.arange(num_queries) % num_documents
+    queries = [
+        documents[doc][rng.integers(len(documents[doc]))] + 0.8 * rng.normal(size=dimension).astype(np.float32)
+        for doc in query_documents
+    ]
+    float32_bytes = sum(vectors.nbytes for vectors in documents)
+
+    with tempfile.TemporaryDirectory() as path:
+        writer = LocalVectorStore(path)
+        for doc, vectors in enumerate(documents):
+            doc_key = f"tenant/doc{doc}.pdf"
+            writer.upsert([
+                {"id": f"{doc_key}#{i}", "values": vector.tolist(), "metadata": {"username": "tenant", "doc_key": doc_key}}
+                for i, vector in enumerate(vectors)
+            ])
+
+        exact_results = None
+
+        print(f"\n{num_documents} documents of {min_chunks} to {max_chunks} chunks ({int(num_chunks.sum())} chunks) x {dimension} dimensions, top_k={top_k}")
+        print(f"float32 vectors: {float32_bytes / 2**20:.1f} MB")
+
+        for quantization, rescore_factor in [("none", 1), ("int8", 10), ("pq", 10)]:
+            vector_store = LocalVectorStore(path, quantization=quantization, rescore_factor=rescore_factor)
+            results = []
+
+            for doc, query in zip(query_documents, queries):
+                query_filter = {"username": {"$eq": "tenant"}, "doc_key": f"tenant/doc{doc}.pdf"}
+                matches = vector_store.query(vector=query.tolist(), filter=query_filter, top_k=top_k)["matches"]
+                results.append({match["id"] for match in matches})
+
+            if exact_results is None:
+                exact_results = results
+
+            recall = np.mean([len(result & exact) / len(exact) for result, exact in zip(results, exact_results)])
+            compressed = [partition.quantized for partition in vector_store._partitions.values()]
+            compressed_bytes = sum(quantized.nbytes for quantized in compressed if quantized is not None) if quantization != "none" else 0
+            num_product_quantized = sum(type(quantized).__name__ == "ProductQuantizedVectors" for quantized in compressed)
+
+            print(f"{quantization:<5} rescore x{rescore_factor:<3} recall@{top_k} {recall:.3f}  "
+                  f"{(compressed_bytes or float32_bytes) / 2**20:7.1f} MB in memory  "
+                  f"({num_product_quantized} of {num_documents} partitions product quantized)")
+
+        # what product quantization of every partition would take, each with its own codebooks
+        codebook_bytes = 4 * dimension * np.minimum(256, num_chunks).sum()
+        print(f"pq codes and codebooks of every partition: {(num_chunks.sum() * 96 + codebook_bytes) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    run_benchmark()
+    run_many_documents_benchmark()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the offset-based text chunker against LangChain's RecursiveCharacterTextSplitter.
+
+Both split the same synthetic document with the default chunk size and overlap, 
+and the benchmark checks that they produce the same chunks before timing them.
+
+Run from the project root (the .env file must be present, as for the app):
+    python -m benchmarks.benchmark_text_chunker
+"""
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.gen_ai.rag.text_chunker import split_text_spans
+
+
+def generate_document(num_words=500000, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ["revenue", "quarter", "growth", "the", "of", "and", "report", "2024", "net", "margin"]
+    words = []
+    
+    for _ in range(num_words):
+        words.append(rng.choice(vocabulary))
+        roll = rng.random()
+        words.append("\n\n" if roll < 0.005 else "\n" if roll < 0.05 else " ")
+    
+    return "".join(words)
+
+
+def time_best_of(function, repeats=3):
+    best = float("inf")
+    
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    
+    return best, result
+
+
+def run_benchmark(num_words=500000, chunk_size=512, chunk_overlap=50):
+    text = generate_document(num_words)
+    megabytes = len(text.encode("utf-8")) / 1e6
+    
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    langchain_seconds, langchain_chunks = time_best_of(lambda: splitter.split_text(text))
+    spans_seconds, spans = time_best_of(
+        lambda: split_text_spans(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+    
+    assert [text[start:end] for start, end in spans] == langchain_chunks
+    
+    print(f"document: {megabytes:.1f} MB, {len(spans)} chunks")
+    print(f"RecursiveCharacterTextSplitter: {megabytes / langchain_seconds:8.1f} MB/s ({langchain_seconds:.3f}s)")
+    print(f"split_text_spans:               {megabytes / spans_seconds:8.1f} MB/s ({spans_seconds:.3f}s)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
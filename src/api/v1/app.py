@@ -1,16 +1,18 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile, Request, Depends
+from fastapi import APIRouter, HTTPException, File, Form, UploadFile, Request, Depends
+from fastapi.responses import StreamingResponse
 import logging
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 import fitz
-from io import BytesIO
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from langchain.embeddings import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
-from pinecone import Pinecone
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 import redis.asyncio as redis
-import time
+import asyncio
+import functools
 import os
 
 from src.models.requests import (
@@ -22,20 +24,68 @@ from src.config import (
     AWS_BUCKET_NAME,
     AWS_REGION,
     MAIN_TENANT,
-    PINECONE_API_KEY,
-    PINECONE_INDEX
+    REDIS_HOST,
+    REDIS_PORT,
+    BULK_UPLOAD_MAX_CONCURRENT_S3_UPLOADS,
+    HYBRID_SEARCH_ENABLED,
+    SEMANTIC_ANSWER_CACHE_ENABLED,
+    CONDENSATION_MODEL,
+    SPECULATIVE_RETRIEVAL_ENABLED,
+    SINGLE_FLIGHT_ENABLED,
+    SUMMARY_TREE_ENABLED,
+    SUMMARY_MODEL
 )
 from src.utils.exceptions import return_error_param
-from src.utils.aws_operation import (
-    get_file
+from src.utils.aws_operation import get_file
+from src.utils.server_sent_events import (
+    SSE_HEADERS,
+    format_sse_event,
+    stream_response_events
+)
+from src.utils.single_flight import (
+    SingleFlight
+)
+from src.utils.ingestion_jobs import (
+    IngestionJobManager
 )
 from src.gen_ai.rag.doc_processing import (
-    init_pinecone_and_doc_indexing
+    IndexingRequest,
+    init_pinecone_and_doc_indexing,
+    init_pinecone_and_bulk_doc_indexing
+)
+from src.gen_ai.rag.document_store import (
+    DocumentStore
+)
+from src.gen_ai.rag.vector_store import (
+    create_vector_store
+)
+from src.gen_ai.rag.keyword_index import (
+    KeywordIndexStore
+)
+from src.gen_ai.rag.answer_cache import (
+    SemanticAnswerCache
+)
+from src.gen_ai.rag.embedding_cache import (
+    CachedEmbeddings,
+    create_embedding_cache,
+    create_query_embedding_cache
+)
+from src.gen_ai.rag.query_condensation import (
+    CondensationCache
+)
+from src.gen_ai.rag.chain_registry import (
+    chain_registry
 )
 from src.gen_ai.rag.chat_processing import (
-    generate_standalone_query,
+    condense_query,
+    condense_query_with_speculative_retrieval,
+    retrieve_semantic_search_context,
+    retrieve_summarization_candidates,
     generate_semantic_search_response,
-    generate_summarized_response
+    generate_summarized_response,
+    stream_semantic_search_response,
+    stream_summarized_response,
+    load_summary_nodes
 )
 
 api_router = APIRouter()
@@ -58,15 +108,61 @@ llm = ChatOpenAI(
     max_retries=2,
 )
 
+# init a lighter LLM for condensing follow-up questions into standalone queries
+condensation_llm = ChatOpenAI(
+    model=CONDENSATION_MODEL,
+    temperature=0,
+    max_tokens=None,
+    timeout=None,
+    max_retries=2,
+)
+
+# init the LLM that writes the summary tree of every document at ingestion
+summary_llm = ChatOpenAI(
+    model=SUMMARY_MODEL,
+    temperature=0,
+    max_tokens=None,
+    timeout=None,
+    max_retries=2,
+) if SUMMARY_TREE_ENABLED else None
+
+# build the prompt | llm | parser pipelines of the prompt templates once, every request reuses them
+chain_registry.prepare(llm)
+chain_registry.prepare(condensation_llm)
+if summary_llm is not None:
+    chain_registry.prepare(summary_llm)
+
+# init the cache of standalone queries of past (history, question) pairs
+condensation_cache = CondensationCache()
+
 # init embedding model, I am 'text-embedding-ada-002' model from Open AI
-embedding_model=OpenAIEmbeddings(
-    model='text-embedding-ada-002'
+# behind a persistent cache, so repeated chunks and queries are only embedded once,
+# repeated queries are also kept in memory and in Redis to skip the embedding call altogether
+embedding_model=CachedEmbeddings(
+    embedding_model=OpenAIEmbeddings(
+        model='text-embedding-ada-002'
+    ),
+    cache=create_embedding_cache(),
+    query_cache=create_query_embedding_cache()
 )
 
-# init connection to Pipecone Vector DB index
-pinecone_instance = Pinecone(api_key=PINECONE_API_KEY)
-pinecone_index = pinecone_instance.Index(PINECONE_INDEX)
+# init the vector store, Pinecone Vector DB index or the local in-process index depending on VECTOR_STORE_BACKEND
+vector_store = create_vector_store()
+
+# init local store of the chunk text, vectors in Pinecone only carry ids and filter fields
+document_store = DocumentStore()
+
+# init the BM25 keyword indexes fused with the vector search, built from the document store at indexing time
+keyword_index_store = KeywordIndexStore() if HYBRID_SEARCH_ENABLED else None
 
+# init the cache of past answers, looked up by the similarity of the standalone query so paraphrases hit too
+answer_cache = SemanticAnswerCache() if SEMANTIC_ANSWER_CACHE_ENABLED else None
+
+# init the coalescing of identical in-flight queries, so concurrent requests of a popular document share one LLM call
+single_flight = SingleFlight()
+
+# init background workers that run document indexing outside of the request
+ingestion_job_manager = IngestionJobManager()
 
 
 # DEFINE API ENDPOINS
@@ -75,9 +171,104 @@ pinecone_index = pinecone_instance.Index(PINECONE_INDEX)
 @api_router.on_event("startup")
 async def startup():
     logging.info("is running in docker environemt: ",not os.getenv("HOSTNAME")==None)
-    redis_client = redis.Redis(host="redis" if os.getenv("HOSTNAME") else "localhost", port=6379, db=0)
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
     FastAPICache.init(RedisBackend(redis_client), prefix="fastapi-cache")
 
+# Cache a complete LLM response, a Redis error never fails the request
+async def cache_llm_response(cache: RedisBackend, 
+                             key_redis: str, 
+                             response: str, 
+                             answer_cache_entry: Optional[tuple] = None):
+    try: 
+        await cache.set(key_redis,response,expire=600)
+        logging.info("cached LLM response")
+    except Exception as e:
+        logging.info("There is error with Redis server, can not cache LLM response")
+    
+    # answer_cache_entry is the (doc_key, namespace, standalone_query, query_embedding) of the response
+    if answer_cache is not None and answer_cache_entry is not None:
+        try:
+            await asyncio.to_thread(answer_cache.put,*answer_cache_entry,response)
+        except Exception as e:
+            logging.warning(f"can not store the answer in the semantic answer cache: {e}")
+
+
+# Look up the answer of a similar past query of the document, returns the entry to store the new answer under on a miss
+async def lookup_semantic_answer_cache(doc_key: str,
+                                       namespace: str,
+                                       standalone_query: str):
+    if answer_cache is None:
+        return None, None
+    
+    try:
+        # the query embedding is cached, so retrieval does not embed the query again
+        query_embedding=await embedding_model.aembed_query(standalone_query)
+        cached_answer=await asyncio.to_thread(answer_cache.get,doc_key,namespace,query_embedding)
+    except Exception as e:
+        logging.warning(f"semantic answer cache lookup failed: {e}")
+        return None, None
+    
+    logging.info(f"semantic answer cache stats: {answer_cache.stats()}")
+    
+    return cached_answer, (doc_key,namespace,standalone_query,query_embedding)
+
+
+def cached_answer_response(answer, stream: bool):
+    # replay a cached answer, as a single event when streaming, Redis returns it as bytes
+    answer=answer.decode() if isinstance(answer,bytes) else answer
+    
+    if stream:
+        return StreamingResponse(
+            iter([format_sse_event({"response":answer},event="done")]),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
+    
+    return {"response":answer}
+
+
+# Condense the user query, retrieving for the raw user query at the same time when speculative retrieval is enabled
+# and `retrieve` is given. Returns the standalone query, its matches or None when they still have to be retrieved,
+# and the outcome of the speculation
+async def condense_and_retrieve(user_query, history_messages, retrieve=None):
+    if not SPECULATIVE_RETRIEVAL_ENABLED or retrieve is None:
+        standalone_query=await condense_query(
+            llm=condensation_llm,
+            user_query=user_query,
+            history_messages=history_messages,
+            condensation_cache=condensation_cache
+        )
+        return standalone_query, None, "disabled" if not SPECULATIVE_RETRIEVAL_ENABLED else "skipped"
+    
+    return await condense_query_with_speculative_retrieval(
+        llm=condensation_llm,
+        user_query=user_query,
+        history_messages=history_messages,
+        retrieve=retrieve,
+        embedding_model=embedding_model,
+        condensation_cache=condensation_cache
+    )
+
+
+# Compute a response once for identical concurrent queries, the other requests of this worker await it,
+# those of other workers wait until it is cached under the same key. Returns the response and how it was obtained
+async def coalesce_llm_response(cache: RedisBackend,
+                                key_redis: str,
+                                compute):
+    if not SINGLE_FLIGHT_ENABLED:
+        return await compute(), "disabled"
+    
+    async def lookup():
+        value=await cache.get(key_redis)
+        return value.decode() if isinstance(value,bytes) else value
+    
+    return await single_flight.run(
+        key_redis,
+        compute,
+        lookup=lookup,
+        redis_client=getattr(cache,"redis",None)
+    )
+
 # Dependency to get Redis backend
 async def get_redis_cache():
     return FastAPICache.get_backend()
@@ -140,42 +331,21 @@ async def upload_file(request: Request,
         # Read file content
         file_content = await file.read()
 
-        # Open the PDF file using PyMuPDF from the in-memory bytes
-        pdf_document = fitz.open(stream=BytesIO(file_content), filetype="pdf")
+        # Open the PDF file using PyMuPDF from the in-memory bytes, it is parsed only once and handed to indexing
+        pdf_document = fitz.open(stream=file_content, filetype="pdf")
         
         # Get the number of pages
         num_pages = pdf_document.page_count
 
-        logging.info("num_pages: ",num_pages)
+        logging.info(f"num_pages: {num_pages}")
         
         # Get the file size
         file_size = len(file_content)
 
-        logging.info("file_size: ",file_size)
+        logging.info(f"file_size: {file_size}")
 
         s3_dockey=f"{folder_name}{file.filename}"
         
-        logging.info("start uploading pdf document to s3 bucket")
-
-        # Upload the file to the S3 bucket
-        s3_client.put_object(
-            Bucket=AWS_BUCKET_NAME,
-            Key=s3_dockey,
-            Body=file_content,
-            ContentType=file.content_type
-        )
-        
-        logging.info("uploading pdf document to s3 bucket successfully")
-        
-    # Handle different AWS credential errors
-    except NoCredentialsError:
-        raise HTTPException(
-            status_code=403, 
-            detail="AWS credentials not found")
-    except PartialCredentialsError:
-        raise HTTPException(
-            status_code=403, 
-            detail="Incomplete AWS credentials")
     except Exception as e:
         raise HTTPException(
             status_code=return_error_param(e,"status_code"), 
@@ -184,31 +354,205 @@ async def upload_file(request: Request,
     # START INDEXING THE UPLOADED DOCUMENT
     logging.info("start_pinecone_indexing")
     
-    # Retrieve the uploaded PDF content from AWS S3
-    file_content= get_file(
-        s3_client=s3_client,
-        doc_key=s3_dockey
-    )[0]
+    def index_document(on_progress):
+        try:
+            with ThreadPoolExecutor(max_workers=1) as s3_upload_executor:
+                logging.info("start uploading pdf document to s3 bucket")
+                
+                # Upload the file to the S3 bucket while the document is being embedded
+                s3_upload=s3_upload_executor.submit(
+                    s3_client.put_object,
+                    Bucket=AWS_BUCKET_NAME,
+                    Key=s3_dockey,
+                    Body=file_content,
+                    ContentType=file.content_type
+                )
 
-    logging.info("file_content: ",file_content)
+                # Run the Pinecone indexing pipeline for the document, straight from the uploaded bytes
+                init_pinecone_and_doc_indexing(
+                    username=MAIN_TENANT,  # Tenant name 
+                    doc_key=s3_dockey,   # Document path in S3
+                    file_bytes=file_content,  # File content in bytes
+                    embedding_model=embedding_model,
+                    vector_store=vector_store,
+                    on_progress=on_progress,
+                    pdf_document=pdf_document,
+                    document_store=document_store,
+                    keyword_index_store=keyword_index_store,
+                    summary_llm=summary_llm
+                )
+                
+                # Answers cached for the previous version of the document are stale once it is re-indexed
+                if answer_cache is not None:
+                    answer_cache.invalidate(s3_dockey)
+                
+                # Wait for the upload, this raises in case of error
+                s3_upload.result()
+                
+                logging.info("uploading pdf document to s3 bucket successfully")
+        
+        # Handle different AWS credential errors
+        except NoCredentialsError:
+            raise RuntimeError("AWS credentials not found")
+        except PartialCredentialsError:
+            raise RuntimeError("Incomplete AWS credentials")
+        finally:
+            pdf_document.close()
+        
+        logging.info(f"successully indexed pdf document {file.filename}")
+        logging.info(f"embedding cache stats: {embedding_model.stats()}")
+    
+    # Index the document in the background, the client polls the job status endpoint
+    job=ingestion_job_manager.submit(
+        doc_key=s3_dockey,
+        filename=file.filename,
+        task=index_document
+    )
+        
+    return {"message": "File received, upload to S3 and indexing have started", 
+            "filename": file.filename,
+            "job_id": job.job_id}
 
-    # Run the Pinecone indexing pipeline for the document
-    try:
-        init_pinecone_and_doc_indexing(
-            username=MAIN_TENANT,  # Tenant name 
-            doc_key=s3_dockey,   # Document path in S3
-            file_bytes=file_content,  # File content in bytes
-            embedding_model=embedding_model,
-            pc=pinecone_instance
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500,
-                            detail="We encouter error when spinning up chat engine for this document")
+
+# Define an API endpoint to upload many PDF files, or index PDF documents already in S3, through one shared indexing pipeline
+@api_router.post("/bulk_upload_documents_and_trigger_indexing")
+async def bulk_upload_files(files: List[UploadFile] = File(default=[]),
+                            s3_keys: List[str] = Form(default=[])):
+    
+    # Define the folder name in S3 where the files are stored
+    folder_name=f"{MAIN_TENANT}/"
+    
+    if not files and not s3_keys:
+        raise HTTPException(status_code=400, detail="Provide PDF files or S3 keys of PDF documents")
+    
+    # One result per file, in the order of the request, accepted documents get an indexing job
+    results=[]
+    accepted_documents=[]
+    
+    def accept(filename, file_content=None):
+        s3_dockey=f"{folder_name}{filename}"
+        result={"filename": filename}
+        results.append(result)
+        
+        if any(document["doc_key"] == s3_dockey for document in accepted_documents):
+            result["error"]="Duplicate document in the same request"
+            return
+        
+        accepted_documents.append({
+            "doc_key": s3_dockey,
+            "filename": filename,
+            "file_content": file_content,
+            "result": result
+        })
+    
+    for file in files:
+        # Validate if the uploaded file is a PDF
+        if file.content_type != "application/pdf":
+            results.append({"filename": file.filename, "error": "File must be a PDF"})
+            continue
+        
+        accept(file.filename, await file.read())
     
-    logging.info(f"successully indexed pdf document {file.filename}")
+    for s3_key in s3_keys:
+        # Keys may be given with or without the tenant folder
+        accept(s3_key[len(folder_name):] if s3_key.startswith(folder_name) else s3_key)
+    
+    if not accepted_documents:
+        return {"response": results}
+    
+    # START INDEXING THE DOCUMENTS
+    logging.info(f"start_bulk_pinecone_indexing of {len(accepted_documents)} documents")
+    
+    def index_documents(trackers):
+        with ThreadPoolExecutor(max_workers=BULK_UPLOAD_MAX_CONCURRENT_S3_UPLOADS) as s3_upload_executor:
+            indexing_requests=[]
+            
+            for document,(on_progress,on_done) in zip(accepted_documents,trackers):
+                file_content=document["file_content"]
+                
+                # Answers cached for the previous version of the document are stale once it is re-indexed
+                def on_done(error, doc_key=document["doc_key"], on_done=on_done):
+                    if error is None and answer_cache is not None:
+                        answer_cache.invalidate(doc_key)
+                    on_done(error)
+                
+                if file_content is None:
+                    # Documents given by S3 key are downloaded when the pipeline reaches them
+                    indexing_requests.append(IndexingRequest(
+                        doc_key=document["doc_key"],
+                        load_file_bytes=lambda doc_key=document["doc_key"]: get_file(s3_client,doc_key)[1],
+                        on_progress=on_progress,
+                        on_done=on_done
+                    ))
+                    continue
+                
+                # Upload the file to the S3 bucket while the documents are being embedded
+                s3_upload=s3_upload_executor.submit(
+                    s3_client.put_object,
+                    Bucket=AWS_BUCKET_NAME,
+                    Key=document["doc_key"],
+                    Body=file_content,
+                    ContentType="application/pdf"
+                )
+                
+                # The document is only done once its upload is done too
+                def on_indexed(error, s3_upload=s3_upload, on_done=on_done):
+                    if error is None:
+                        try:
+                            s3_upload.result()
+                        except (NoCredentialsError, PartialCredentialsError):
+                            error=RuntimeError("AWS credentials not found or incomplete")
+                        except Exception as e:
+                            error=e
+                    on_done(error)
+                
+                indexing_requests.append(IndexingRequest(
+                    doc_key=document["doc_key"],
+                    load_file_bytes=lambda file_content=file_content: file_content,
+                    on_progress=on_progress,
+                    on_done=on_indexed
+                ))
+            
+            # Run one Pinecone indexing pipeline shared by all documents
+            init_pinecone_and_bulk_doc_indexing(
+                username=MAIN_TENANT,  # Tenant name 
+                documents=indexing_requests,
+                embedding_model=embedding_model,
+                vector_store=vector_store,
+                document_store=document_store,
+                keyword_index_store=keyword_index_store,
+                summary_llm=summary_llm
+            )
         
-    return {"message": "File uploaded and indexed successfully", 
-            "filename": file.filename}
+        logging.info(f"embedding cache stats: {embedding_model.stats()}")
+    
+    # Index the documents in the background, the client polls the job status endpoint of every document
+    jobs=ingestion_job_manager.submit_bulk(
+        documents=[(document["doc_key"],document["filename"]) for document in accepted_documents],
+        task=index_documents
+    )
+    
+    for document,job in zip(accepted_documents,jobs):
+        document["result"]["job_id"]=job.job_id
+    
+    return {"message": f"{len(jobs)} documents received, upload to S3 and indexing have started",
+            "response": results}
+
+
+# Define an API endpoint to report the state, progress and timings of a document indexing job
+@api_router.get("/indexing_status/{job_id}")
+async def get_indexing_status(job_id: str):
+    
+    job=ingestion_job_manager.get(job_id)
+    
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Indexing job {job_id} does not exist"
+        )
+    
+    return {"response": job.to_dict()}
+
 
 @api_router.post("/semantic_search/{doc_name}")
 async def generate_result_for_semantic_search(
@@ -221,12 +565,12 @@ async def generate_result_for_semantic_search(
     
     # check if the response for this query has been cached
     try: 
-        key_redis=doc_name+"#"+request.list_of_messages[-1].content.replace(" ","").lower()
+        key_redis="semantic_search:"+doc_name+"#"+request.list_of_messages[-1].content.replace(" ","").lower()
         value=await cache.get(key_redis)
         if value:
-            time.sleep(1)
             logging.info("redis cache hit, immediately return response")
-            return {"response":value}
+            
+            return cached_answer_response(value,request.stream)
         
         logging.info("redis cache miss")
     except Exception as e:
@@ -237,9 +581,10 @@ async def generate_result_for_semantic_search(
     subfolder_prefix = f"{MAIN_TENANT}/"  # Include trailing slash
     
     try:
-        # Fetch the list of documents stored under the subfolder in S3
-        response = s3_client.list_objects_v2(Bucket=bucket_name, 
-                                    Prefix=subfolder_prefix)
+        # Fetch the list of documents stored under the subfolder in S3, in a worker thread so the event loop keeps serving other requests
+        response = await asyncio.to_thread(s3_client.list_objects_v2,
+                                           Bucket=bucket_name, 
+                                           Prefix=subfolder_prefix)
 
         # If documents exist in the specified subfolder, extract their names
         if 'Contents' in response:
@@ -276,37 +621,90 @@ async def generate_result_for_semantic_search(
     logging.info("history_messages: ",history_messages)
     logging.info("len_history_messages: ",len(history_messages))
     
-    # If there are no previous messages, use the user query directly
-    if not history_messages:
-        standalone_query=user_query.content
-    else:
-        # Generate a standalone query using the chat history and user query using LLM
-        standalone_query=generate_standalone_query(
-            llm=llm,
-            user_query=user_query,
-            history_messages=history_messages
-        )
-    
-    # Perform semantic search to retrieve relevant information from the document
-    result_semantic_search=await generate_semantic_search_response(
-            llm=llm,
+    # Use the user query directly when it does not refer back to previous messages,
+    # otherwise generate a standalone query using the chat history and user query using LLM,
+    # while the passages of the raw user query are retrieved in case the standalone query is close to it
+    standalone_query,similar_results,speculative_retrieval=await condense_and_retrieve(
+        user_query=user_query,
+        history_messages=history_messages,
+        retrieve=functools.partial(
+            retrieve_semantic_search_context,
             embedding_model=embedding_model,
-            standalone_query=standalone_query,
             username=MAIN_TENANT,
-            history_messages=history_messages,
             doc_key=f"{MAIN_TENANT}/{doc_name}",
             top_k=3,
-            pinecone_index=pinecone_index
+            pinecone_index=vector_store,
+            document_store=document_store,
+            keyword_index_store=keyword_index_store
+        )
     )
+    metadata={"speculative_retrieval":speculative_retrieval}
     
-    # cache the LLM response to Redis cache
-    try: 
-        await cache.set(key_redis,result_semantic_search,expire=600)
-        logging.info("cached LLM response")
-    except Exception as e:
-        logging.info("There is error with Redis server, can not cache LLM response")
+    # Reuse the answer of a similar past query on the same document
+    cached_answer,answer_cache_entry=await lookup_semantic_answer_cache(
+        doc_key=f"{MAIN_TENANT}/{doc_name}",
+        namespace="semantic_search",
+        standalone_query=standalone_query
+    )
+    if cached_answer is not None:
+        logging.info("semantic answer cache hit, immediately return response")
+        return cached_answer_response(cached_answer,request.stream)
+    
+    # Stream the tokens as Server-Sent Events while they are generated, the full text is cached once the stream completes
+    if request.stream:
+        return StreamingResponse(
+            stream_response_events(
+                stream_semantic_search_response(
+                    llm=llm,
+                    embedding_model=embedding_model,
+                    standalone_query=standalone_query,
+                    username=MAIN_TENANT,
+                    history_messages=history_messages,
+                    doc_key=f"{MAIN_TENANT}/{doc_name}",
+                    top_k=3,
+                    pinecone_index=vector_store,
+                    document_store=document_store,
+                    keyword_index_store=keyword_index_store,
+                    similar_results=similar_results,
+                    metadata=metadata
+                ),
+                on_complete=lambda response: cache_llm_response(cache,key_redis,response,answer_cache_entry),
+                metadata=metadata
+            ),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
     
-    return {"response":result_semantic_search}
+    # Perform semantic search to retrieve relevant information from the document
+    async def compute_semantic_search_response():
+        result_semantic_search=await generate_semantic_search_response(
+                llm=llm,
+                embedding_model=embedding_model,
+                standalone_query=standalone_query,
+                username=MAIN_TENANT,
+                history_messages=history_messages,
+                doc_key=f"{MAIN_TENANT}/{doc_name}",
+                top_k=3,
+                pinecone_index=vector_store,
+                document_store=document_store,
+                keyword_index_store=keyword_index_store,
+                similar_results=similar_results,
+                metadata=metadata
+        )
+        logging.info(f"query embedding cache stats: {embedding_model.stats()['query_cache']}")
+        
+        await cache_llm_response(cache,key_redis,result_semantic_search,answer_cache_entry)
+        
+        return result_semantic_search
+    
+    # identical queries in flight at the same time share one computation
+    result_semantic_search,single_flight_outcome=await coalesce_llm_response(
+        cache,key_redis,compute_semantic_search_response
+    )
+    metadata["single_flight"]=single_flight_outcome
+    logging.info(f"single-flight: {single_flight_outcome}")
+    
+    return {"response":result_semantic_search,"metadata":metadata}
    
 
 @api_router.post("/generate_summarization/{doc_name}")
@@ -319,14 +717,14 @@ async def generate_result_for_semantic_search(
     logging.info("preferred_response_length: ",request.preferred_response_length)
     logging.info("request_generate_summarization: ",request.list_of_messages)
     
-    # check if the response for this query has been cached
+    # check if the response for this query has been cached, for this response length
     try: 
-        key_redis=doc_name+"#"+request.list_of_messages[-1].content.replace(" ","").lower()
+        key_redis=f"summarization:{request.preferred_response_length}:"+doc_name+"#"+request.list_of_messages[-1].content.replace(" ","").lower()
         value=await cache.get(key_redis)
         if value:
-            time.sleep(1)
             logging.info("redis cache hit, immediately return response")
-            return {"response":value}
+            
+            return cached_answer_response(value,request.stream)
         
         logging.info("redis cache miss")
     except Exception as e:
@@ -337,9 +735,10 @@ async def generate_result_for_semantic_search(
     subfolder_prefix = f"{MAIN_TENANT}/"  # Include trailing slash
     
     try:
-        # Fetch the list of documents stored under the subfolder in S3
-        response = s3_client.list_objects_v2(Bucket=bucket_name, 
-                                    Prefix=subfolder_prefix)
+        # Fetch the list of documents stored under the subfolder in S3, in a worker thread so the event loop keeps serving other requests
+        response = await asyncio.to_thread(s3_client.list_objects_v2,
+                                           Bucket=bucket_name, 
+                                           Prefix=subfolder_prefix)
 
         # If documents exist in the specified subfolder, extract their names
         if 'Contents' in response:
@@ -374,34 +773,88 @@ async def generate_result_for_semantic_search(
     logging.info("user_query: ",user_query)
     logging.info("history_messages: ",history_messages)
 
-    if not history_messages:
-        standalone_query=user_query.content
-    else:
-        standalone_query=generate_standalone_query(
-            llm=llm,
-            user_query=user_query,
-            history_messages=history_messages
-        )
+    # Broad questions about the whole document are answered from its summary tree, nothing is retrieved for them
+    summary_nodes=await load_summary_nodes(user_query.content,f"{MAIN_TENANT}/{doc_name}",document_store)
     
-
-    result_summarized_response=await generate_summarized_response(
-            llm=llm,
+    standalone_query,similar_results,speculative_retrieval=await condense_and_retrieve(
+        user_query=user_query,
+        history_messages=history_messages,
+        retrieve=None if summary_nodes else functools.partial(
+            retrieve_summarization_candidates,
             embedding_model=embedding_model,
-            standalone_query=standalone_query,
             username=MAIN_TENANT,
-            history_messages=history_messages,
             doc_key=f"{MAIN_TENANT}/{doc_name}",
             top_k=8,
-            preferred_response_length=request.preferred_response_length,
-            pinecone_index=pinecone_index
+            pinecone_index=vector_store,
+            document_store=document_store,
+            keyword_index_store=keyword_index_store
+        )
     )
+    metadata={"speculative_retrieval":speculative_retrieval}
     
-    # cache the LLM response to Redis cache
-    try: 
-        await cache.set(key_redis,result_summarized_response,expire=600)
-        logging.info("cached LLM response")
-    except Exception as e:
-        logging.info("There is error with Redis server, can not cache LLM response")
+    # Reuse the answer of a similar past query on the same document, with the same response length
+    cached_answer,answer_cache_entry=await lookup_semantic_answer_cache(
+        doc_key=f"{MAIN_TENANT}/{doc_name}",
+        namespace=f"summarization:{request.preferred_response_length}",
+        standalone_query=standalone_query
+    )
+    if cached_answer is not None:
+        logging.info("semantic answer cache hit, immediately return response")
+        return cached_answer_response(cached_answer,request.stream)
+    
+    if request.stream:
+        return StreamingResponse(
+            stream_response_events(
+                stream_summarized_response(
+                    llm=llm,
+                    embedding_model=embedding_model,
+                    standalone_query=standalone_query,
+                    username=MAIN_TENANT,
+                    history_messages=history_messages,
+                    doc_key=f"{MAIN_TENANT}/{doc_name}",
+                    top_k=8,
+                    preferred_response_length=request.preferred_response_length,
+                    pinecone_index=vector_store,
+                    document_store=document_store,
+                    keyword_index_store=keyword_index_store,
+                    similar_results=similar_results,
+                    metadata=metadata
+                ),
+                on_complete=lambda response: cache_llm_response(cache,key_redis,response,answer_cache_entry),
+                metadata=metadata
+            ),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
+
+    async def compute_summarized_response():
+        result_summarized_response=await generate_summarized_response(
+                llm=llm,
+                embedding_model=embedding_model,
+                standalone_query=standalone_query,
+                username=MAIN_TENANT,
+                history_messages=history_messages,
+                doc_key=f"{MAIN_TENANT}/{doc_name}",
+                top_k=8,
+                preferred_response_length=request.preferred_response_length,
+                pinecone_index=vector_store,
+                document_store=document_store,
+                keyword_index_store=keyword_index_store,
+                similar_results=similar_results,
+                metadata=metadata
+        )
+        logging.info(f"query embedding cache stats: {embedding_model.stats()['query_cache']}")
+        
+        await cache_llm_response(cache,key_redis,result_summarized_response,answer_cache_entry)
+        
+        return result_summarized_response
+    
+    # identical queries in flight at the same time share one computation
+    result_summarized_response,single_flight_outcome=await coalesce_llm_response(
+        cache,key_redis,compute_summarized_response
+    )
+    metadata["single_flight"]=single_flight_outcome
+    logging.info(f"single-flight: {single_flight_outcome}")
     
-    return {"response":result_summarized_response}
+    return {"response":result_summarized_response,"metadata":metadata}
 
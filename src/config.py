@@ -13,4 +13,108 @@ MAIN_TENANT=os.getenv("MAIN_TENANT")
 SIMILARITY_SEARCH_THRESHOLD=float(os.getenv("SIMILARITY_SEARCH_THRESHOLD"))
 CLARITY_SCORE_FOR_READABILITY=int(os.getenv("CLARITY_SCORE_FOR_READABILITY"))
 PINECONE_API_KEY=os.getenv("PINECONE_API_KEY")
-PINECONE_INDEX=os.getenv("PINECONE_INDEX")
\ No newline at end of file
+PINECONE_INDEX=os.getenv("PINECONE_INDEX")
+
+# Batched embedding settings used during document indexing
+EMBEDDING_BATCH_SIZE=int(os.getenv("EMBEDDING_BATCH_SIZE",64))
+EMBEDDING_MAX_CONCURRENT_BATCHES=int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES",8))
+EMBEDDING_MAX_RETRIES=int(os.getenv("EMBEDDING_MAX_RETRIES",3))
+EMBEDDING_RETRY_BACKOFF_SECONDS=float(os.getenv("EMBEDDING_RETRY_BACKOFF_SECONDS",1.0))
+
+# Parallel PDF text extraction settings
+PDF_EXTRACTION_MAX_WORKERS=int(os.getenv("PDF_EXTRACTION_MAX_WORKERS",os.cpu_count() or 1))
+PDF_PARALLEL_EXTRACTION_MIN_PAGES=int(os.getenv("PDF_PARALLEL_EXTRACTION_MIN_PAGES",64))
+PDF_EXTRACTION_PAGES_PER_TASK=int(os.getenv("PDF_EXTRACTION_PAGES_PER_TASK",16))
+
+# Streaming ingestion pipeline settings
+INGESTION_QUEUE_SIZE=int(os.getenv("INGESTION_QUEUE_SIZE",8))
+PINECONE_UPSERT_BATCH_SIZE=int(os.getenv("PINECONE_UPSERT_BATCH_SIZE",100))
+PINECONE_MAX_CONCURRENT_UPSERTS=int(os.getenv("PINECONE_MAX_CONCURRENT_UPSERTS",30))
+
+# Background ingestion worker settings
+INGESTION_MAX_CONCURRENT_JOBS=int(os.getenv("INGESTION_MAX_CONCURRENT_JOBS",2))
+INGESTION_MAX_RETAINED_JOBS=int(os.getenv("INGESTION_MAX_RETAINED_JOBS",1000))
+
+# Incremental re-indexing settings
+PINECONE_DELETE_BATCH_SIZE=int(os.getenv("PINECONE_DELETE_BATCH_SIZE",1000))
+
+# Redis server shared by the response cache and the embedding cache
+REDIS_HOST=os.getenv("REDIS_HOST","redis" if os.getenv("HOSTNAME") else "localhost")
+REDIS_PORT=int(os.getenv("REDIS_PORT",6379))
+
+# Persistent embedding cache settings, the backend is one of "sqlite", "redis" or "none"
+EMBEDDING_CACHE_BACKEND=os.getenv("EMBEDDING_CACHE_BACKEND","sqlite")
+EMBEDDING_CACHE_PATH=os.getenv("EMBEDDING_CACHE_PATH","data/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_BYTES=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES",512*1024*1024))
+
+# Local store of chunk text, page and offsets, the vectors in Pinecone only carry ids and filter fields
+DOCUMENT_STORE_PATH=os.getenv("DOCUMENT_STORE_PATH","data/document_store.sqlite3")
+
+# Bulk upload settings
+BULK_UPLOAD_MAX_CONCURRENT_S3_UPLOADS=int(os.getenv("BULK_UPLOAD_MAX_CONCURRENT_S3_UPLOADS",4))
+
+# Vector store settings, the backend is one of "pinecone" or "local" (memory-mapped files, no network needed)
+VECTOR_STORE_BACKEND=os.getenv("VECTOR_STORE_BACKEND","pinecone")
+LOCAL_VECTOR_STORE_PATH=os.getenv("LOCAL_VECTOR_STORE_PATH","data/vector_store")
+
+# Compressed vectors of the local vector store, the quantization is one of "none", "int8" or "pq"
+LOCAL_VECTOR_STORE_QUANTIZATION=os.getenv("LOCAL_VECTOR_STORE_QUANTIZATION","none")
+LOCAL_VECTOR_STORE_PQ_SUBSPACES=int(os.getenv("LOCAL_VECTOR_STORE_PQ_SUBSPACES",96))
+LOCAL_VECTOR_STORE_RESCORE_FACTOR=int(os.getenv("LOCAL_VECTOR_STORE_RESCORE_FACTOR",10))
+
+# Query embedding cache settings, an in-process LRU in front of Redis
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES=int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES",10000))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS=int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS",7*24*3600))
+QUERY_EMBEDDING_CACHE_REDIS_ENABLED=os.getenv("QUERY_EMBEDDING_CACHE_REDIS_ENABLED","true").lower()=="true"
+
+# Hybrid BM25 and vector retrieval settings
+KEYWORD_INDEX_PATH=os.getenv("KEYWORD_INDEX_PATH","data/keyword_index")
+HYBRID_SEARCH_ENABLED=os.getenv("HYBRID_SEARCH_ENABLED","true").lower()=="true"
+HYBRID_SEARCH_CANDIDATES=int(os.getenv("HYBRID_SEARCH_CANDIDATES",20))
+RRF_K=int(os.getenv("RRF_K",60))
+# A passage that contains this share of the query terms, weighted by idf, is relevant whatever its similarity score
+KEYWORD_MATCH_THRESHOLD=float(os.getenv("KEYWORD_MATCH_THRESHOLD",0.8))
+
+# Maximal marginal relevance reranking of the summarization context
+MMR_ENABLED=os.getenv("MMR_ENABLED","true").lower()=="true"
+MMR_CANDIDATES=int(os.getenv("MMR_CANDIDATES",20))
+MMR_LAMBDA=float(os.getenv("MMR_LAMBDA",0.7))
+MMR_DUPLICATE_SIMILARITY=float(os.getenv("MMR_DUPLICATE_SIMILARITY",0.95))
+MMR_RELEVANCE_MARGIN=float(os.getenv("MMR_RELEVANCE_MARGIN",0.05))
+MMR_MAX_KEYWORD_MATCHES=int(os.getenv("MMR_MAX_KEYWORD_MATCHES",2))
+
+# Semantic answer cache settings, answers of past queries reused for similar queries on the same document
+SEMANTIC_ANSWER_CACHE_ENABLED=os.getenv("SEMANTIC_ANSWER_CACHE_ENABLED","true").lower()=="true"
+SEMANTIC_ANSWER_CACHE_PATH=os.getenv("SEMANTIC_ANSWER_CACHE_PATH","data/answer_cache.sqlite3")
+SEMANTIC_ANSWER_CACHE_THRESHOLD=float(os.getenv("SEMANTIC_ANSWER_CACHE_THRESHOLD",0.95))
+SEMANTIC_ANSWER_CACHE_MAX_ENTRIES=int(os.getenv("SEMANTIC_ANSWER_CACHE_MAX_ENTRIES",500))
+SEMANTIC_ANSWER_CACHE_TTL_SECONDS=int(os.getenv("SEMANTIC_ANSWER_CACHE_TTL_SECONDS",24*3600))
+
+# Standalone query condensation settings
+CONDENSATION_MODEL=os.getenv("CONDENSATION_MODEL","gpt-4o-mini")
+CONDENSATION_HEURISTIC_ENABLED=os.getenv("CONDENSATION_HEURISTIC_ENABLED","true").lower()=="true"
+CONDENSATION_CACHE_MAX_ENTRIES=int(os.getenv("CONDENSATION_CACHE_MAX_ENTRIES",10000))
+
+# Speculative retrieval on the raw user query while the standalone query is condensed
+SPECULATIVE_RETRIEVAL_ENABLED=os.getenv("SPECULATIVE_RETRIEVAL_ENABLED","true").lower()=="true"
+SPECULATIVE_RETRIEVAL_STRING_SIMILARITY=float(os.getenv("SPECULATIVE_RETRIEVAL_STRING_SIMILARITY",0.9))
+SPECULATIVE_RETRIEVAL_EMBEDDING_SIMILARITY=float(os.getenv("SPECULATIVE_RETRIEVAL_EMBEDDING_SIMILARITY",0.95))
+
+# Token budgets of the prompts, counted with the tokenizer of the chat model
+PROMPT_TOKEN_ENCODING=os.getenv("PROMPT_TOKEN_ENCODING","o200k_base")
+PROMPT_HISTORY_MAX_TOKENS=int(os.getenv("PROMPT_HISTORY_MAX_TOKENS",1000))
+PROMPT_CONTEXT_MAX_TOKENS=int(os.getenv("PROMPT_CONTEXT_MAX_TOKENS",3000))
+
+# Single-flight coalescing of identical in-flight queries, within a worker and across workers through a Redis lock
+SINGLE_FLIGHT_ENABLED=os.getenv("SINGLE_FLIGHT_ENABLED","true").lower()=="true"
+SINGLE_FLIGHT_LOCK_TTL_MS=int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS",60000))
+SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS=float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS",30))
+SINGLE_FLIGHT_POLL_INTERVAL_SECONDS=float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL_SECONDS",0.1))
+
+# Hierarchical summaries of every document, built at ingestion and used for broad summarization queries
+SUMMARY_TREE_ENABLED=os.getenv("SUMMARY_TREE_ENABLED","true").lower()=="true"
+SUMMARY_MODEL=os.getenv("SUMMARY_MODEL","gpt-4o-mini")
+SUMMARY_SECTION_MAX_TOKENS=int(os.getenv("SUMMARY_SECTION_MAX_TOKENS",2000))
+SUMMARY_REDUCE_MAX_TOKENS=int(os.getenv("SUMMARY_REDUCE_MAX_TOKENS",4000))
+SUMMARY_RESPONSE_LENGTHS=os.getenv("SUMMARY_RESPONSE_LENGTHS","short,medium,long").split(",")
+SUMMARY_MAX_CONCURRENT_CALLS=int(os.getenv("SUMMARY_MAX_CONCURRENT_CALLS",4))
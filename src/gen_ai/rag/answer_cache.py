@@ -0,0 +1,183 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from src.config import (
+    SEMANTIC_ANSWER_CACHE_PATH,
+    SEMANTIC_ANSWER_CACHE_THRESHOLD,
+    SEMANTIC_ANSWER_CACHE_MAX_ENTRIES,
+    SEMANTIC_ANSWER_CACHE_TTL_SECONDS
+)
+
+
+class SemanticAnswerCache:
+    """Cache of past answers of every document, looked up by the similarity of the standalone queries.
+
+    A query whose embedding has a cosine similarity of at least `threshold` with
+    the embedding of a past query of the same document and namespace, such as
+    "semantic_search", gets the answer of that query, so paraphrases of a question
+    share one LLM call.
+
+    Every document and namespace keeps at most `max_entries` answers, the least
+    recently used are evicted first, and answers expire after `ttl_seconds`. The
+    answers of a document are dropped when it is re-indexed.
+
+    Entries are stored in SQLite, shared by the workers of a host. The embeddings
+    of a document are kept in memory as one matrix, reloaded when the version of
+    the document, bumped on every change by any worker, no longer matches.
+    """
+
+    def __init__(self,
+                 path: str = SEMANTIC_ANSWER_CACHE_PATH,
+                 threshold: float = SEMANTIC_ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = SEMANTIC_ANSWER_CACHE_TTL_SECONDS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], tuple] = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, doc_key TEXT NOT NULL, namespace TEXT NOT NULL, "
+            "query TEXT NOT NULL, embedding BLOB NOT NULL, answer TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used_at REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS answers_doc_key ON answers (doc_key, namespace)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions (doc_key TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        self._connection.commit()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache."""
+
+        total = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def _bump_version(self, doc_key: str) -> None:
+        self._connection.execute(
+            "INSERT INTO versions (doc_key, version) VALUES (?, 1) "
+            "ON CONFLICT (doc_key) DO UPDATE SET version = version + 1", (doc_key,))
+
+    def _load_entries(self, doc_key: str, namespace: str) -> tuple:
+        # Returns the version, ids, normalized embeddings, answers and creation times of a document, reloaded when changed
+        row = self._connection.execute(
+            "SELECT version FROM versions WHERE doc_key = ?", (doc_key,)).fetchone()
+        version = row[0] if row else 0
+
+        cached = self._entries.get((doc_key, namespace))
+
+        if cached is not None and cached[0] == version:
+            return cached
+
+        rows = self._connection.execute(
+            "SELECT id, embedding, answer, created_at FROM answers "
+            "WHERE doc_key = ? AND namespace = ?", (doc_key, namespace)).fetchall()
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        embeddings = np.array([np.frombuffer(row[1], dtype=np.float32) for row in rows], dtype=np.float32)
+        answers = [row[2] for row in rows]
+        created_at = np.array([row[3] for row in rows], dtype=np.float64)
+
+        entries = (version, ids, embeddings, answers, created_at)
+        self._entries[(doc_key, namespace)] = entries
+
+        return entries
+
+    def get(self,
+            doc_key: str,
+            namespace: str,
+            query_vector: List[float]) -> Optional[str]:
+        """Returns the answer of the most similar past query of the document, or None when none is similar enough.
+
+        Args:
+            doc_key (str): The document key.
+            namespace (str): The kind of answer, such as "semantic_search".
+            query_vector (List[float]): The embedding of the standalone query.
+
+        Returns:
+            Optional[str]: The cached answer, or None.
+        """
+
+        now = time.time()
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        with self._lock:
+            _, ids, embeddings, answers, created_at = self._load_entries(doc_key, namespace)
+
+            if len(ids):
+                similarities = embeddings @ query
+                # Expired answers are ignored until the next write purges them
+                similarities[created_at < now - self.ttl_seconds] = -1
+                best = int(similarities.argmax())
+
+                if similarities[best] >= self.threshold:
+                    self._connection.execute(
+                        "UPDATE answers SET last_used_at = ? WHERE id = ?", (now, int(ids[best])))
+                    self._connection.commit()
+                    self.hits += 1
+                    return answers[best]
+
+            self.misses += 1
+            return None
+
+    def put(self,
+            doc_key: str,
+            namespace: str,
+            query: str,
+            query_vector: List[float],
+            answer: str) -> None:
+        """Stores the answer of a query, then evicts expired and least recently used answers.
+
+        Args:
+            doc_key (str): The document key.
+            namespace (str): The kind of answer, such as "semantic_search".
+            query (str): The standalone query.
+            query_vector (List[float]): The embedding of the standalone query.
+            answer (str): The answer.
+        """
+
+        now = time.time()
+        embedding = np.asarray(query_vector, dtype=np.float32)
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO answers (doc_key, namespace, query, embedding, answer, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_key, namespace, query, embedding.tobytes(), answer, now, now))
+            self._connection.execute(
+                "DELETE FROM answers WHERE doc_key = ? AND namespace = ? AND created_at < ?",
+                (doc_key, namespace, now - self.ttl_seconds))
+            self._connection.execute(
+                "DELETE FROM answers WHERE id IN ("
+                "SELECT id FROM answers WHERE doc_key = ? AND namespace = ? "
+                "ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (doc_key, namespace, self.max_entries))
+            self._bump_version(doc_key)
+            self._connection.commit()
+
+    def invalidate(self, doc_key: str) -> None:
+        """Drops every answer of a document, called when it is re-indexed."""
+
+        with self._lock:
+            self._connection.execute("DELETE FROM answers WHERE doc_key = ?", (doc_key,))
+            self._bump_version(doc_key)
+            self._connection.commit()
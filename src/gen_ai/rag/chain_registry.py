@@ -0,0 +1,123 @@
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import threading
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import PromptTemplate
+
+from src.gen_ai.rag.prompt_template import (
+    CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE,
+    PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE,
+    SUMMARIZE_SIMILAR_PASSAGE_INTO_CONCISE_RESPONSE_TEMPLATE,
+    LLM_GENERATED_SUMMARY_FALLBACK,
+    SUMMARIZE_DOCUMENT_SECTION_TEMPLATE,
+    COMBINE_SECTION_SUMMARIES_TEMPLATE,
+    SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE
+)
+
+
+PROMPT_TEMPLATES = (
+    CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE,
+    PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE,
+    SUMMARIZE_SIMILAR_PASSAGE_INTO_CONCISE_RESPONSE_TEMPLATE,
+    LLM_GENERATED_SUMMARY_FALLBACK,
+    SUMMARIZE_DOCUMENT_SECTION_TEMPLATE,
+    COMBINE_SECTION_SUMMARIES_TEMPLATE,
+    SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE
+)
+
+
+class PromptChain:
+    """A compiled prompt and the chat model it is sent to, whose output is the text of the response.
+
+    It does what a prompt | llm | StrOutputParser() pipeline does, but calls the
+    chat model directly: a RunnableSequence sets up callbacks and a run for
+    every step, which costs more per request than the formatting itself.
+    """
+
+    def __init__(self, prompt: PromptTemplate, llm: BaseChatModel):
+        self.prompt = prompt
+        self.llm = llm
+
+    async def ainvoke(self, inputs: dict) -> str:
+        """Returns the response of the chat model to the prompt filled with `inputs`."""
+
+        message = await self.llm.ainvoke(self.prompt.format_prompt(**inputs))
+
+        return message.content
+
+    async def astream(self, inputs: dict) -> AsyncIterator[str]:
+        """Yields the pieces of the response of the chat model to the prompt filled with `inputs`."""
+
+        async for chunk in self.llm.astream(self.prompt.format_prompt(**inputs)):
+            yield chunk.content
+
+    def batch(self, inputs: List[dict], max_concurrency: Optional[int] = None) -> List[str]:
+        """Returns the responses to the prompt filled with every item of `inputs`, for callers outside the event loop."""
+
+        messages = self.llm.batch(
+            [self.prompt.format_prompt(**item) for item in inputs],
+            config={"max_concurrency": max_concurrency})
+
+        return [message.content for message in messages]
+
+
+class ChainRegistry:
+    """Prompt templates compiled once, and their chains with every chat model.
+
+    The templates are parsed when the registry is created, and the chain of a
+    template and an LLM is built on first use, or up front with `prepare`, then
+    reused by every request. Chains hold no per-request state, so one chain
+    serves concurrent requests.
+    """
+
+    def __init__(self, templates: Iterable[str] = PROMPT_TEMPLATES):
+        self._prompts: Dict[str, PromptTemplate] = {
+            template: PromptTemplate.from_template(template) for template in templates
+        }
+        self._chains: Dict[Tuple[str, int], PromptChain] = {}
+        self._lock = threading.Lock()
+
+    def prompt(self, template: str) -> PromptTemplate:
+        """Returns the compiled prompt of a template, compiled now when not registered yet."""
+
+        prompt = self._prompts.get(template)
+
+        if prompt is None:
+            with self._lock:
+                prompt = self._prompts.setdefault(template, PromptTemplate.from_template(template))
+
+        return prompt
+
+    def chain(self, template: str, llm: BaseChatModel) -> PromptChain:
+        """Returns the chain of a template and a chat model.
+
+        Args:
+            template (str): The prompt template.
+            llm (BaseChatModel): The chat model.
+
+        Returns:
+            PromptChain: The chain, from the values of the template variables to the response text.
+        """
+
+        key = (template, id(llm))
+        chain = self._chains.get(key)
+
+        # the chain holds its LLM, so a reused id of a collected LLM is never matched
+        if chain is not None and chain.llm is llm:
+            return chain
+
+        chain = PromptChain(self.prompt(template), llm)
+
+        with self._lock:
+            self._chains[key] = chain
+
+        return chain
+
+    def prepare(self, llm: BaseChatModel, templates: Optional[Iterable[str]] = None) -> None:
+        """Builds the chains of an LLM up front, for all the registered templates by default."""
+
+        for template in templates if templates is not None else list(self._prompts):
+            self.chain(template, llm)
+
+
+chain_registry = ChainRegistry()
@@ -1,61 +1,104 @@
-from typing import List
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import difflib
 import logging
-import textstat
-from langchain.memory import ChatMessageHistory
-from langchain_core.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import numpy as np
 from langchain.embeddings import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 from pinecone import Index
 
 from src.gen_ai.rag.pinecone_operation import (
-    retrieve_top_k_similar_search_from_vector_db
+    aretrieve_top_k_similar_search_from_vector_db
+)
+from src.gen_ai.rag.reranking import (
+    select_diverse_matches
+)
+from src.gen_ai.rag.chain_registry import (
+    chain_registry
+)
+from src.gen_ai.rag.prompt_budget import (
+    assemble_chat_history,
+    assemble_context,
+    token_counter
+)
+from src.gen_ai.rag.readability import (
+    chunk_readability,
+    flesch_reading_ease
+)
+from src.gen_ai.rag.summary_tree import (
+    DOCUMENT,
+    is_broad_summary_query,
+    top_summary_nodes
+)
+from src.gen_ai.rag.query_condensation import (
+    CondensationCache,
+    condensation_cache_key,
+    is_self_contained
 )
 from src.gen_ai.rag.prompt_template import (
     CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE,
     PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE,
     SUMMARIZE_SIMILAR_PASSAGE_INTO_CONCISE_RESPONSE_TEMPLATE,
-    LLM_GENERATED_SUMMARY_FALLBACK
+    LLM_GENERATED_SUMMARY_FALLBACK,
+    SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE
 )
 from src.models.requests import (
     SingleChatMessageRequest
 )
 from src.config import (
     CLARITY_SCORE_FOR_READABILITY,
-    SIMILARITY_SEARCH_THRESHOLD
+    SIMILARITY_SEARCH_THRESHOLD,
+    KEYWORD_MATCH_THRESHOLD,
+    MMR_ENABLED,
+    MMR_CANDIDATES,
+    CONDENSATION_HEURISTIC_ENABLED,
+    SPECULATIVE_RETRIEVAL_STRING_SIMILARITY,
+    SPECULATIVE_RETRIEVAL_EMBEDDING_SIMILARITY,
+    SUMMARY_TREE_ENABLED
 )
 
 
-def format_chat_history(
-    chat_history: List[SingleChatMessageRequest]
-) -> ChatMessageHistory:
-    """Converts chat history from ChatbotSingleMessage to ChatMessageHistory for usage with langchain
+def build_prompt_inputs(
+        standalone_query: str,
+        history_messages: List[SingleChatMessageRequest],
+        similar_results: Optional[list],
+        metadata: Optional[dict]=None) -> dict:
+    """
+    Builds the values of a prompt template, the history and the context packed within their token budgets.
 
     Args:
-        chat_history (List[SingleChatMessageRequest]): Previous chat history containing sender and content
+        standalone_query (str): user standalone query
+        history_messages (List[SingleChatMessageRequest]): history messages
+        similar_results (list, optional): retrieved matches, best first
+        metadata (dict, optional): details of the request, the token counts of the prompt are added to it
 
     Returns:
-        ChatMessageHistory: Formatted chat history compatible with LangChain
+        dict: the "context", "chat_history" and "question" values
     """
     
-    chat_history_formatted = ChatMessageHistory()
+    chat_history,history_tokens,num_history_messages=assemble_chat_history(history_messages)
+    context,context_tokens,num_passages=assemble_context(similar_results or [])
     
-    for message in chat_history:
-        if message.role == "user":
-            chat_history_formatted.add_user_message(message.content)
-        elif message.role == "assistant":
-            # revert output format
-            chat_history_formatted.add_ai_message(
-                message=message.content
-            )
-        else:
-            logging.info("sender of this message is not valid")
-            
-    logging.info("chat_history_formatted: ",chat_history_formatted)
+    prompt_tokens={
+        "question": token_counter.count(standalone_query),
+        "history": history_tokens,
+        "context": context_tokens,
+        "history_messages_dropped": len(history_messages)-num_history_messages,
+        "passages_dropped": len(similar_results or [])-num_passages
+    }
+    logging.info(f"prompt tokens: {prompt_tokens}")
+    
+    if metadata is not None:
+        metadata["prompt_tokens"]=prompt_tokens
+    
+    return {
+        "context": context,
+        "chat_history": chat_history,
+        "question": standalone_query,
+    }
 
-    return chat_history_formatted
 
-def generate_standalone_query(
+async def generate_standalone_query(
         llm: ChatOpenAI,
         user_query: SingleChatMessageRequest,
         history_messages: List[SingleChatMessageRequest]) -> str:
@@ -73,25 +116,245 @@ def generate_standalone_query(
     
     logging.info("inside generate_standalone_query")
     
-    formatted_chat_history=format_chat_history(
-        chat_history=history_messages
-    )
+    # only the most recent messages that fit in the history token budget
+    formatted_chat_history,_,_=assemble_chat_history(history_messages)
     
     logging.info("formatted_chat_history: ",formatted_chat_history)
 
-    question_generator_template = PromptTemplate.from_template(
-        CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE
+    # the prompt | llm | parser pipeline is built once and reused by every request
+    chain = chain_registry.chain(CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE, llm)
+
+    standalone_query=await chain.ainvoke(
+        {"chat_history": formatted_chat_history,"question":user_query.content}
     )
 
-    chain = LLMChain(llm=llm, prompt=question_generator_template)
+    logging.info("standalone_query: ",standalone_query)
+
+    return standalone_query
+
+
+async def condense_query(
+        llm: ChatOpenAI,
+        user_query: SingleChatMessageRequest,
+        history_messages: List[SingleChatMessageRequest],
+        condensation_cache: CondensationCache = None) -> str:
+    """
+    Returns the standalone query of a user query, calling the LLM only when the query may refer back to the conversation.
+
+    The query is used as is when there is no history or when `is_self_contained` finds 
+    no reference to earlier turns. Otherwise the standalone query is memoized by a hash 
+    of the history and the query, so a retried or repeated request does not call the LLM again.
+
+    Args:
+        llm (ChatOpenAI): large language model used for condensation, a light model is enough
+        user_query (SingleChatMessageRequest): user query
+        history_messages (List[SingleChatMessageRequest]): history of messages
+        condensation_cache (CondensationCache, optional): cache of past standalone queries
 
-    response=chain(
-        {"chat_history": format_chat_history,"question":user_query}, return_only_outputs=True
+    Returns:
+        str: user standalone query
+    """
+    
+    if not history_messages:
+        return user_query.content
+    
+    if CONDENSATION_HEURISTIC_ENABLED and is_self_contained(user_query.content):
+        logging.info("user query is self-contained, skip condensation")
+        return user_query.content
+    
+    key=condensation_cache_key(history_messages,user_query.content)
+    
+    if condensation_cache is not None:
+        standalone_query=condensation_cache.get(key)
+        
+        if standalone_query is not None:
+            logging.info("condensation cache hit")
+            return standalone_query
+    
+    standalone_query=await generate_standalone_query(
+        llm=llm,
+        user_query=user_query,
+        history_messages=history_messages
     )
+    
+    if condensation_cache is not None:
+        condensation_cache.set(key,standalone_query)
+    
+    return standalone_query
+
+
+async def is_similar_query(
+        query: str,
+        other_query: str,
+        embedding_model: OpenAIEmbeddings) -> bool:
+    """
+    Tells whether two queries are close enough to share their retrieval results.
+
+    The queries are first compared as strings, and only when they differ more than 
+    SPECULATIVE_RETRIEVAL_STRING_SIMILARITY by the cosine similarity of their embeddings.
 
-    logging.info("standalone_query: ",response['text'])
+    Args:
+        query (str): a query
+        other_query (str): the query to compare it to
+        embedding_model (OpenAIEmbeddings): embedding model
+
+    Returns:
+        bool: True when the queries are similar
+    """
+    
+    string_similarity=difflib.SequenceMatcher(None,query.lower(),other_query.lower()).ratio()
+    
+    if string_similarity >= SPECULATIVE_RETRIEVAL_STRING_SIMILARITY:
+        return True
+    
+    # both embeddings are needed anyway, they are served from the query embedding cache afterwards
+    query_vector,other_query_vector=await asyncio.gather(
+        embedding_model.aembed_query(query),
+        embedding_model.aembed_query(other_query)
+    )
+    query_vector=np.asarray(query_vector)
+    other_query_vector=np.asarray(other_query_vector)
+    
+    embedding_similarity=float(query_vector @ other_query_vector) / max(
+        float(np.linalg.norm(query_vector) * np.linalg.norm(other_query_vector)), 1e-12)
+    
+    logging.info(f"standalone query similarity: string {string_similarity:.3f}, embedding {embedding_similarity:.3f}")
+    
+    return embedding_similarity >= SPECULATIVE_RETRIEVAL_EMBEDDING_SIMILARITY
 
-    return response['text']
+
+async def condense_query_with_speculative_retrieval(
+        llm: ChatOpenAI,
+        user_query: SingleChatMessageRequest,
+        history_messages: List[SingleChatMessageRequest],
+        retrieve: Callable[[str], Awaitable[list]],
+        embedding_model: OpenAIEmbeddings,
+        condensation_cache: CondensationCache = None) -> Tuple[str, Optional[list], str]:
+    """
+    Condenses the user query while the retrieval for the raw user query runs speculatively.
+
+    When the standalone query is the user query, or close to it, the speculative results 
+    are returned, otherwise they are discarded and the caller retrieves for the standalone query.
+
+    Args:
+        llm (ChatOpenAI): large language model used for condensation
+        user_query (SingleChatMessageRequest): user query
+        history_messages (List[SingleChatMessageRequest]): history of messages
+        retrieve (Callable[[str], Awaitable[list]]): retrieves the matches of a query
+        embedding_model (OpenAIEmbeddings): embedding model, to compare the queries
+        condensation_cache (CondensationCache, optional): cache of past standalone queries
+
+    Returns:
+        Tuple[str, Optional[list], str]: the standalone query, its matches or None when they still have 
+            to be retrieved, and the outcome of the speculation: "not_needed" when the user query was used 
+            as is, "hit" when the speculative results are reused and "miss" otherwise
+    """
+    
+    speculative_retrieval=asyncio.create_task(retrieve(user_query.content))
+    
+    try:
+        standalone_query=await condense_query(
+            llm=llm,
+            user_query=user_query,
+            history_messages=history_messages,
+            condensation_cache=condensation_cache
+        )
+        
+        if standalone_query == user_query.content:
+            speculation="not_needed"
+        elif await is_similar_query(standalone_query,user_query.content,embedding_model):
+            speculation="hit"
+        else:
+            speculation="miss"
+    except Exception:
+        speculative_retrieval.cancel()
+        raise
+    
+    similar_results=None
+    
+    if speculation == "miss":
+        speculative_retrieval.cancel()
+    else:
+        try:
+            similar_results=await speculative_retrieval
+        except Exception as e:
+            logging.warning(f"speculative retrieval failed, retrieve again: {e}")
+            speculation="miss"
+    
+    logging.info(f"speculative retrieval: {speculation}")
+    
+    return standalone_query,similar_results,speculation
+
+
+async def retrieve_semantic_search_context(
+        query: str,
+        embedding_model: OpenAIEmbeddings,
+        username: str,
+        doc_key: str,
+        top_k: int,
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None) -> list:
+    """Retrieves the passages a semantic search answer is based on, see `stream_semantic_search_response` for the arguments."""
+    
+    # Retrieve the top-k most similar search results from the vector database
+    return await aretrieve_top_k_similar_search_from_vector_db(
+        username=username,
+        doc_key=doc_key,
+        query=query,
+        top_k=top_k,
+        embedding_model=embedding_model,
+        pinecone_index=pinecone_index,
+        document_store=document_store,
+        keyword_index_store=keyword_index_store
+    )
+
+
+async def retrieve_summarization_candidates(
+        query: str,
+        embedding_model: OpenAIEmbeddings,
+        username: str,
+        doc_key: str,
+        top_k: int,
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None) -> list:
+    """Retrieves the candidate passages of a summary before reranking, see `stream_summarized_response` for the arguments."""
+    
+    # Retrieve a wider set of candidates with their vectors from the vector database, the reranking keeps at most top-k of them
+    return await aretrieve_top_k_similar_search_from_vector_db(
+        username=username,
+        doc_key=doc_key,
+        query=query,
+        top_k=max(top_k,MMR_CANDIDATES) if MMR_ENABLED else top_k,
+        embedding_model=embedding_model,
+        pinecone_index=pinecone_index,
+        document_store=document_store,
+        keyword_index_store=keyword_index_store,
+        include_values=MMR_ENABLED
+    )
+
+
+async def stream_llm_response(
+        llm: ChatOpenAI,
+        template: str,
+        inputs: dict) -> AsyncIterator[str]:
+    """
+    Streams the response of the LLM to a prompt template, as the tokens are generated.
+
+    Args:
+        llm (ChatOpenAI): large language model
+        template (str): prompt template
+        inputs (dict): values of the template variables
+
+    Yields:
+        str: the next piece of the response
+    """
+    
+    chain = chain_registry.chain(template, llm)
+    
+    async for token in chain.astream(inputs):
+        yield token
 
 
 async def generate_semantic_search_response(
@@ -102,10 +365,57 @@ async def generate_semantic_search_response(
         history_messages: List[SingleChatMessageRequest],
         doc_key: str,
         top_k: int,
-        pinecone_index
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        similar_results: Optional[list]=None,
+        metadata: Optional[dict]=None
 ) -> str:
     """ Generates a semantic search response based on a user query and relevant document context using LLM
 
+    Collects the pieces of `stream_semantic_search_response`, see it for the arguments.
+
+    Returns:
+        str: result for semantic search
+    """
+    
+    pieces=[]
+    
+    async for piece in stream_semantic_search_response(
+        llm=llm,
+        embedding_model=embedding_model,
+        standalone_query=standalone_query,
+        username=username,
+        history_messages=history_messages,
+        doc_key=doc_key,
+        top_k=top_k,
+        pinecone_index=pinecone_index,
+        document_store=document_store,
+        keyword_index_store=keyword_index_store,
+        similar_results=similar_results,
+        metadata=metadata
+    ):
+        pieces.append(piece)
+    
+    return "".join(pieces)
+
+
+async def stream_semantic_search_response(
+        llm: ChatOpenAI,
+        embedding_model: OpenAIEmbeddings,
+        standalone_query: str,
+        username: str,
+        history_messages: List[SingleChatMessageRequest],
+        doc_key: str,
+        top_k: int,
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        similar_results: Optional[list]=None,
+        metadata: Optional[dict]=None
+) -> AsyncIterator[str]:
+    """ Streams a semantic search response based on a user query and relevant document context using LLM
+
 
     Args:
         llm (ChatOpenAI): large language model
@@ -116,33 +426,42 @@ async def generate_semantic_search_response(
         doc_key (str): unique document key
         top_k (int): k most similar documents in vector db
         pinecone_index (Index): index that host the vector db
+        document_store (DocumentStore, optional): local store that holds the text of the chunks
+        keyword_index_store (KeywordIndexStore, optional): BM25 keyword indexes fused with the vector search
+        similar_results (list, optional): matches already retrieved for the query, such as by speculative retrieval
+        metadata (dict, optional): details of the request, the token counts of the prompt are added to it
 
-    Returns:
-        str: result for semantic search
+    Yields:
+        str: the next piece of the result for semantic search, the LLM response is streamed token by token
     """
     
     logging.info("inside_generate_system_respons")
     
-    # Retrieve the top-k (k=1 in this case) most similar search results from the vector database
-    similar_results=retrieve_top_k_similar_search_from_vector_db(
-        username=username,
-        doc_key=doc_key,
-        query=standalone_query,
-        top_k=top_k,
-        embedding_model=embedding_model,
-        pinecone_index=pinecone_index
-    )
-    
-    all_texts=None
+    # Retrieve the top-k most similar search results from the vector database, unless they were already retrieved
+    if similar_results is None:
+        similar_results=await retrieve_semantic_search_context(
+            query=standalone_query,
+            embedding_model=embedding_model,
+            username=username,
+            doc_key=doc_key,
+            top_k=top_k,
+            pinecone_index=pinecone_index,
+            document_store=document_store,
+            keyword_index_store=keyword_index_store
+        )
     
     # if top similar passage is retrieved succesfully
     if similar_results: 
         logging.info("similar_results: ",similar_results)
         
-        # Extract similarity score of the top retrieved result
-        similarity_score=similar_results[0]['score']
+        # Extract the best similarity score of the retrieved results, passages only found by keyword search have no similarity score
+        similarity_score=max((chunk['score'] for chunk in similar_results if chunk['score'] is not None),default=0.0)
         logging.info("similarity score ",similarity_score)
         
+        # Extract the best keyword coverage, an exact match of the query terms such as an identifier the embedding does not capture
+        keyword_coverage=max((chunk.get('keyword_coverage',0.0) for chunk in similar_results),default=0.0)
+        logging.info("keyword coverage ",keyword_coverage)
+        
         # Extract the text content from the retrieved search results
         all_texts=[chunk['metadata']['text'] for chunk in similar_results]
         logging.info("all_texts: ",all_texts)
@@ -151,69 +470,106 @@ async def generate_semantic_search_response(
         logging.info("SIMILARITY_SEARCH_THRESHOLD: ",SIMILARITY_SEARCH_THRESHOLD)
         logging.info("CLARITY_SCORE_FOR_READABILITY: ",CLARITY_SCORE_FOR_READABILITY)
         
-        # if similarity score of the most similar passage is higher than our predefined threshold, we found the relevant passage containing information for semantic search
-        if similarity_score >= SIMILARITY_SEARCH_THRESHOLD:
+        # if similarity score of the most similar passage is higher than our predefined threshold, or a passage matches the query terms exactly, 
+        # we found the relevant passage containing information for semantic search
+        if similarity_score >= SIMILARITY_SEARCH_THRESHOLD or keyword_coverage >= KEYWORD_MATCH_THRESHOLD:
             
-            # we then compute the clarity score using textstat library to see if the retrieved passage is easy to read for user
-            clarity_score=textstat.flesch_reading_ease(" ".join(all_texts))
+            # we then compute the clarity score of the retrieved passages to see if they are easy to read for user,
+            # from the word, sentence and syllable counts stored with every chunk at indexing time
+            if all(chunk['metadata'].get('readability') is not None for chunk in similar_results):
+                clarity_score=flesch_reading_ease([chunk_readability(chunk) for chunk in similar_results])
+            else:
+                # chunks indexed before the counts were stored are counted now, in a worker thread as syllable counting is CPU bound
+                clarity_score=await asyncio.to_thread(
+                    lambda: flesch_reading_ease([chunk_readability(chunk) for chunk in similar_results]))
             
             logging.info("clarity_score: ",clarity_score)
             
             # if the clarity score is less than our predefine threshold, we ask LLM to rephrase to add clarity 
             if clarity_score < CLARITY_SCORE_FOR_READABILITY:
                 
-                formatted_chat_history=format_chat_history(
-                    chat_history=history_messages
-                )
-
-                chat_template = PromptTemplate.from_template(PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE)
-                
-                chain = LLMChain(llm=llm, prompt=chat_template)
-                
-                result = chain(
-                    {
-                        "context": all_texts,
-                        "chat_history": formatted_chat_history,
-                        "question": standalone_query,
-                    },
-                    return_only_outputs=True
-                )
-                
-                logging.info("result_semantic_search: ",result['text'])
-
-                return result['text']
+                async for token in stream_llm_response(
+                    llm,
+                    PERFORM_SEMANTIC_SEARCH_WITH_CONTEXT_TEMPLATE,
+                    build_prompt_inputs(standalone_query,history_messages,similar_results,metadata)
+                ):
+                    yield token
+
+                return
         
             else:
                 # otherwise the passage is clear and readable, we straight away return response to user without making LLM call
-                return " ".join(all_texts)
+                yield " ".join(all_texts)
+                return
             
 
     # if similarity score of the most similar passage is less than our predefined threshold, implying that we can not find relavant information in our document to answer user query,so we will use fallback LLM-generated summary 
     logging.info("No relavant passage is found based on user query")
     logging.info("Trigger fallback LLM-generated summary")
     
-    formatted_chat_history=format_chat_history(
-            chat_history=history_messages
-    )
-
-    chat_template = PromptTemplate.from_template(LLM_GENERATED_SUMMARY_FALLBACK)
+    async for token in stream_llm_response(
+        llm,
+        LLM_GENERATED_SUMMARY_FALLBACK,
+        build_prompt_inputs(standalone_query,history_messages,similar_results,metadata)
+    ):
+        yield token
     
-    chain = LLMChain(llm=llm, prompt=chat_template)
-    
-    result = chain(
-        {
-            "context": all_texts if all_texts else "",
-            "chat_history": formatted_chat_history,
-            "question": standalone_query,
-        },
-        return_only_outputs=True
-    )
     
-    logging.info("result_semantic_search_fall_back: ",result['text'])
+async def stream_summary_tree_response(
+        llm: ChatOpenAI,
+        summary_nodes: List[dict],
+        preferred_response_length: str,
+        metadata: Optional[dict]=None
+) -> AsyncIterator[str]:
+    """
+    Streams the summary of a whole document from its precomputed summary tree.
+
+    The document summary of the preferred response length is returned as is, for other 
+    lengths the LLM writes one from the top level of the tree, the summaries the stored 
+    document summaries were written from, which cover the whole document within the 
+    reduce token budget.
 
-    return result['text']
+    Args:
+        llm (ChatOpenAI): large language model
+        summary_nodes (List[dict]): nodes of the summary tree of the document
+        preferred_response_length (str): user preffered length of response
+        metadata (dict, optional): details of the request, the source of the summary is added to it
+
+    Yields:
+        str: the next piece of the summary
+    """
+    
+    response_length=(preferred_response_length or "").strip().lower()
+    
+    for node in summary_nodes:
+        if node["level"] == DOCUMENT and node["response_length"].strip().lower() == response_length:
+            logging.info(f"precomputed {response_length} document summary")
+            
+            if metadata is not None:
+                metadata["summary_source"]="document_summary"
+            
+            yield node["text"]
+            return
     
+    if metadata is not None:
+        metadata["summary_source"]="section_summaries"
     
+    # The top level covers the whole document within the reduce budget, packing the sections in the context budget would drop its end
+    top_nodes=top_summary_nodes(summary_nodes)
+    context="\n\n".join(node["text"] for node in top_nodes)
+    logging.info(f"summarizing the document from {len(top_nodes)} top level summaries")
+
+    async for token in stream_llm_response(
+        llm,
+        SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE,
+        {
+            "text": context,
+            "preferred_response_length": preferred_response_length
+        }
+    ):
+        yield token
+
+
 async def generate_summarized_response(
         llm: ChatOpenAI,
         embedding_model: OpenAIEmbeddings,
@@ -223,10 +579,84 @@ async def generate_summarized_response(
         doc_key: str,
         top_k: int,
         preferred_response_length: str,
-        pinecone_index
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        similar_results: Optional[list]=None,
+        metadata: Optional[dict]=None
 ):
     """  Generates a summarized response based on a user query and relevant document context.
 
+    Collects the pieces of `stream_summarized_response`, see it for the arguments.
+
+    Returns:
+        str: the summarized response from LLM
+    """
+    
+    pieces=[]
+    
+    async for piece in stream_summarized_response(
+        llm=llm,
+        embedding_model=embedding_model,
+        standalone_query=standalone_query,
+        username=username,
+        history_messages=history_messages,
+        doc_key=doc_key,
+        top_k=top_k,
+        preferred_response_length=preferred_response_length,
+        pinecone_index=pinecone_index,
+        document_store=document_store,
+        keyword_index_store=keyword_index_store,
+        similar_results=similar_results,
+        metadata=metadata
+    ):
+        pieces.append(piece)
+    
+    return "".join(pieces)
+
+
+async def load_summary_nodes(query: str,
+                             doc_key: str,
+                             document_store=None) -> list:
+    """Returns the summary tree of the document when it answers the query, an empty list when retrieval does.
+
+    Only broad questions about the whole document are answered from the summary tree, 
+    so no retrieval is needed for them.
+
+    Args:
+        query (str): the user or standalone query
+        doc_key (str): unique document key
+        document_store (DocumentStore, optional): local store that holds the summaries
+
+    Returns:
+        list: the summary nodes of the document, or an empty list
+    """
+    
+    if not SUMMARY_TREE_ENABLED or document_store is None or not is_broad_summary_query(query):
+        return []
+    
+    return await asyncio.to_thread(document_store.get_summaries,doc_key)
+
+
+async def stream_summarized_response(
+        llm: ChatOpenAI,
+        embedding_model: OpenAIEmbeddings,
+        standalone_query: str,
+        username: str,
+        history_messages: List[SingleChatMessageRequest],
+        doc_key: str,
+        top_k: int,
+        preferred_response_length: str,
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        similar_results: Optional[list]=None,
+        metadata: Optional[dict]=None
+) -> AsyncIterator[str]:
+    """  Streams a summarized response based on a user query and relevant document context.
+
+    Broad questions about the whole document are answered from its summary tree, when it has one.
+
 
     Args:
         llm (ChatOpenAI): large language model
@@ -235,53 +665,61 @@ async def generate_summarized_response(
         username (str): username must be unique
         history_messages (List[SingleChatMessageRequest]): history messages between user and system
         doc_key (str): unique document key
-        top_k (int): k most similar documents in vector db
+        top_k (int): maximum number of passages sent to the LLM, fewer when the most relevant ones are near duplicates
         preferred_response_length (str): user preffered length of response
+        document_store (DocumentStore, optional): local store that holds the text of the chunks
+        keyword_index_store (KeywordIndexStore, optional): BM25 keyword indexes fused with the vector search
+        similar_results (list, optional): matches already retrieved for the query, such as by speculative retrieval
+        metadata (dict, optional): details of the request, the token counts of the prompt are added to it
 
-    Returns:
-        str: the summarized response from LLM
+    Yields:
+        str: the next piece of the summarized response from LLM, as the tokens are generated
     """
     
     logging.info("inside_generate_summarized_response")
     
-    # Retrieve the top-k (k=5 in this case) most similar search results from the vector database
-    similar_results=retrieve_top_k_similar_search_from_vector_db(
-        username=username,
-        doc_key=doc_key,
-        query=standalone_query,
-        top_k=top_k,
-        embedding_model=embedding_model,
-        pinecone_index=pinecone_index
-    )
-
-    logging.info("similar_results: ",similar_results)
+    # Answer broad questions about the whole document from its summary tree, built once at ingestion
+    summary_nodes=await load_summary_nodes(standalone_query,doc_key,document_store)
     
-    # Extract the text content from the retrieved search results
-    all_texts=[chunk['metadata']['text'] for chunk in similar_results]
-    logging.info("all_texts: ",all_texts)
+    if summary_nodes:
+        async for token in stream_summary_tree_response(llm,summary_nodes,preferred_response_length,metadata):
+            yield token
+        return
     
-    formatted_chat_history=format_chat_history(
-        chat_history=history_messages
-    )
-
-    chat_template = PromptTemplate.from_template(SUMMARIZE_SIMILAR_PASSAGE_INTO_CONCISE_RESPONSE_TEMPLATE)
+    if metadata is not None:
+        metadata["summary_source"]="retrieval"
     
-    chain = LLMChain(llm=llm, prompt=chat_template)
+    # Retrieve the candidate passages, unless they were already retrieved
+    if similar_results is None:
+        similar_results=await retrieve_summarization_candidates(
+            query=standalone_query,
+            embedding_model=embedding_model,
+            username=username,
+            doc_key=doc_key,
+            top_k=top_k,
+            pinecone_index=pinecone_index,
+            document_store=document_store,
+            keyword_index_store=keyword_index_store
+        )
     
+    # Keep the smallest set of relevant passages that are not near duplicates of each other, such as overlapping chunks
+    if MMR_ENABLED:
+        num_candidates=len(similar_results)
+        similar_results=select_diverse_matches(similar_results,max_matches=top_k)
+        logging.info(f"reranking kept {len(similar_results)} of {num_candidates} passages")
 
-    result = chain(
-        {
-            "context": all_texts,
-            "chat_history": formatted_chat_history,
-            "question": standalone_query,
-            "preferred_response_length": preferred_response_length
-        },
-        return_only_outputs=True
-    )
+    logging.info("similar_results: ",similar_results)
     
-    logging.info("result_summary: ",result['text'])
-
-    return result['text']
+    # Pack the passages, best first, and the most recent history within their token budgets
+    inputs=build_prompt_inputs(standalone_query,history_messages,similar_results,metadata)
+    inputs["preferred_response_length"]=preferred_response_length
+
+    async for token in stream_llm_response(
+        llm,
+        SUMMARIZE_SIMILAR_PASSAGE_INTO_CONCISE_RESPONSE_TEMPLATE,
+        inputs
+    ):
+        yield token
 
 
    
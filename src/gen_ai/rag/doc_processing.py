@@ -1,67 +1,320 @@
 
 import os
 import fitz  # PyMuPDF
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
-from pinecone import Pinecone
 import itertools
+import functools
+import hashlib
+import json
 import logging
-from concurrent.futures import ProcessPoolExecutor
+import time
+import threading
+from bisect import bisect_right
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+import queue
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import multiprocessing
 
 from src.config import (
-    PINECONE_INDEX
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENT_BATCHES,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_BACKOFF_SECONDS,
+    PDF_EXTRACTION_MAX_WORKERS,
+    PDF_PARALLEL_EXTRACTION_MIN_PAGES,
+    PDF_EXTRACTION_PAGES_PER_TASK,
+    INGESTION_QUEUE_SIZE,
+    PINECONE_UPSERT_BATCH_SIZE,
+    PINECONE_MAX_CONCURRENT_UPSERTS,
+    PINECONE_DELETE_BATCH_SIZE
 )
+from src.gen_ai.rag.text_chunker import split_text_spans
+from src.gen_ai.rag.summary_tree import build_document_summaries
+from src.gen_ai.rag.readability import readability_counts
 
 
-def extract_text_from_pdf(
-    file_bytes: bytes):
-    """Extracts text content from a PDF file given its byte stream.
+# Marks the end of the items produced by a pipeline stage
+_END_OF_STAGE = object()
 
-    This function loads a PDF document from a byte stream and extracts text 
-    from all pages, concatenating them into a single string.
+# Worker processes for parallel PDF text extraction, created on first use and shared across uploads
+_pdf_extraction_pool = None
+_pdf_extraction_pool_lock = threading.Lock()
+
+
+def prefetch(iterable: Iterable,
+             max_size: int = INGESTION_QUEUE_SIZE) -> Iterator:
+    """
+    Runs an iterable in a background thread, at most `max_size` items ahead of the consumer.
+
+    This is the bounded queue between two stages of the ingestion pipeline: the 
+    producing stage keeps working while the consuming stage is busy, and blocks 
+    once the queue is full so memory use stays flat. Errors raised by the 
+    producing stage are re-raised in the consumer.
 
     Args:
-        file_bytes (bytes): The byte representation of the PDF file.
+        iterable (Iterable): The producing stage.
+        max_size (int, optional): The maximum number of items buffered. Default is INGESTION_QUEUE_SIZE.
+
+    Yields:
+        Any: The items of the iterable, in order.
+    """
+    
+    buffer = queue.Queue(maxsize=max_size)
+    stopped = threading.Event()
+    
+    def put(item) -> bool:
+        # Give up once the consumer has gone away, instead of blocking forever on a full queue
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END_OF_STAGE, None))
+        except BaseException as e:
+            put((_END_OF_STAGE, e))
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    try:
+        while True:
+            item, error = buffer.get()
+            
+            if item is _END_OF_STAGE:
+                if error is not None:
+                    raise error
+                return
+            
+            yield item
+    finally:
+        stopped.set()
+
+
+def map_in_order(function,
+                 iterable: Iterable,
+                 max_in_flight: int,
+                 executor: Optional[Executor] = None) -> Iterator:
+    """
+    Applies a function to every item of an iterable concurrently, yielding results in input order.
+
+    At most `max_in_flight` items are being processed at once, the next item is 
+    only pulled from the iterable when a result has been handed to the consumer.
+
+    Args:
+        function (Callable): The function applied to every item.
+        iterable (Iterable): The input items.
+        max_in_flight (int): The maximum number of items processed at once.
+        executor (Optional[Executor], optional): The executor running the function. 
+            Default is None, which runs the function on a dedicated thread pool.
+
+    Yields:
+        Any: The result of the function for every item, in input order.
+    """
+    
+    items = iter(iterable)
+    max_in_flight = max(1, max_in_flight)
+    owns_executor = executor is None
+    
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    
+    in_flight = deque(executor.submit(function, item) for item in itertools.islice(items, max_in_flight))
+    
+    try:
+        while in_flight:
+            result = in_flight.popleft().result()
+            
+            for item in itertools.islice(items, 1):
+                in_flight.append(executor.submit(function, item))
+            
+            yield result
+    finally:
+        # Do not start the items still waiting in the queue once the consumer stopped or one item failed
+        for future in in_flight:
+            future.cancel()
+        
+        if owns_executor:
+            executor.shutdown(wait=False)
+
+
+def get_pdf_extraction_pool() -> ProcessPoolExecutor:
+    """Returns the process pool used for parallel PDF text extraction, creating it on first use.
+
+    The pool lives as long as the application so that worker start-up is paid once,
+    not on every upload. Workers are spawned rather than forked so that they never 
+    inherit locks held by threads of the API server.
 
     Returns:
-        str: The extracted text content from the PDF.
+        ProcessPoolExecutor: The shared pool of extraction worker processes.
+    """
+    
+    global _pdf_extraction_pool
+    
+    with _pdf_extraction_pool_lock:
+        if _pdf_extraction_pool is None:
+            _pdf_extraction_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"))
+    
+    return _pdf_extraction_pool
+
+
+def extract_page_range_from_pdf(
+    file_path: str,
+    page_range: Tuple[int, int]) -> List[str]:
+    """Extracts the text of a range of pages from a PDF file given its path.
+
+    This is the unit of work of the parallel extraction mode, every worker 
+    process opens the same file and only reads its own pages. Tasks only carry 
+    the path, so the file is not copied to the workers with every range.
+
+    Args:
+        file_path (str): The path of the PDF file.
+        page_range (Tuple[int, int]): Index of the first page (inclusive) and of the last page (exclusive) to extract.
+
+    Returns:
+        List[str]: The text of every page in the range, in page order.
     """
     
     doc = fitz.open(
+        file_path, 
+        filetype="pdf")
+    
+    try:
+        return [doc[page_index].get_text() for page_index in range(*page_range)]
+    finally:
+        doc.close()
+
+
+def iter_pages_from_pdf(
+    file_bytes: bytes,
+    parallel: Optional[bool] = None,
+    max_workers: int = PDF_EXTRACTION_MAX_WORKERS,
+    pages_per_task: int = PDF_EXTRACTION_PAGES_PER_TASK,
+    pdf_document: Optional[fitz.Document] = None) -> Iterator[str]:
+    """Lazily extracts the text of every page of a PDF file given its byte stream.
+
+    In parallel mode the pages are split into contiguous ranges that are 
+    extracted by separate worker processes, which matters for large scanned 
+    reports because text extraction is pure CPU work. Only a bounded number of
+    ranges is in flight at once, so memory does not grow with the document.
+    The file is written once to a temporary file that the workers open, rather
+    than sent to them with every range.
+
+    Args:
+        file_bytes (bytes): The byte representation of the PDF file.
+        parallel (Optional[bool], optional): Whether to extract pages in worker processes. 
+            Default is None, which enables it for documents with at least PDF_PARALLEL_EXTRACTION_MIN_PAGES pages.
+        max_workers (int, optional): Maximum number of page ranges extracted at once. Default is PDF_EXTRACTION_MAX_WORKERS.
+        pages_per_task (int, optional): Number of pages in each range. Default is PDF_EXTRACTION_PAGES_PER_TASK.
+        pdf_document (Optional[fitz.Document], optional): The document already opened from `file_bytes`, 
+            so that it is not parsed a second time. It is left open. Default is None.
+
+    Yields:
+        str: The text of every page, in page order.
+    """
+    
+    doc = pdf_document if pdf_document is not None else fitz.open(
         stream=file_bytes, 
         filetype="pdf")
     
-    text = ""
+    num_pages = doc.page_count
+    
+    if parallel is None:
+        parallel = num_pages >= PDF_PARALLEL_EXTRACTION_MIN_PAGES
+    
+    if not parallel or max_workers <= 1 or num_pages <= pages_per_task:
+        try:
+            for page in doc:
+                yield page.get_text()
+        finally:
+            if pdf_document is None:
+                doc.close()
+        return
+    
+    if pdf_document is None:
+        doc.close()
+    
+    logging.info(f"extracting {num_pages} pages with up to {max_workers} worker processes")
+    
+    page_ranges = (
+        (start_page, min(start_page + pages_per_task, num_pages))
+        for start_page in range(0, num_pages, pages_per_task)
+    )
     
-    for page in doc:
-        text += page.get_text()
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        pdf_file.write(file_bytes)
+        pdf_file.flush()
         
-    return text
+        for page_texts in map_in_order(
+            functools.partial(extract_page_range_from_pdf, pdf_file.name),
+            page_ranges,
+            max_in_flight=max_workers,
+            executor=get_pdf_extraction_pool()):
+            yield from page_texts
 
 
-def chunk_text(text: str,
-               chunk_size=512,
-               chunk_overlap=50):
+def iter_chunk_pages(pages: Iterable[str],
+                     chunk_size=512,
+                     chunk_overlap=50,
+                     align_to_pages: bool = False) -> Iterator[Tuple[str, int, int, int]]:
     """
-    Splits a given text into smaller chunks using a recursive character-based text splitter.
+    Lazily splits the text of a document into smaller chunks and tags every chunk with its page number and offsets.
+
+    The chunk boundaries come from a single pass of `split_text_spans` over the text, 
+    which returns character offsets, so chunks never have to be searched for again 
+    to find where they start. A chunk that spans a page break is tagged with the 
+    page it starts on.
+    
+    With `align_to_pages` every page is split on its own instead, as soon as it is 
+    extracted. Chunk boundaries then restart at every page, so an edit on one page 
+    of a revised document leaves the chunks of all other pages unchanged.
 
     Args:
-        text (str): The input text to be split.
+        pages (Iterable[str]): The text of every page of the document, in page order.
         chunk_size (int, optional): The maximum size of each text chunk. Default is 512.
         chunk_overlap (int, optional): The number of overlapping characters between consecutive chunks. Default is 50.
+        align_to_pages (bool, optional): Whether chunks restart at every page. Default is False.
 
-    Returns:
-        list: A list of text chunks.
+    Yields:
+        Tuple[str, int, int, int]: A (chunk, page number, start, end) tuple, page numbers start at 1 
+            and the offsets are those of the chunk in the text of the whole document.
     """
     
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, 
-        chunk_overlap=chunk_overlap)
+    if align_to_pages:
+        page_start = 0
+        
+        for page_number, page in enumerate(pages, start=1):
+            for start, end in split_text_spans(page, chunk_size=chunk_size, chunk_overlap=chunk_overlap):
+                yield page[start:end], page_number, page_start + start, page_start + end
+            
+            page_start += len(page)
+        return
+    
+    # Character offset of the start of every page in the whole document
+    page_starts = []
+    page_texts = []
+    document_length = 0
     
-    chunks_doc = splitter.split_text(text)
+    for page in pages:
+        page_starts.append(document_length)
+        page_texts.append(page)
+        document_length += len(page)
     
-    return chunks_doc
+    text = "".join(page_texts)
+    
+    for start, end in split_text_spans(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap):
+        yield text[start:end], bisect_right(page_starts, start), start, end
 
 
 def chunks(iterable, 
@@ -86,91 +339,642 @@ def chunks(iterable,
         chunk = tuple(itertools.islice(it, batch_size))
 
 
+def embed_batch_with_retry(batch: tuple,
+                           embedding_model,
+                           max_retries: int = EMBEDDING_MAX_RETRIES,
+                           retry_backoff_seconds: float = EMBEDDING_RETRY_BACKOFF_SECONDS) -> list:
+    """
+    Embeds one batch of chunks in a single request, retrying only this batch on failure.
+
+    Args:
+        batch (tuple): The chunks of text to embed together.
+        embedding_model: An embedding model exposing `embed_documents`.
+        max_retries (int, optional): Number of retries after the first failed attempt. Default is EMBEDDING_MAX_RETRIES.
+        retry_backoff_seconds (float, optional): Base delay between retries, doubled on every attempt. Default is EMBEDDING_RETRY_BACKOFF_SECONDS.
+
+    Returns:
+        list: The embeddings of the batch, in the same order as the chunks.
+    """
+    
+    attempt = 0
+    
+    while True:
+        try:
+            return embedding_model.embed_documents(list(batch))
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            
+            delay = retry_backoff_seconds * (2 ** attempt)
+            attempt += 1
+            
+            logging.warning(f"embedding batch failed ({e}), retry {attempt}/{max_retries} in {delay}s")
+            time.sleep(delay)
+
+
+def create_chunk_id(doc_key: str,
+                    chunk_text: str) -> str:
+    """
+    Derives the vector id of a chunk from a hash of its content.
+
+    The id does not depend on the position of the chunk, so an edit near the start 
+    of a revised document leaves the ids of every unchanged chunk as they were.
+
+    Args:
+        doc_key (str): A unique identifier for the document.
+        chunk_text (str): The text of the chunk.
+
+    Returns:
+        str: The vector id, the document key followed by "#" and the content hash.
+    """
+    
+    return f"{doc_key}#{hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()[:32]}"
+
+
+def list_document_vector_ids(index,
+                             doc_key: str) -> Set[str]:
+    """
+    Lists the ids of all vectors already stored for a document.
+
+    Vectors indexed before ids were content based used positional ids (`{doc_key}_{i}`), 
+    those are listed too so that re-indexing removes them.
+
+    Args:
+        index (VectorStore): The vector store.
+        doc_key (str): A unique identifier for the document.
+
+    Returns:
+        Set[str]: The ids of the stored vectors of the document.
+    """
+    
+    vector_ids = set()
+    
+    for ids in index.list(prefix=f"{doc_key}#"):
+        vector_ids.update(ids)
+    
+    for ids in index.list(prefix=f"{doc_key}_"):
+        vector_ids.update(vector_id for vector_id in ids if vector_id[len(doc_key)+1:].isdigit())
+    
+    return vector_ids
+
+
+def iter_new_document_chunks(doc_key: str,
+                             file_bytes: bytes,
+                             on_progress: Optional[Callable[[str, int], None]] = None,
+                             existing_ids: Optional[Set[str]] = None,
+                             seen_ids: Optional[Set[str]] = None,
+                             pdf_document: Optional[fitz.Document] = None,
+                             document_store=None) -> Iterator[dict]:
+    """
+    Lazily extracts and chunks a PDF file, and yields the chunks that still have to be embedded.
+
+    Pages are extracted in a background thread a bounded number of pages ahead of 
+    chunking. Chunks whose content hash is already stored, or that repeat an earlier 
+    chunk, are not yielded, but they are still written to the document store.
+
+    Args:
+        doc_key (str): A unique identifier for the document.
+        file_bytes (bytes): The PDF file content in byte format.
+        on_progress (Optional[Callable[[str, int], None]], optional): Called with "reused" for every chunk 
+            that is already stored. Default is None.
+        existing_ids (Optional[Set[str]], optional): Ids of the vectors already stored for the document. Default is None.
+        seen_ids (Optional[Set[str]], optional): Filled with the ids of every chunk of the document. Default is None.
+        pdf_document (Optional[fitz.Document], optional): The document already opened from `file_bytes`. Default is None.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text. Default is None.
+
+    Yields:
+        dict: A chunk with its id, doc_key, text, page, start and end offsets, and its readability counts.
+    """
+    existing_ids=existing_ids if existing_ids is not None else set()
+    seen_ids=seen_ids if seen_ids is not None else set()
+    
+    # Extract text of every page from PDF, in its own pipeline stage
+    pages=prefetch(iter_pages_from_pdf(file_bytes, pdf_document=pdf_document))
+    
+    reused_chunks=[]
+    
+    # Chunk every page into smaller parts, so that unchanged pages keep their chunk ids, and only keep new chunks
+    for chunk_text,page,start,end in iter_chunk_pages(pages, align_to_pages=True):
+        vector_id=create_chunk_id(doc_key,chunk_text)
+        
+        if vector_id in seen_ids:
+            continue
+        
+        seen_ids.add(vector_id)
+        
+        chunk={
+            "id":vector_id,
+            "doc_key":doc_key,
+            "text":chunk_text,
+            "page":page,
+            "start":start,
+            "end":end
+        }
+        
+        if vector_id in existing_ids:
+            # Reused chunks may have moved, and vectors indexed before the document store have no stored text yet
+            if document_store is not None:
+                reused_chunks.append(chunk)
+                
+                if len(reused_chunks) >= EMBEDDING_BATCH_SIZE:
+                    document_store.put_many(reused_chunks)
+                    reused_chunks=[]
+            
+            if on_progress:
+                on_progress("reused",1)
+            continue
+        
+        # Count the words, sentences and syllables of the chunk once, queries combine the counts of their top-k chunks
+        chunk["readability"]=readability_counts(chunk_text)
+        
+        yield chunk
+    
+    if reused_chunks:
+        document_store.put_many(reused_chunks)
+
+
+def iter_embedded_vectors(username: str,
+                          new_chunks: Iterable[dict],
+                          embedding_model,
+                          on_embedded: Optional[Callable[[tuple], None]] = None,
+                          document_store=None,
+                          batch_size: int = EMBEDDING_BATCH_SIZE,
+                          max_concurrent_batches: int = EMBEDDING_MAX_CONCURRENT_BATCHES,
+                          max_retries: int = EMBEDDING_MAX_RETRIES,
+                          retry_backoff_seconds: float = EMBEDDING_RETRY_BACKOFF_SECONDS) -> Iterator[dict]:
+    """
+    Embeds a stream of chunks in concurrent batches and yields them as vectors with metadata.
+
+    Batches are cut from the stream regardless of which document the chunks come 
+    from, so the chunks of several small documents share embedding requests. 
+    Every batch is retried on its own, so a transient failure never re-sends the 
+    batches that already succeeded, and the vectors keep the order of the chunks.
+
+    With a document store, the text, page and offsets of every chunk are written 
+    to it before the vector is yielded, and the vector metadata only keeps the 
+    fields used to filter queries.
+
+    Args:
+        username (str): The username associated with the documents.
+        new_chunks (Iterable[dict]): The chunks to embed, as yielded by `iter_new_document_chunks`.
+        embedding_model: An embedding model used to generate vector embeddings.
+        on_embedded (Optional[Callable[[tuple], None]], optional): Called with every batch of chunks once it is embedded. Default is None.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text. 
+            Default is None, which keeps the text in the vector metadata.
+        batch_size (int, optional): Number of chunks sent per request. Default is EMBEDDING_BATCH_SIZE.
+        max_concurrent_batches (int, optional): Maximum number of requests in flight. Default is EMBEDDING_MAX_CONCURRENT_BATCHES.
+        max_retries (int, optional): Number of retries per failed batch. Default is EMBEDDING_MAX_RETRIES.
+        retry_backoff_seconds (float, optional): Base delay between retries. Default is EMBEDDING_RETRY_BACKOFF_SECONDS.
+
+    Yields:
+        dict: A dictionary containing a vector embedding and its metadata
+    """
+    
+    chunk_batches=chunks(
+        new_chunks,
+        batch_size=batch_size)
+    
+    # Generate embeddings in concurrent batches, keeping chunk order
+    embedded_batches=map_in_order(
+        lambda batch: (batch, embed_batch_with_retry(
+            [chunk["text"] for chunk in batch],
+            embedding_model,
+            max_retries=max_retries,
+            retry_backoff_seconds=retry_backoff_seconds)),
+        chunk_batches,
+        max_in_flight=max_concurrent_batches)
+    
+    # Construct the iterable vector with metadata
+    for batch,vectors in embedded_batches:
+        if on_embedded:
+            on_embedded(batch)
+        
+        # Store the text before the vectors are upserted, so every vector a query can match has its text stored
+        if document_store is not None:
+            document_store.put_many(batch)
+        
+        for chunk,vector in zip(batch,vectors):
+            metadata={
+                "username":username,
+                "doc_key":chunk["doc_key"],
+                "page":chunk["page"]
+            }
+            
+            if document_store is None:
+                metadata["text"]=chunk["text"]
+                
+                if chunk.get("readability") is not None:
+                    metadata["readability"]=json.dumps(chunk["readability"])
+            
+            yield {
+                "id":chunk["id"],
+                "values":vector,
+                "metadata":metadata
+            }
+
+
 def create_iterable_vectors(username: str,
                             doc_key: str,
                             file_bytes: bytes,
-                            embedding_model) -> list:
+                            embedding_model,
+                            on_progress: Optional[Callable[[str, int], None]] = None,
+                            existing_ids: Optional[Set[str]] = None,
+                            seen_ids: Optional[Set[str]] = None,
+                            pdf_document: Optional[fitz.Document] = None,
+                            document_store=None) -> Iterator[dict]:
     """
-    Processes a PDF file to generate chunked text embeddings with metadata.
+    Processes a PDF file into a stream of chunked text embeddings with metadata.
+
+    Pages are extracted in a background thread a bounded number of pages ahead of 
+    chunking, and chunks are embedded in concurrent batches, so nothing but a few 
+    batches of the document is held in memory at once. Chunks whose content hash 
+    is already stored, or that repeat an earlier chunk, are not embedded again.
 
     Args:
         username (str): The username associated with the document.
         doc_key (str): A unique identifier for the document.
         file_bytes (bytes): The PDF file content in byte format.
         embedding_model: An embedding model used to generate vector embeddings.
+        on_progress (Optional[Callable[[str, int], None]], optional): Called with "embedded" and the 
+            number of chunks after every embedded batch, and with "reused" for every chunk that is 
+            already stored. Default is None.
+        existing_ids (Optional[Set[str]], optional): Ids of the vectors already stored for the document. Default is None.
+        seen_ids (Optional[Set[str]], optional): Filled with the ids of every chunk of the document. Default is None.
+        pdf_document (Optional[fitz.Document], optional): The document already opened from `file_bytes`. Default is None.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text. 
+            Default is None, which keeps the text in the vector metadata.
+
+    Yields:
+        dict: A dictionary containing a vector embedding and its metadata
+    
+    """
+    
+    new_chunks=iter_new_document_chunks(
+        doc_key=doc_key,
+        file_bytes=file_bytes,
+        on_progress=on_progress,
+        existing_ids=existing_ids,
+        seen_ids=seen_ids,
+        pdf_document=pdf_document,
+        document_store=document_store)
+    
+    yield from iter_embedded_vectors(
+        username=username,
+        new_chunks=new_chunks,
+        embedding_model=embedding_model,
+        on_embedded=(lambda batch: on_progress("embedded",len(batch))) if on_progress else None,
+        document_store=document_store)
+
+
+def wait_for_upsert(async_upsert: Tuple,
+                    on_upserted: Optional[Callable[[tuple], None]] = None) -> None:
+    """
+    Waits for an asynchronous upsert request and reports its vectors as upserted.
+
+    Args:
+        async_upsert (Tuple): The pending request and the batch of vectors it carries.
+        on_upserted (Optional[Callable[[tuple], None]], optional): Called with the batch of vectors. Default is None.
 
     Returns:
-        list: A list of dictionaries containing vector embeddings and metadata
+        None
+    """
+    
+    async_result, batch = async_upsert
     
+    # this raises in case of error
+    async_result.get()
+    
+    if on_upserted:
+        on_upserted(batch)
+
+
+def upsert_vectors_in_parallel(index,
+                               vectors: Iterable[dict],
+                               on_upserted: Optional[Callable[[tuple], None]] = None) -> int:
+    """
+    Upserts a stream of vectors in batches, with a bounded number of requests in flight.
+
+    The vectors are produced in their own pipeline stage, a bounded number of upsert 
+    batches ahead. Requests complete in the order they were sent.
+
+    Args:
+        index (VectorStore): The vector store, Pinecone needs enough pool threads for PINECONE_MAX_CONCURRENT_UPSERTS.
+        vectors (Iterable[dict]): The vectors to upsert.
+        on_upserted (Optional[Callable[[tuple], None]], optional): Called with every batch of vectors once it is upserted. Default is None.
+
+    Returns:
+        int: The number of upserted vectors.
     """
-    # Extract text from PDF
-    text=extract_text_from_pdf(file_bytes)
     
-    # Chunk the text into smaller parts
-    chunk_docs=chunk_text(text)
+    # Embedding runs in its own pipeline stage, a bounded number of upsert batches ahead
+    upsert_batches=prefetch(
+        chunks(
+            vectors,
+            batch_size=PINECONE_UPSERT_BATCH_SIZE))
     
-    # Function to generate embeddings 
-    vectors=[embedding_model.embed_query(chunk) for chunk in chunk_docs]
+    num_vectors=0
+    async_results=deque()
     
-    # Construct the iterable vector with metadata
-    iterable_vector=[
-        {
-            "id":f"{doc_key}_{i}",
-            "values":vector,
-            "metadata":
-                {
-                    "username":username,
-                    "doc_key":doc_key,
-                    "text":chunk_text
-                }
-        }
-        for i,(chunk_text,vector) in enumerate(list(zip(chunk_docs,vectors)))
-    ]
+    # Send requests in parallel, keeping a bounded number in flight
+    for ids_vectors_chunk in upsert_batches:
+        async_results.append(
+            (
+                index.upsert(
+                    vectors=ids_vectors_chunk, 
+                    async_req=True
+                ),
+                ids_vectors_chunk
+            )
+        )
+        num_vectors+=len(ids_vectors_chunk)
+        
+        # Wait for and retrieve responses (this raises in case of error)
+        if len(async_results) >= PINECONE_MAX_CONCURRENT_UPSERTS:
+            wait_for_upsert(async_results.popleft(),on_upserted)
+    
+    while async_results:
+        wait_for_upsert(async_results.popleft(),on_upserted)
+    
+    return num_vectors
+
+
+def delete_removed_vectors(index,
+                           removed_ids: Set[str],
+                           on_progress: Optional[Callable[[str, int], None]] = None,
+                           document_store=None) -> None:
+    """
+    Deletes the vectors of chunks that are no longer in a re-indexed document.
+
+    Args:
+        index (VectorStore): The vector store.
+        removed_ids (Set[str]): The ids of the vectors to delete.
+        on_progress (Optional[Callable[[str, int], None]], optional): Called with "deleted" and the number of vectors. Default is None.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text. Default is None.
+
+    Returns:
+        None
+    """
     
-    return iterable_vector
+    for ids_chunk in chunks(list(removed_ids), batch_size=PINECONE_DELETE_BATCH_SIZE):
+        index.delete(ids=list(ids_chunk))
+        
+        if document_store is not None:
+            document_store.delete_many(list(ids_chunk))
+        
+        if on_progress:
+            on_progress("deleted",len(ids_chunk))
+
+
+def build_keyword_index(doc_key: str,
+                        document_store,
+                        keyword_index_store) -> None:
+    """
+    Rebuilds the keyword index of a document from the chunks in the document store.
+
+    Called once the vectors are upserted and the removed chunks deleted, so the 
+    index holds exactly the chunks a vector query can match.
+
+    Args:
+        doc_key (str): A unique identifier for the document.
+        document_store (DocumentStore): The store that keeps the chunk text.
+        keyword_index_store (KeywordIndexStore): The store of the keyword indexes.
+
+    Returns:
+        None
+    """
+    
+    document_chunks=document_store.get_document_chunks(doc_key)
+    
+    keyword_index_store.build(doc_key,[(chunk["id"],chunk["text"]) for chunk in document_chunks])
+    
+    logging.info(f"built keyword index of {len(document_chunks)} chunks for document {doc_key}")
 
 
 def init_pinecone_and_doc_indexing(username: str,
                                    doc_key: str,
                                    file_bytes: bytes,
                                    embedding_model,
-                                   pc) -> None:
+                                   vector_store,
+                                   on_progress: Optional[Callable[[str, int], None]] = None,
+                                   pdf_document: Optional[fitz.Document] = None,
+                                   document_store=None,
+                                   keyword_index_store=None,
+                                   summary_llm=None) -> None:
     
     """
     Initializes Pinecone indexing and upserts document embeddings.
 
+    Ingestion is a streaming pipeline of extraction, chunking, embedding and 
+    upserting stages connected by bounded queues, so upserts start as soon as the 
+    first batch is embedded and memory use does not grow with the document.
+    
+    Indexing is incremental: only chunks that are not stored yet are embedded and 
+    upserted, and once the upserts are done the vectors of chunks that are no longer 
+    in the document are deleted.
+
     Args:
         username (str): The username associated with the document.
         doc_key (str): A unique identifier for the document.
         file_bytes (bytes): The PDF file content in byte format.
         embedding_model: The embedding model used to generate vector embeddings.
-        pc: The Pinecone client instance.
+        vector_store (VectorStore): The vector store that holds the embeddings.
+        on_progress (Optional[Callable[[str, int], None]], optional): Called with a stage, "reused", "embedded", 
+            "upserted" or "deleted", and the number of chunks that went through it. Default is None.
+        pdf_document (Optional[fitz.Document], optional): The document already opened from `file_bytes`, 
+            so that the upload is only parsed once. Default is None.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text, 
+            page and offsets outside of Pinecone. Default is None, which keeps the text in the vector metadata.
+        keyword_index_store (Optional[KeywordIndexStore], optional): The store of the BM25 keyword indexes, 
+            the index of the document is rebuilt from the document store. Default is None.
+        summary_llm (optional): The chat model that writes the summary tree of the document, stored in the 
+            document store. Default is None, which builds no summaries.
 
     Returns:
         None
     """
     
-    with pc.Index(PINECONE_INDEX, pool_threads=30) as index:
-        
-        iterable_vector=create_iterable_vectors(
+    # Diff against the chunks already stored for this document
+    existing_ids=list_document_vector_ids(vector_store,doc_key)
+    seen_ids=set()
+    
+    logging.info(f"{len(existing_ids)} vectors already stored for document {doc_key}")
+    
+    num_vectors=upsert_vectors_in_parallel(
+        vector_store,
+        create_iterable_vectors(
             username=username,
             doc_key=doc_key,
             file_bytes=file_bytes,
-            embedding_model=embedding_model)
+            embedding_model=embedding_model,
+            on_progress=on_progress,
+            existing_ids=existing_ids,
+            seen_ids=seen_ids,
+            pdf_document=pdf_document,
+            document_store=document_store),
+        on_upserted=(lambda batch: on_progress("upserted",len(batch))) if on_progress else None)
+    
+    # Delete the chunks removed from the document only now, so queries keep working while re-indexing
+    removed_ids=existing_ids-seen_ids
+    
+    delete_removed_vectors(vector_store,removed_ids,on_progress,document_store)
+    
+    if keyword_index_store is not None and document_store is not None:
+        build_keyword_index(doc_key,document_store,keyword_index_store)
+    
+    # Summarize the document once at ingestion, broad summarization queries are answered from the summaries
+    if summary_llm is not None and document_store is not None:
+        build_document_summaries(doc_key,document_store,summary_llm)
+
+    logging.info(f"upserted {num_vectors} vectors and deleted {len(removed_ids)} vectors of document {doc_key} in the vector store")
+
+
+@dataclass
+class IndexingRequest:
+    """One document of a bulk indexing run."""
+    
+    doc_key: str
+    # Returns the PDF file content, called when the document is reached in the pipeline
+    load_file_bytes: Callable[[], bytes]
+    on_progress: Optional[Callable[[str, int], None]] = None
+    # Called once with None when the document is indexed, or with the error that stopped it
+    on_done: Optional[Callable[[Optional[Exception]], None]] = None
+
+
+def init_pinecone_and_bulk_doc_indexing(username: str,
+                                        documents: List[IndexingRequest],
+                                        embedding_model,
+                                        vector_store,
+                                        document_store=None,
+                                        keyword_index_store=None,
+                                        summary_llm=None) -> None:
+    """
+    Indexes many documents through one shared pipeline of embedding batches and upsert requests.
+
+    The chunks of all documents form a single stream, so the tail of one document 
+    and the chunks of small documents fill the same embedding batches and upsert 
+    requests instead of each document sending its own partly filled ones. The next 
+    document is loaded while the current one is chunked and embedded.
+    
+    A document that can not be loaded or parsed fails on its own and the others 
+    carry on. As soon as all the vectors of a document are upserted, the chunks 
+    removed from it are deleted, its keyword index and summaries are rebuilt and it 
+    is reported done, in a worker of their own so that summarizing a large document 
+    does not hold up the upserts of the next ones.
+
+    Args:
+        username (str): The username associated with the documents.
+        documents (List[IndexingRequest]): The documents to index, with unique doc keys.
+        embedding_model: The embedding model used to generate vector embeddings.
+        vector_store (VectorStore): The vector store that holds the embeddings.
+        document_store (Optional[DocumentStore], optional): The store that keeps the chunk text, 
+            page and offsets outside of Pinecone. Default is None, which keeps the text in the vector metadata.
+        keyword_index_store (Optional[KeywordIndexStore], optional): The store of the BM25 keyword indexes, 
+            the index of every document is rebuilt from the document store. Default is None.
+        summary_llm (optional): The chat model that writes the summary tree of every document, stored in the 
+            document store. Default is None, which builds no summaries.
+
+    Returns:
+        None
+    """
+    
+    document_positions={document.doc_key: position for position, document in enumerate(documents)}
+    existing_ids=[set() for _ in documents]
+    seen_ids=[set() for _ in documents]
+    errors=[None]*len(documents)
+    num_finished=0
+    
+    def report_progress(stage, batch, get_doc_key):
+        for doc_key, num_chunks in Counter(get_doc_key(item) for item in batch).items():
+            on_progress=documents[document_positions[doc_key]].on_progress
+            if on_progress:
+                on_progress(stage, num_chunks)
+    
+    def load_documents():
+        for position, document in enumerate(documents):
+            try:
+                yield position, document.load_file_bytes()
+            except Exception as e:
+                yield position, e
+    
+    def iter_all_new_chunks():
+        # Download the next document while the current one is processed
+        for position, file_bytes in prefetch(load_documents(), max_size=1):
+            document=documents[position]
+            
+            try:
+                if isinstance(file_bytes, Exception):
+                    raise file_bytes
+                
+                existing_ids[position]=list_document_vector_ids(vector_store,document.doc_key)
+                
+                yield from iter_new_document_chunks(
+                    doc_key=document.doc_key,
+                    file_bytes=file_bytes,
+                    on_progress=document.on_progress,
+                    existing_ids=existing_ids[position],
+                    seen_ids=seen_ids[position],
+                    document_store=document_store)
+            except Exception as e:
+                logging.exception(f"failed to index document {document.doc_key}")
+                errors[position]=e
+    
+    def finish_document(position):
+        document=documents[position]
+        error=errors[position]
         
-        logging.info("Embedding of document is completed, now proceed to upserting embeddings to Pinecone DB")
+        if error is None:
+            try:
+                delete_removed_vectors(
+                    vector_store,
+                    existing_ids[position]-seen_ids[position],
+                    document.on_progress,
+                    document_store)
+                
+                if keyword_index_store is not None and document_store is not None:
+                    build_keyword_index(document.doc_key,document_store,keyword_index_store)
+                
+                if summary_llm is not None and document_store is not None:
+                    build_document_summaries(document.doc_key,document_store,summary_llm)
+            except Exception as e:
+                logging.exception(f"failed to finish indexing document {document.doc_key}")
+                error=e
         
-        # Send requests in parallel
-        async_results = [
-            index.upsert(
-                vectors=ids_vectors_chunk, 
-                async_req=True
-            )
-            for ids_vectors_chunk in chunks(iterable_vector, batch_size=100)
-        ]
+        if document.on_done:
+            try:
+                document.on_done(error)
+            except Exception:
+                logging.exception(f"failed to report document {document.doc_key} done")
+    
+    # Documents are finished one at a time and in order, outside of the upsert stage
+    finishing_executor=ThreadPoolExecutor(max_workers=1,thread_name_prefix="finish-documents")
+    
+    def finish_documents(until_position):
+        # Documents are streamed in order, so every document before the last upserted one is complete
+        nonlocal num_finished
         
-        # Wait for and retrieve responses (this raises in case of error)
-        [async_result.get() for async_result in async_results]
+        while num_finished < until_position:
+            finishing_executor.submit(finish_document,num_finished)
+            num_finished+=1
     
-    logging.info("index_stats: ",index.describe_index_stats())
+    def on_upserted(batch):
+        report_progress("upserted", batch, lambda vector: vector["metadata"]["doc_key"])
+        finish_documents(document_positions[batch[-1]["metadata"]["doc_key"]])
     
+    try:
+        num_vectors=upsert_vectors_in_parallel(
+            vector_store,
+            iter_embedded_vectors(
+                username=username,
+                new_chunks=iter_all_new_chunks(),
+                embedding_model=embedding_model,
+                on_embedded=lambda batch: report_progress("embedded", batch, lambda chunk: chunk["doc_key"]),
+                document_store=document_store),
+            on_upserted=on_upserted)
+        
+        finish_documents(len(documents))
+    finally:
+        # Wait for the documents that are still being finished
+        finishing_executor.shutdown(wait=True)
+
+    logging.info(f"upserted {num_vectors} vectors of {len(documents)} documents in the vector store, "
+                 f"{sum(error is not None for error in errors)} documents failed")
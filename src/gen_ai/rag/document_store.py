@@ -0,0 +1,160 @@
+from typing import Dict, Iterable, List, Optional
+import json
+import os
+import sqlite3
+import threading
+
+from src.config import DOCUMENT_STORE_PATH
+
+
+class DocumentStore:
+    """Local store of the text, page and offsets of every indexed chunk, keyed by vector id.
+
+    Vectors in Pinecone only carry small filter fields, the chunk text is kept here
+    and loaded for the top-k matches of a query in one bulk lookup, which keeps
+    upsert payloads and query responses small. The readability counts of every
+    chunk are kept with its text, as JSON.
+    """
+
+    def __init__(self,
+                 path: str = DOCUMENT_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id TEXT PRIMARY KEY, doc_key TEXT NOT NULL, text TEXT NOT NULL, "
+            "page INTEGER NOT NULL, start_offset INTEGER NOT NULL, end_offset INTEGER NOT NULL, readability TEXT)")
+        # stores created before the readability counts were kept
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(chunks)")]
+        if "readability" not in columns:
+            self._connection.execute("ALTER TABLE chunks ADD COLUMN readability TEXT")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_doc_key ON chunks (doc_key)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "id TEXT NOT NULL, doc_key TEXT NOT NULL, level TEXT NOT NULL, position INTEGER NOT NULL, "
+            "response_length TEXT NOT NULL, text TEXT NOT NULL, start_offset INTEGER NOT NULL, end_offset INTEGER NOT NULL, "
+            "PRIMARY KEY (doc_key, id))")
+        self._connection.commit()
+
+    def put_many(self, chunks: Iterable[dict]) -> None:
+        """Stores chunks given as dictionaries with id, doc_key, text, page, start and end keys, and optionally readability.
+
+        A chunk stored again without readability counts, such as a chunk reused
+        when its document is indexed again, keeps the counts already stored.
+        """
+
+        rows = [
+            dict(chunk, readability=json.dumps(chunk["readability"]) if chunk.get("readability") is not None else None)
+            for chunk in chunks
+        ]
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO chunks (id, doc_key, text, page, start_offset, end_offset, readability) "
+                "VALUES (:id, :doc_key, :text, :page, :start, :end, :readability) "
+                "ON CONFLICT (id) DO UPDATE SET doc_key = excluded.doc_key, text = excluded.text, "
+                "page = excluded.page, start_offset = excluded.start_offset, end_offset = excluded.end_offset, "
+                "readability = COALESCE(excluded.readability, chunks.readability)",
+                rows)
+            self._connection.commit()
+
+    def get_many(self, ids: List[str]) -> Dict[str, dict]:
+        """Returns the stored chunks of the given vector ids, ids that are not stored are left out.
+
+        The readability counts of chunks stored before they were kept are None.
+        """
+
+        found = {}
+
+        with self._lock:
+            # stay below the SQLite limit on the number of query parameters
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    "SELECT id, doc_key, text, page, start_offset, end_offset, readability "
+                    f"FROM chunks WHERE id IN ({placeholders})", batch)
+
+                for vector_id, doc_key, text, page, start_offset, end_offset, readability in rows:
+                    found[vector_id] = {
+                        "doc_key": doc_key,
+                        "text": text,
+                        "page": page,
+                        "start": start_offset,
+                        "end": end_offset,
+                        "readability": json.loads(readability) if readability is not None else None
+                    }
+
+        return found
+
+    def get_document_chunks(self, doc_key: str) -> List[dict]:
+        """Returns the stored chunks of a document, in document order, as dictionaries with id, text, page, start and end keys."""
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, text, page, start_offset, end_offset FROM chunks "
+                "WHERE doc_key = ? ORDER BY start_offset", (doc_key,)).fetchall()
+
+        return [
+            {
+                "id": vector_id,
+                "text": text,
+                "page": page,
+                "start": start_offset,
+                "end": end_offset
+            }
+            for vector_id, text, page, start_offset, end_offset in rows
+        ]
+
+    def delete_many(self, ids: List[str]) -> None:
+        """Deletes the stored chunks of the given vector ids."""
+
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM chunks WHERE id = ?",
+                [(vector_id,) for vector_id in ids])
+            self._connection.commit()
+
+    def put_summaries(self, doc_key: str, nodes: Iterable[dict]) -> None:
+        """Replaces the summary tree of a document, given as dictionaries with id, level, position,
+        response_length, text, start and end keys."""
+
+        with self._lock:
+            self._connection.execute("DELETE FROM summaries WHERE doc_key = ?", (doc_key,))
+            self._connection.executemany(
+                "INSERT INTO summaries (id, doc_key, level, position, response_length, text, start_offset, end_offset) "
+                "VALUES (:id, :doc_key, :level, :position, :response_length, :text, :start, :end)",
+                [dict(node, doc_key=doc_key) for node in nodes])
+            self._connection.commit()
+
+    def get_summaries(self, doc_key: str, level: Optional[str] = None) -> List[dict]:
+        """Returns the summary nodes of a document, of one level or all of them, in document order."""
+
+        query = ("SELECT id, level, position, response_length, text, start_offset, end_offset "
+                 "FROM summaries WHERE doc_key = ?")
+        params = [doc_key]
+
+        if level is not None:
+            query += " AND level = ?"
+            params.append(level)
+
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY level, position", params).fetchall()
+
+        return [
+            {
+                "id": node_id,
+                "level": node_level,
+                "position": position,
+                "response_length": response_length,
+                "text": text,
+                "start": start_offset,
+                "end": end_offset
+            }
+            for node_id, node_level, position, response_length, text, start_offset, end_offset in rows
+        ]
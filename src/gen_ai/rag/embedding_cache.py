@@ -0,0 +1,518 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import redis
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from src.config import (
+    EMBEDDING_CACHE_BACKEND,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_BYTES,
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    QUERY_EMBEDDING_CACHE_REDIS_ENABLED,
+    REDIS_HOST,
+    REDIS_PORT
+)
+
+
+def normalize_text(text: str) -> str:
+    """Collapses runs of whitespace so that chunks differing only in spacing share a cache entry.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+
+    return " ".join(text.split())
+
+
+def embedding_cache_key(model_name: str,
+                        text: str) -> str:
+    """Builds the cache key of an embedding from the model name and a hash of the normalized text.
+
+    Args:
+        model_name (str): Name of the embedding model.
+        text (str): The embedded text.
+
+    Returns:
+        str: The cache key.
+    """
+
+    text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    return f"{model_name}:{text_hash}"
+
+
+def normalize_query(text: str) -> str:
+    """Normalizes a query so that queries differing only in case or spacing share a cache entry.
+
+    Args:
+        text (str): The query text.
+
+    Returns:
+        str: The normalized query.
+    """
+
+    return normalize_text(text).lower()
+
+
+def serialize_vector(vector: List[float]) -> bytes:
+    """Packs an embedding into float32 bytes for storage in the cache."""
+
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def deserialize_vector(data: bytes) -> List[float]:
+    """Unpacks an embedding stored in the cache."""
+
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+class SQLiteEmbeddingCache:
+    """Embedding cache stored in a local SQLite file, with size-based LRU eviction."""
+
+    def __init__(self,
+                 path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._connection.commit()
+
+        self._total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """Returns the cached vectors of the given keys, and marks them as recently used."""
+
+        found = {}
+
+        with self._lock:
+            # stay below the SQLite limit on the number of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found])
+                self._connection.commit()
+
+        return found
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        """Stores vectors, then evicts the least recently used ones while the cache is over its size."""
+
+        now = time.time()
+
+        with self._lock:
+            for key, vector in items.items():
+                replaced = self._connection.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                    (key, vector, now))
+                self._total_bytes += len(vector) - (replaced[0] if replaced else 0)
+
+            if self._total_bytes > self._max_bytes:
+                evicted = []
+
+                for key, size in self._connection.execute(
+                        "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access"):
+                    if self._total_bytes <= self._max_bytes:
+                        break
+                    evicted.append((key,))
+                    self._total_bytes -= size
+
+                self._connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+            self._connection.commit()
+
+
+class RedisEmbeddingCache:
+    """Embedding cache stored in Redis, with size-based LRU eviction.
+
+    Access times are kept in a sorted set and the total size in a counter, so the
+    cache can be shared by every worker without relying on the eviction policy of
+    the Redis server, which also holds the response cache.
+    """
+
+    def __init__(self,
+                 redis_client,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+                 prefix: str = "embedding-cache"):
+        self._redis = redis_client
+        self._max_bytes = max_bytes
+        self._prefix = prefix
+        self._lru_key = f"{prefix}:lru"
+        self._size_key = f"{prefix}:bytes"
+
+    def _vector_key(self, key: str) -> str:
+        return f"{self._prefix}:vector:{key}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """Returns the cached vectors of the given keys, and marks them as recently used."""
+
+        if not keys:
+            return {}
+
+        values = self._redis.mget([self._vector_key(key) for key in keys])
+        found = {key: value for key, value in zip(keys, values) if value is not None}
+
+        if found:
+            now = time.time()
+            self._redis.zadd(self._lru_key, {key: now for key in found})
+
+        return found
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        """Stores vectors, then evicts the least recently used ones while the cache is over its size."""
+
+        if not items:
+            return
+
+        # Size of the entries being replaced, so the size counter does not drift
+        pipeline = self._redis.pipeline()
+        for key in items:
+            pipeline.strlen(self._vector_key(key))
+        replaced_bytes = sum(pipeline.execute())
+
+        now = time.time()
+        pipeline = self._redis.pipeline()
+
+        for key, vector in items.items():
+            pipeline.set(self._vector_key(key), vector)
+            pipeline.zadd(self._lru_key, {key: now})
+
+        pipeline.incrby(self._size_key, sum(len(vector) for vector in items.values()) - replaced_bytes)
+        total_bytes = pipeline.execute()[-1]
+
+        while total_bytes > self._max_bytes:
+            oldest_keys = self._redis.zrange(self._lru_key, 0, 99)
+
+            if not oldest_keys:
+                break
+
+            oldest_keys = [key.decode() if isinstance(key, bytes) else key for key in oldest_keys]
+
+            pipeline = self._redis.pipeline()
+            for key in oldest_keys:
+                pipeline.strlen(self._vector_key(key))
+            sizes = pipeline.execute()
+
+            # Only evict as many of the oldest entries as needed to get back under the size
+            evicted_keys = []
+            evicted_bytes = 0
+            for key, size in zip(oldest_keys, sizes):
+                if total_bytes - evicted_bytes <= self._max_bytes:
+                    break
+                evicted_keys.append(key)
+                evicted_bytes += size
+
+            pipeline = self._redis.pipeline()
+            pipeline.delete(*[self._vector_key(key) for key in evicted_keys])
+            pipeline.zrem(self._lru_key, *evicted_keys)
+            pipeline.decrby(self._size_key, evicted_bytes)
+            total_bytes = pipeline.execute()[-1]
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings, an in-process LRU in front of Redis shared by every worker.
+
+    Both tiers expire entries after `ttl_seconds`. A Redis hit is copied into the
+    LRU, and Redis errors are logged and treated as misses, so a Redis outage
+    only costs the embedding call it would have saved.
+    """
+
+    def __init__(self,
+                 redis_client=None,
+                 max_entries: int = QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+                 prefix: str = "query-embedding-cache"):
+        self._redis = redis_client
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the hit counters of every tier and the overall hit rate."""
+
+        with self._lock:
+            total = self.memory_hits + self.redis_hits + self.misses
+
+            return {
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.redis_hits) / total if total else 0.0,
+                "entries": len(self._entries)
+            }
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached vector of a key, or None."""
+
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                vector, expires_at = entry
+
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return vector
+
+                del self._entries[key]
+
+        vector = None
+
+        if self._redis is not None:
+            try:
+                vector = self._redis.get(f"{self._prefix}:{key}")
+            except Exception as e:
+                logging.warning(f"query embedding cache lookup in Redis failed: {e}")
+
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+
+            self.redis_hits += 1
+
+        self._remember(key, vector, now)
+
+        return vector
+
+    def set(self, key: str, vector: bytes) -> None:
+        """Stores a vector in both tiers."""
+
+        self._remember(key, vector, time.time())
+
+        if self._redis is not None:
+            try:
+                self._redis.set(f"{self._prefix}:{key}", vector, ex=self._ttl_seconds)
+            except Exception as e:
+                logging.warning(f"query embedding cache update in Redis failed: {e}")
+
+    def _remember(self, key: str, vector: bytes, now: float) -> None:
+        with self._lock:
+            self._entries[key] = (vector, now + self._ttl_seconds)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding model wrapper that only sends texts missing from the embedding cache to the model.
+
+    Boilerplate chunks such as disclaimers, headers and legal footers repeat across
+    documents, so they are embedded once. The same cache serves query embeddings,
+    behind an optional `query_cache` that keeps repeated queries in memory and in Redis.
+    Cache errors are logged and never fail the embedding call.
+    """
+
+    def __init__(self,
+                 embedding_model: Embeddings,
+                 cache=None,
+                 model_name: Optional[str] = None,
+                 query_cache: Optional[QueryEmbeddingCache] = None):
+        self.embedding_model = embedding_model
+        self.cache = cache
+        self.query_cache = query_cache
+        self.model_name = model_name or getattr(embedding_model, "model", type(embedding_model).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache."""
+
+        total = self.hits + self.misses
+
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+        if self.query_cache is not None:
+            stats["query_cache"] = self.query_cache.stats()
+
+        return stats
+
+    def _lookup(self, keys: List[str]) -> Dict[str, bytes]:
+        if self.cache is None:
+            return {}
+
+        try:
+            return self.cache.get_many(keys)
+        except Exception as e:
+            logging.warning(f"embedding cache lookup failed: {e}")
+            return {}
+
+    def _store(self, items: Dict[str, bytes]) -> None:
+        if self.cache is None or not items:
+            return
+
+        try:
+            self.cache.set_many(items)
+        except Exception as e:
+            logging.warning(f"embedding cache update failed: {e}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model_name, text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        vectors = [deserialize_vector(cached[key]) if key in cached else None for key in keys]
+
+        # Embed each missing text once, even if it appears several times in the batch
+        missing = {}
+        for text, key, vector in zip(texts, keys, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+
+        if missing:
+            missing_vectors = dict(zip(
+                missing,
+                self.embedding_model.embed_documents(list(missing.values()))))
+
+            self._store({key: serialize_vector(vector) for key, vector in missing_vectors.items()})
+
+            vectors = [missing_vectors[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        with self._lock:
+            self.misses += sum(1 for key in keys if key in missing)
+            self.hits += len(keys) - sum(1 for key in keys if key in missing)
+
+        return vectors
+
+    def _lookup_query(self, text: str) -> Tuple[str, str, Optional[List[float]]]:
+        # Returns the cache keys of a query and its cached vector, or None
+        query_key = f"{self.model_name}:{normalize_query(text)}"
+
+        if self.query_cache is not None:
+            cached_vector = self.query_cache.get(query_key)
+
+            if cached_vector is not None:
+                return query_key, None, deserialize_vector(cached_vector)
+
+        key = embedding_cache_key(self.model_name, text)
+        cached = self._lookup([key])
+
+        if key not in cached:
+            return query_key, key, None
+
+        with self._lock:
+            self.hits += 1
+
+        if self.query_cache is not None:
+            self.query_cache.set(query_key, cached[key])
+
+        return query_key, key, deserialize_vector(cached[key])
+
+    def _store_query(self, query_key: str, key: str, vector: List[float]) -> None:
+        vector_bytes = serialize_vector(vector)
+        self._store({key: vector_bytes})
+
+        with self._lock:
+            self.misses += 1
+
+        if self.query_cache is not None:
+            self.query_cache.set(query_key, vector_bytes)
+
+    def embed_query(self, text: str) -> List[float]:
+        query_key, key, vector = self._lookup_query(text)
+
+        if vector is None:
+            vector = self.embedding_model.embed_query(text)
+            self._store_query(query_key, key, vector)
+
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # The cache lookups are blocking, they run in a worker thread while the embedding call is awaited
+        query_key, key, vector = await asyncio.to_thread(self._lookup_query, text)
+
+        if vector is None:
+            vector = await self.embedding_model.aembed_query(text)
+            await asyncio.to_thread(self._store_query, query_key, key, vector)
+
+        return vector
+
+
+def create_query_embedding_cache(redis_enabled: bool = QUERY_EMBEDDING_CACHE_REDIS_ENABLED) -> QueryEmbeddingCache:
+    """Creates the query embedding cache, with its Redis tier when QUERY_EMBEDDING_CACHE_REDIS_ENABLED is set.
+
+    Args:
+        redis_enabled (bool, optional): Whether to share the cache through Redis. Default is QUERY_EMBEDDING_CACHE_REDIS_ENABLED.
+
+    Returns:
+        QueryEmbeddingCache: The query embedding cache.
+    """
+
+    redis_client = None
+
+    if redis_enabled:
+        # A short timeout, an unreachable Redis must not cost more than the embedding call it saves
+        redis_client = redis.Redis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=0,
+            socket_connect_timeout=0.2,
+            socket_timeout=0.2)
+
+    return QueryEmbeddingCache(redis_client)
+
+
+def create_embedding_cache(backend: str = EMBEDDING_CACHE_BACKEND):
+    """Creates the embedding cache configured by EMBEDDING_CACHE_BACKEND.
+
+    Args:
+        backend (str, optional): "sqlite", "redis" or "none". Default is EMBEDDING_CACHE_BACKEND.
+
+    Returns:
+        The embedding cache, or None when caching is disabled.
+    """
+
+    if backend == "sqlite":
+        return SQLiteEmbeddingCache()
+
+    if backend == "redis":
+        return RedisEmbeddingCache(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0))
+
+    if backend != "none":
+        logging.warning(f"unknown embedding cache backend {backend}, embedding cache is disabled")
+
+    return None
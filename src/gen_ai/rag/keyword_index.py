@@ -0,0 +1,277 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+from src.config import (
+    KEYWORD_INDEX_PATH,
+    RRF_K
+)
+
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Words of a question that say nothing of what it is about, left out of the coverage of a query
+_QUESTION_WORDS = frozenset(
+    "a about an and are as at be by can could do does for from how i in is it me of on or please "
+    "say says tell that the this to was were what when where which who whom why will with would you".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits a text into lowercase word tokens, identifiers such as "CS-101" give "cs" and "101"."""
+
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """BM25 index of the chunks of one document.
+
+    The postings of every term are a slice of two flat arrays, the rows of the
+    chunks that contain the term and the number of occurrences in each, so a
+    query only touches the postings of its own terms.
+    """
+
+    def __init__(self,
+                 ids: List[str],
+                 terms: Dict[str, int],
+                 term_offsets: np.ndarray,
+                 posting_rows: np.ndarray,
+                 posting_freqs: np.ndarray,
+                 chunk_lengths: np.ndarray,
+                 k1: float = 1.2,
+                 b: float = 0.75):
+        self.ids = ids
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.posting_rows = posting_rows
+        self.posting_freqs = posting_freqs
+        self.chunk_lengths = chunk_lengths
+        self.k1 = k1
+
+        # Length normalization of every chunk, the only part of BM25 that does not depend on the query
+        average_length = chunk_lengths.mean() if len(chunk_lengths) and chunk_lengths.mean() > 0 else 1.0
+        self._length_norms = (k1 * (1 - b + b * chunk_lengths / average_length)).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[str, str]]) -> "KeywordIndex":
+        """Builds the index of (vector id, text) pairs.
+
+        Args:
+            chunks (Iterable[Tuple[str, str]]): The id and text of every chunk of the document.
+
+        Returns:
+            KeywordIndex: The index.
+        """
+
+        ids = []
+        terms = {}
+        posting_terms = []
+        posting_rows = []
+        posting_freqs = []
+        chunk_lengths = []
+
+        for row, (chunk_id, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            ids.append(chunk_id)
+            chunk_lengths.append(len(tokens))
+
+            for term, count in Counter(tokens).items():
+                posting_terms.append(terms.setdefault(term, len(terms)))
+                posting_rows.append(row)
+                posting_freqs.append(min(count, np.iinfo(np.uint16).max))
+
+        posting_terms = np.array(posting_terms, dtype=np.int32)
+
+        # Group the postings by term, a stable sort keeps the rows of every term in order
+        order = np.argsort(posting_terms, kind="stable")
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum(np.bincount(posting_terms, minlength=len(terms)))
+
+        return cls(
+            ids,
+            terms,
+            term_offsets,
+            np.array(posting_rows, dtype=np.int32)[order],
+            np.array(posting_freqs, dtype=np.uint16)[order],
+            np.array(chunk_lengths, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path: str) -> "KeywordIndex":
+        with np.load(path) as arrays:
+            return cls(
+                arrays["ids"].tolist(),
+                {term: term_id for term_id, term in enumerate(arrays["terms"].tolist())},
+                arrays["term_offsets"],
+                arrays["posting_rows"],
+                arrays["posting_freqs"],
+                arrays["chunk_lengths"])
+
+    def save(self, path: str) -> None:
+        # Write to a temporary file first, so readers never see a partly written index
+        temporary_path = f"{path}.tmp.npz"
+
+        np.savez(
+            temporary_path,
+            ids=np.array(self.ids, dtype=str),
+            terms=np.array(list(self.terms), dtype=str),
+            term_offsets=self.term_offsets,
+            posting_rows=self.posting_rows,
+            posting_freqs=self.posting_freqs,
+            chunk_lengths=self.chunk_lengths)
+        os.replace(temporary_path, path)
+
+    def _postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        # The rows and occurrences of the chunks that contain the term, and its idf
+        term_id = self.terms.get(term)
+
+        if term_id is None:
+            return None
+
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        document_frequency = end - start
+        idf = np.log(1 + (len(self.ids) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        return self.posting_rows[start:end], self.posting_freqs[start:end].astype(np.float32), idf
+
+    def scores(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every chunk for the query."""
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+
+            if postings is None:
+                continue
+
+            rows, freqs, idf = postings
+            scores[rows] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norms[rows])
+
+        return scores
+
+    def coverage(self, query: str) -> Dict[str, float]:
+        """Returns the share of the query terms every chunk contains, weighted by their idf.
+
+        Unlike the BM25 score, the coverage does not depend on the length of the
+        chunk nor on the size of the document, so it can be compared to a fixed
+        threshold: a chunk that contains every term of an identifier query, such
+        as "CS-101", has a coverage of 1. Question words, terms that are not in
+        the document and terms found in more than half of the chunks, which match
+        anything, are left out. Chunks without any of the other terms are left out.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            Dict[str, float]: The coverage of the chunks that contain a query term, by id.
+        """
+
+        coverage = np.zeros(len(self.ids))
+        total_idf = 0.0
+
+        for term in set(tokenize(query)) - _QUESTION_WORDS:
+            postings = self._postings(term)
+
+            if postings is None or 2 * len(postings[0]) > len(self.ids):
+                continue
+
+            rows, _, idf = postings
+            coverage[rows] += idf
+            total_idf += idf
+
+        return {self.ids[row]: float(coverage[row] / total_idf) for row in np.flatnonzero(coverage)}
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Returns the ids and BM25 scores of the `top_k` best chunks, chunks without any query term are left out."""
+
+        scores = self.scores(query)
+        rows = np.flatnonzero(scores > 0)
+
+        if len(rows) > top_k:
+            rows = rows[np.argpartition(-scores[rows], top_k - 1)[:top_k]]
+
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+
+        return [(self.ids[row], float(scores[row])) for row in rows]
+
+
+class KeywordIndexStore:
+    """Keyword indexes of every document, saved as one file per document and cached in memory.
+
+    An index is reloaded when its file changes, so the indexes built by the
+    ingestion of another worker are picked up by the next query.
+    """
+
+    def __init__(self, path: str = KEYWORD_INDEX_PATH):
+        self.path = path
+        self._indexes: Dict[str, Tuple[tuple, KeywordIndex]] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def _index_path(self, doc_key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(doc_key.encode("utf-8")).hexdigest()[:32] + ".npz")
+
+    def build(self, doc_key: str, chunks: Iterable[Tuple[str, str]]) -> KeywordIndex:
+        """Builds and saves the index of a document, replacing the previous one."""
+
+        index = KeywordIndex.build(chunks)
+        index.save(self._index_path(doc_key))
+
+        with self._lock:
+            self._indexes.pop(doc_key, None)
+
+        return index
+
+    def get(self, doc_key: str) -> Optional[KeywordIndex]:
+        """Returns the index of a document, or None when the document has no index yet."""
+
+        path = self._index_path(doc_key)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            cached = self._indexes.get(doc_key)
+
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        index = KeywordIndex.load(path)
+
+        with self._lock:
+            self._indexes[doc_key] = (version, index)
+
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]],
+                           k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuses several rankings of ids with reciprocal rank fusion.
+
+    Every ranking adds 1 / (k + rank) to the score of the ids it contains, so ids
+    ranked well by several retrievers come first, whatever the scale of their scores.
+
+    Args:
+        rankings (Sequence[Sequence[str]]): The ids of every ranking, best first.
+        k (int, optional): The rank constant, larger values flatten the contribution of the top ranks. Default is RRF_K.
+
+    Returns:
+        List[Tuple[str, float]]: The ids and fused scores, best first.
+    """
+
+    fused_scores = {}
+
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused_scores[item_id] = fused_scores.get(item_id, 0.0) + 1.0 / (k + rank)
+
+    return sorted(fused_scores.items(), key=lambda item: item[1], reverse=True)
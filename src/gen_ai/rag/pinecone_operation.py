@@ -1,32 +1,204 @@
 from langchain.embeddings import OpenAIEmbeddings
+from typing import Dict, Optional
+import asyncio
 import logging
 
+from src.config import (
+    HYBRID_SEARCH_CANDIDATES
+)
+from src.gen_ai.rag.keyword_index import (
+    reciprocal_rank_fusion
+)
 
-def retrieve_top_k_similar_search_from_vector_db(
+
+async def aretrieve_top_k_similar_search_from_vector_db(
         username:str, 
         doc_key: str,
         query: str,
         top_k: int,
         embedding_model: OpenAIEmbeddings,
-        pinecone_index
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        include_values: bool=False
         
 ):
-    embedding_query=embedding_model.embed_query(query)
+    """Retrieves the top k matches of a query without blocking the event loop.
+
+    The query is embedded with the async embedding call, and the vector store query, 
+    keyword search and document store lookup, which are blocking, run in a worker thread.
+    """
+    
+    embedding_query=await embedding_model.aembed_query(query)
     
     logging.info("len of emdedding query: ",len(embedding_query))
     
+    return await asyncio.to_thread(
+        search_vector_db,
+        username=username,
+        doc_key=doc_key,
+        query=query,
+        embedding_query=embedding_query,
+        top_k=top_k,
+        pinecone_index=pinecone_index,
+        document_store=document_store,
+        keyword_index_store=keyword_index_store,
+        include_values=include_values
+    )
+
+
+def search_vector_db(
+        username:str, 
+        doc_key: str,
+        query: str,
+        embedding_query: list,
+        top_k: int,
+        pinecone_index,
+        document_store=None,
+        keyword_index_store=None,
+        include_values: bool=False
+):
+    """Retrieves the top k matches of an embedded query and loads their text.
+
+    Args:
+        username (str): username
+        doc_key (str): unique document key
+        query (str): the query text, used by the keyword search
+        embedding_query (list): the embedding of the query
+        top_k (int): number of matches to return
+        pinecone_index (VectorStore): the vector store
+        document_store (DocumentStore, optional): local store that holds the text of the chunks
+        keyword_index_store (KeywordIndexStore, optional): BM25 keyword indexes fused with the vector search
+        include_values (bool, optional): whether to return the vector values of the matches. Default is False.
+
+    Returns:
+        list: the matches, best first
+    """
+    
+    # with a keyword index, retrieve a wider set of candidates from both retrievers and fuse them
+    keyword_index=None
+    if keyword_index_store is not None and document_store is not None:
+        keyword_index=keyword_index_store.get(doc_key)
+    
     results=pinecone_index.query(
         vector=embedding_query,
         filter={
             "username": {"$eq": username},
             "doc_key": doc_key
         },
-        top_k=top_k,
-        include_metadata=True
+        top_k=max(top_k,HYBRID_SEARCH_CANDIDATES) if keyword_index is not None else top_k,
+        include_metadata=True,
+        include_values=include_values
     )
     
     logging.info("results_similar_search ",results)
     
-    return results['matches']
+    matches=results['matches']
+    
+    if keyword_index is not None:
+        matches=fuse_keyword_matches(
+            vector_matches=matches,
+            keyword_matches=keyword_index.search(query,max(top_k,HYBRID_SEARCH_CANDIDATES)),
+            doc_key=doc_key,
+            top_k=top_k,
+            keyword_coverage=keyword_index.coverage(query)
+        )
+    
+    if document_store is not None:
+        load_chunk_texts(matches,document_store)
+    
+    return matches
+
+
+def fuse_keyword_matches(vector_matches: list,
+                         keyword_matches: list,
+                         doc_key: str,
+                         top_k: int,
+                         keyword_coverage: Optional[Dict[str, float]] = None) -> list:
+    """Fuses vector matches with BM25 keyword matches by reciprocal rank fusion and keeps the top k.
+
+    Every fused match keeps the cosine similarity of its vector match as its score, 
+    so the similarity threshold applies to the same scale as with vector search alone. 
+    A chunk that is only found by the keyword index has no cosine similarity, its 
+    score is None. The share of the query terms a match contains is kept as its 
+    keyword coverage, so that an exact keyword match counts as relevant whatever 
+    its cosine similarity.
+
+    Args:
+        vector_matches (list): The matches of a vector query, best first.
+        keyword_matches (list): The (id, BM25 score) pairs of a keyword search, best first.
+        doc_key (str): The document key of the matches.
+        top_k (int): Number of fused matches to keep.
+        keyword_coverage (Optional[Dict[str, float]], optional): The keyword coverage of the chunks, 
+            as returned by `KeywordIndex.coverage`. Default is None.
+
+    Returns:
+        list: The fused matches as dictionaries with id, score, rrf_score, keyword_coverage and metadata keys, 
+            best first, and the values of the vector matches when the vector query returned them.
+    """
+    
+    vector_matches_by_id={match['id']: match for match in vector_matches}
+    
+    fused=reciprocal_rank_fusion([
+        [match['id'] for match in vector_matches],
+        [vector_id for vector_id,_ in keyword_matches]
+    ])
+    
+    matches=[]
+    
+    for vector_id,rrf_score in fused[:top_k]:
+        vector_match=vector_matches_by_id.get(vector_id)
+        
+        match={
+            "id":vector_id,
+            "score":vector_match['score'] if vector_match is not None else None,
+            "rrf_score":rrf_score,
+            "keyword_coverage":keyword_coverage.get(vector_id,0.0) if keyword_coverage is not None else 0.0,
+            "metadata":dict(vector_match['metadata']) if vector_match is not None else {"doc_key":doc_key}
+        }
+        
+        if vector_match is not None and 'values' in vector_match:
+            match['values']=vector_match['values']
+        
+        matches.append(match)
+    
+    return matches
+
+
+def load_chunk_texts(matches: list,
+                     document_store) -> list:
+    """Fills in the text of every match from the document store, in one bulk lookup.
+
+    Vectors indexed before the document store keep their text in the metadata, 
+    those matches are left as they are. The readability counts of the chunk are 
+    filled in as well when they are stored.
+
+    Args:
+        matches (list): The matches of a Pinecone query.
+        document_store (DocumentStore): The store that keeps the chunk text.
+
+    Returns:
+        list: The same matches, with the text in the metadata of every match.
+    """
+    
+    stored_chunks=document_store.get_many([match['id'] for match in matches])
+    
+    for match in matches:
+        stored_chunk=stored_chunks.get(match['id'])
+        
+        if stored_chunk is None:
+            if 'text' not in match['metadata']:
+                logging.warning(f"text of vector {match['id']} is missing from the document store")
+                match['metadata']['text']=""
+            continue
+        
+        match['metadata']['text']=stored_chunk['text']
+        match['metadata']['start']=stored_chunk['start']
+        match['metadata']['end']=stored_chunk['end']
+        
+        if stored_chunk['readability'] is not None:
+            match['metadata']['readability']=stored_chunk['readability']
+    
+    return matches
 
     
\ No newline at end of file
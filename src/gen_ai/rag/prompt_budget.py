@@ -0,0 +1,163 @@
+from typing import List, Optional, Tuple
+import logging
+import threading
+
+import tiktoken
+
+from src.config import (
+    PROMPT_TOKEN_ENCODING,
+    PROMPT_HISTORY_MAX_TOKENS,
+    PROMPT_CONTEXT_MAX_TOKENS
+)
+
+
+# Rough size of a token of English text, used when the tokenizer can not be loaded
+_CHARACTERS_PER_TOKEN = 4
+
+# Prefixes of the history messages in the prompts, as LangChain formats a chat history
+_ROLE_PREFIXES = {
+    "user": "Human",
+    "assistant": "AI"
+}
+
+_TRUNCATION_MARKER = " ..."
+
+
+class TokenCounter:
+    """Counts the tokens of prompt text locally with the tokenizer of the chat model.
+
+    The tiktoken encoding is loaded on first use. When it can not be loaded, for
+    instance because its file can not be downloaded, tokens are estimated from
+    the number of characters so that prompts stay bounded all the same.
+    """
+
+    def __init__(self, encoding_name: str = PROMPT_TOKEN_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logging.warning(f"can not load the {self.encoding_name} tokenizer, estimating token counts: {e}")
+                    self._loaded = True
+
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """Returns the number of tokens of a text."""
+
+        encoding = self._get_encoding()
+
+        if encoding is None:
+            return -(-len(text) // _CHARACTERS_PER_TOKEN)
+
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Returns the beginning of a text that holds at most `max_tokens` tokens."""
+
+        encoding = self._get_encoding()
+
+        if encoding is None:
+            return text[:max_tokens * _CHARACTERS_PER_TOKEN]
+
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+token_counter = TokenCounter()
+
+
+def format_history_message(message) -> Optional[str]:
+    """Formats one history message as a line of the prompt, None for messages of an unknown role."""
+
+    prefix = _ROLE_PREFIXES.get(message.role)
+
+    if prefix is None:
+        logging.info("sender of this message is not valid")
+        return None
+
+    return f"{prefix}: {message.content}"
+
+
+def assemble_chat_history(history_messages: List,
+                          max_tokens: int = PROMPT_HISTORY_MAX_TOKENS,
+                          counter: TokenCounter = token_counter) -> Tuple[str, int, int]:
+    """Formats the most recent messages of a conversation that fit in a token budget.
+
+    Messages are added from the newest to the oldest, and the oldest ones that
+    no longer fit are dropped. When even the newest message does not fit, its
+    beginning is kept.
+
+    Args:
+        history_messages (List): The messages before the latest user query, oldest first.
+        max_tokens (int, optional): The token budget of the history. Default is PROMPT_HISTORY_MAX_TOKENS.
+        counter (TokenCounter, optional): The token counter. Default is the shared counter.
+
+    Returns:
+        Tuple[str, int, int]: The history text, its number of tokens and the number of messages kept.
+    """
+
+    lines = []
+    # every line but the first is preceded by a line break, counted with the line
+    tokens = 0
+
+    for message in reversed(history_messages):
+        line = format_history_message(message)
+
+        if line is None:
+            continue
+
+        line_tokens = counter.count(line) + (1 if lines else 0)
+
+        if tokens + line_tokens > max_tokens:
+            if not lines and max_tokens > 0:
+                line = counter.truncate(line, max(max_tokens - counter.count(_TRUNCATION_MARKER), 0)) + _TRUNCATION_MARKER
+                lines.append(line)
+                tokens = counter.count(line)
+            break
+
+        lines.append(line)
+        tokens += line_tokens
+
+    return "\n".join(reversed(lines)), tokens, len(lines)
+
+
+def assemble_context(similar_results: List[dict],
+                     max_tokens: int = PROMPT_CONTEXT_MAX_TOKENS,
+                     counter: TokenCounter = token_counter) -> Tuple[str, int, int]:
+    """Packs the retrieved passages that fit in a token budget, the best ranked first.
+
+    The passages are taken in the order of the matches, which are ranked best
+    first; a passage that does not fit in the remaining budget is skipped and
+    shorter, lower ranked ones may still take its place.
+
+    Args:
+        similar_results (List[dict]): The retrieved matches, best first, with their text in the metadata.
+        max_tokens (int, optional): The token budget of the context. Default is PROMPT_CONTEXT_MAX_TOKENS.
+        counter (TokenCounter, optional): The token counter. Default is the shared counter.
+
+    Returns:
+        Tuple[str, int, int]: The context text, its number of tokens and the number of passages kept.
+    """
+
+    passages = []
+    tokens = 0
+
+    for match in similar_results:
+        passage = match["metadata"]["text"]
+        # passages are separated by a blank line, counted with the passage
+        passage_tokens = counter.count(passage) + (1 if passages else 0)
+
+        if tokens + passage_tokens > max_tokens:
+            continue
+
+        passages.append(passage)
+        tokens += passage_tokens
+
+    return "\n\n".join(passages), tokens, len(passages)
@@ -89,4 +89,58 @@ Question:
 
 ----------
 Response (in correct formatting):
-"""
\ No newline at end of file
+"""
+
+SUMMARIZE_DOCUMENT_SECTION_TEMPLATE = """
+You are a friendly expert summarizing one section of a longer document.
+ 
+Instructions:
+1. Summarize the section below in a few paragraphs, retaining key technical details, terms, names and figures.
+2. Strictly use the provided text, don't use your external knowledge.
+3. Write plain paragraphs without headings, the summary is later combined with the summaries of the other sections.
+
+----------
+Section of the original document:
+{text}
+
+----------
+Summary of the section:
+"""
+
+COMBINE_SECTION_SUMMARIES_TEMPLATE = """
+You are a friendly expert summarizing a long document from the summaries of its consecutive sections.
+ 
+Instructions:
+1. Combine the summaries below into one summary that follows the order of the document.
+2. Retain key technical details and remove repetitions.
+3. Strictly use the provided summaries, don't use your external knowledge.
+4. Write plain paragraphs without headings.
+
+----------
+Summaries of consecutive sections of the original document:
+{text}
+
+----------
+Combined summary:
+"""
+
+SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE = """
+You are a friendly expert to give an overview of a whole document from the summaries of its sections.
+ 
+Instructions:
+1. Use clear language and present the main topics of the document in the order they appear.
+2. Retain key technical details.
+3. Use Markdown formatting to enhance readability with headings, list items, paraphragh. Apply headings, lists, and appropriate line spacing where necessary.
+4. Strictly use provided summaries, don't use your external knowledge.
+5. The length of your response should be align with user's preferred response length.
+----------
+Summaries of the sections of the original document:
+{text}
+
+----------
+User preferred response length:
+{preferred_response_length}
+
+----------
+Response (in correct formatting):
+"""
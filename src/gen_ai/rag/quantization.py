@@ -0,0 +1,320 @@
+import numpy as np
+
+
+class ScalarQuantizedVectors:
+    """Vectors compressed to int8 codes with one float32 scale per vector, 4 times smaller than float32.
+
+    Scores are approximate inner products, computed in blocks so that only a
+    block of codes is converted back to float32 at once.
+    """
+
+    def __init__(self,
+                 codes: np.ndarray,
+                 scales: np.ndarray,
+                 block_size: int = 1024):
+        self.codes = codes
+        self.scales = scales
+        self.block_size = block_size
+
+    @classmethod
+    def from_vectors(cls,
+                     vectors: np.ndarray,
+                     block_size: int = 1024) -> "ScalarQuantizedVectors":
+        """Quantizes float32 vectors, reading them a block at a time so memory-mapped vectors are never fully loaded.
+
+        Args:
+            vectors (np.ndarray): The (num_vectors, dimension) float32 vectors.
+            block_size (int, optional): Number of vectors quantized at once. Default is 1024.
+
+        Returns:
+            ScalarQuantizedVectors: The quantized vectors.
+        """
+
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(len(vectors), dtype=np.float32)
+
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            block_scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127
+
+            codes[start:start + len(block)] = np.round(block / block_scales[:, None])
+            scales[start:start + len(block)] = block_scales
+
+        return cls(codes, scales, block_size)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def extended(self, vectors: np.ndarray) -> "ScalarQuantizedVectors":
+        """Returns a copy with the rows of `vectors` that follow the quantized ones appended, only those rows are quantized."""
+
+        appended = self.from_vectors(vectors[len(self.codes):], self.block_size)
+
+        return ScalarQuantizedVectors(
+            np.concatenate([self.codes, appended.codes]),
+            np.concatenate([self.scales, appended.scales]),
+            self.block_size)
+
+    def reencoded(self, vectors: np.ndarray) -> "ScalarQuantizedVectors":
+        """Returns the quantized copy of other vectors, every row is quantized on its own."""
+
+        return self.from_vectors(vectors, self.block_size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Returns the approximate inner product of the query with every vector."""
+
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        block = np.empty((self.block_size, self.codes.shape[1]), dtype=np.float32)
+
+        for start in range(0, len(self.codes), self.block_size):
+            end = min(start + self.block_size, len(self.codes))
+            block[:end - start] = self.codes[start:end]
+            scores[start:end] = block[:end - start] @ query_vector
+
+        return scores * self.scales
+
+
+class ProductQuantizedVectors:
+    """Vectors compressed with product quantization, one byte per subspace.
+
+    The vector is cut into `num_subspaces` slices, and every slice is replaced by
+    the index of its nearest centroid among 256 learned on the slices of the same
+    vectors. With 96 subspaces a 1536 dimensional float32 vector takes 96 bytes
+    of codes. Scores are approximate inner products computed from a table of the
+    inner products of the query slices with every centroid.
+    """
+
+    def __init__(self,
+                 codebooks: np.ndarray,
+                 codes: np.ndarray,
+                 num_trained: int = 0,
+                 block_size: int = 1024):
+        self.codebooks = codebooks
+        self.codes = codes
+        # Number of vectors the codebooks were learned on
+        self.num_trained = num_trained
+        self.block_size = block_size
+
+        # Offsets of every code in the flattened lookup table, so scoring is a single gather
+        num_subspaces, num_centroids, _ = codebooks.shape
+        self._table_offsets = np.arange(num_subspaces, dtype=np.int64) * num_centroids
+
+    @classmethod
+    def from_vectors(cls,
+                     vectors: np.ndarray,
+                     num_subspaces: int = 96,
+                     num_centroids: int = 256,
+                     num_iterations: int = 8,
+                     training_size: int = 2048,
+                     block_size: int = 1024,
+                     seed: int = 0) -> "ProductQuantizedVectors":
+        """Learns the centroids of every subspace with k-means on a sample of the vectors, then encodes all of them.
+
+        Args:
+            vectors (np.ndarray): The (num_vectors, dimension) float32 vectors.
+            num_subspaces (int, optional): Number of slices per vector, lowered to the nearest divisor of the dimension. Default is 96.
+            num_centroids (int, optional): Number of centroids per subspace, at most 256. Default is 256.
+            num_iterations (int, optional): Number of k-means iterations. Default is 8.
+            training_size (int, optional): Maximum number of vectors the centroids are learned on. Default is 2048.
+            block_size (int, optional): Number of vectors encoded at once. Default is 1024.
+            seed (int, optional): Seed of the random sampling. Default is 0.
+
+        Returns:
+            ProductQuantizedVectors: The quantized vectors.
+        """
+
+        num_vectors, dimension = vectors.shape
+
+        while dimension % num_subspaces:
+            num_subspaces -= 1
+
+        subspace_dimension = dimension // num_subspaces
+        num_centroids = min(num_centroids, 256, num_vectors)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(num_vectors, size=min(training_size, num_vectors), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32).reshape(len(sample_rows), num_subspaces, subspace_dimension)
+
+        codebooks = np.empty((num_subspaces, num_centroids, subspace_dimension), dtype=np.float32)
+
+        for subspace in range(num_subspaces):
+            codebooks[subspace] = _kmeans(sample[:, subspace], num_centroids, num_iterations, rng)
+
+        return cls(codebooks, _encode(vectors, codebooks, block_size), len(sample_rows), block_size)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def extended(self, vectors: np.ndarray) -> "ProductQuantizedVectors":
+        """Returns a copy with the rows of `vectors` that follow the encoded ones appended, encoded with the same codebooks."""
+
+        appended = _encode(vectors[len(self.codes):], self.codebooks, self.block_size)
+
+        return ProductQuantizedVectors(self.codebooks, np.concatenate([self.codes, appended]), self.num_trained, self.block_size)
+
+    def reencoded(self, vectors: np.ndarray) -> "ProductQuantizedVectors":
+        """Returns other vectors encoded with the same codebooks, which are not learned again."""
+
+        return ProductQuantizedVectors(self.codebooks, _encode(vectors, self.codebooks, self.block_size), self.num_trained, self.block_size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Returns the approximate inner product of the query with every vector."""
+
+        num_subspaces, _, subspace_dimension = self.codebooks.shape
+
+        # Inner product of every query slice with every centroid of its subspace
+        table = np.einsum(
+            "mkd,md->mk",
+            self.codebooks,
+            query_vector.reshape(num_subspaces, subspace_dimension))
+
+        return table.ravel()[self.codes + self._table_offsets].sum(axis=1)
+
+
+def _encode(vectors: np.ndarray,
+            codebooks: np.ndarray,
+            block_size: int) -> np.ndarray:
+    # Index of the nearest centroid of every slice, a block of vectors at a time
+    num_subspaces, _, subspace_dimension = codebooks.shape
+    codes = np.empty((len(vectors), num_subspaces), dtype=np.uint8)
+
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        block = block.reshape(len(block), num_subspaces, subspace_dimension)
+
+        for subspace in range(num_subspaces):
+            codes[start:start + len(block), subspace] = _nearest_centroids(block[:, subspace], codebooks[subspace])
+
+    return codes
+
+
+def _nearest_centroids(points: np.ndarray,
+                       centroids: np.ndarray) -> np.ndarray:
+    # The squared norm of the points does not change which centroid is nearest
+    distances = (centroids * centroids).sum(axis=1) - 2 * points @ centroids.T
+
+    return distances.argmin(axis=1)
+
+
+def _kmeans(points: np.ndarray,
+            num_centroids: int,
+            num_iterations: int,
+            rng: np.random.Generator) -> np.ndarray:
+    centroids = points[rng.choice(len(points), size=num_centroids, replace=False)].copy()
+
+    for _ in range(num_iterations):
+        assignments = _nearest_centroids(points, centroids)
+
+        counts = np.bincount(assignments, minlength=num_centroids)
+        sums = np.stack([
+            np.bincount(assignments, weights=points[:, dimension], minlength=num_centroids)
+            for dimension in range(points.shape[1])
+        ], axis=1)
+
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    return centroids
+
+
+def product_quantization_is_smaller(num_vectors: int,
+                                    dimension: int,
+                                    num_subspaces: int = 96) -> bool:
+    """Tells whether product quantization codes and their codebooks take less memory than int8 codes.
+
+    The codebooks hold 256 centroids per subspace, as much as 256 float32
+    vectors, about 1.5 MB for 1536 dimensions, so they only pay off for
+    partitions of more than about a thousand vectors.
+
+    Args:
+        num_vectors (int): Number of vectors to compress.
+        dimension (int): Dimension of the vectors.
+        num_subspaces (int, optional): Number of subspaces of product quantization. Default is 96.
+
+    Returns:
+        bool: Whether product quantization is smaller.
+    """
+
+    product_bytes = num_vectors * num_subspaces + 4 * dimension * min(256, num_vectors)
+    scalar_bytes = num_vectors * (dimension + 4)
+
+    return product_bytes < scalar_bytes
+
+
+def quantize_vectors(vectors: np.ndarray,
+                     quantization: str,
+                     num_subspaces: int = 96):
+    """Compresses vectors with the given quantization.
+
+    Product quantization falls back to int8 codes for vectors too few for its
+    codebooks to pay off, such as the partition of a short document.
+
+    Args:
+        vectors (np.ndarray): The (num_vectors, dimension) float32 vectors.
+        quantization (str): "int8" for scalar quantization or "pq" for product quantization.
+        num_subspaces (int, optional): Number of subspaces of product quantization. Default is 96.
+
+    Returns:
+        The quantized vectors, exposing `scores(query_vector)` and `nbytes`.
+    """
+
+    if quantization == "int8" or (quantization == "pq" and not product_quantization_is_smaller(*vectors.shape, num_subspaces)):
+        return ScalarQuantizedVectors.from_vectors(vectors)
+
+    if quantization == "pq":
+        return ProductQuantizedVectors.from_vectors(vectors, num_subspaces=num_subspaces)
+
+    raise ValueError(f"unknown quantization {quantization}")
+
+
+def update_quantized_vectors(quantized,
+                             vectors: np.ndarray,
+                             quantization: str,
+                             num_subspaces: int = 96,
+                             rows_appended: bool = True,
+                             training_size: int = 2048):
+    """Updates the compressed copy of vectors that changed since it was built.
+
+    When rows were only appended, only the new rows are encoded. Otherwise, such
+    as after a compaction, every row is encoded again, with the same codebooks
+    for product quantization. The codebooks are only learned again once the
+    vectors outnumber twice those they were learned on, up to `training_size`,
+    so that the codebooks of a growing partition are not stuck with its first
+    rows while the cost of learning them stays amortized. Vectors kept as int8
+    codes because they were too few for product quantization are encoded with
+    it once they are enough.
+
+    Args:
+        quantized: The compressed copy of the previous version of the vectors, or None.
+        vectors (np.ndarray): The (num_vectors, dimension) float32 vectors.
+        quantization (str): "int8" for scalar quantization or "pq" for product quantization.
+        num_subspaces (int, optional): Number of subspaces of product quantization. Default is 96.
+        rows_appended (bool, optional): Whether the quantized rows are the first rows of `vectors`, unchanged. Default is True.
+        training_size (int, optional): Maximum number of vectors the codebooks are learned on. Default is 2048.
+
+    Returns:
+        The quantized vectors, exposing `scores(query_vector)` and `nbytes`.
+    """
+
+    if quantized is None:
+        return quantize_vectors(vectors, quantization, num_subspaces=num_subspaces)
+
+    if isinstance(quantized, ProductQuantizedVectors) and len(vectors) > 2 * quantized.num_trained and quantized.num_trained < training_size:
+        return ProductQuantizedVectors.from_vectors(vectors, num_subspaces=num_subspaces)
+
+    if quantization == "pq" and isinstance(quantized, ScalarQuantizedVectors) and product_quantization_is_smaller(*vectors.shape, num_subspaces):
+        return quantize_vectors(vectors, quantization, num_subspaces=num_subspaces)
+
+    if rows_appended and len(quantized) <= len(vectors):
+        return quantized.extended(vectors)
+
+    return quantized.reencoded(vectors)
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from typing import List, Optional
+import hashlib
+import json
+import re
+import threading
+
+from src.config import CONDENSATION_CACHE_MAX_ENTRIES
+
+
+# Words that refer back to an earlier turn of the conversation
+_REFERRING_WORDS = frozenset({
+    "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
+    "he", "him", "his", "she", "her", "hers",
+    "this", "that", "these", "those", "there",
+    "former", "latter", "above", "previous", "previously", "earlier",
+    "aforementioned", "mentioned", "same", "else", "again", "more", "further"
+})
+
+# Demonstratives followed by one of these nouns name the document itself, which needs no history
+_DOCUMENT_NOUNS = frozenset({
+    "document", "doc", "pdf", "file", "paper", "book", "report", "text"
+})
+
+# Openings of follow-ups that continue the previous answer
+_FOLLOW_UP_OPENINGS = (
+    "and ", "but ", "so ", "then ", "what about", "how about", "why",
+    "elaborate", "explain more", "tell me more", "continue", "go on"
+)
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def is_self_contained(question: str,
+                      min_words: int = 4) -> bool:
+    """Tells whether a question can be understood without the earlier turns of the conversation.
+
+    The check is conservative: a question is only self-contained when it has at
+    least `min_words` words, does not open like a follow-up ("why", "what about",
+    "and ...") and has no pronoun or demonstrative that may refer back, except
+    "this document" and the like. Anything else goes through condensation.
+
+    Args:
+        question (str): The latest user question.
+        min_words (int, optional): Minimum number of words of a self-contained question. Default is 4.
+
+    Returns:
+        bool: True when the question can be used as the standalone query as is.
+    """
+
+    normalized = " ".join(question.lower().split())
+    words = _WORD_PATTERN.findall(normalized)
+
+    if len(words) < min_words or normalized.startswith(_FOLLOW_UP_OPENINGS):
+        return False
+
+    for position, word in enumerate(words):
+        if word not in _REFERRING_WORDS:
+            continue
+
+        next_word = words[position + 1] if position + 1 < len(words) else None
+
+        if word in ("this", "that", "these", "those") and next_word in _DOCUMENT_NOUNS:
+            continue
+
+        return False
+
+    return True
+
+
+def condensation_cache_key(history_messages: List, question: str) -> str:
+    """Builds the cache key of a condensation from a hash of the roles and contents of the history and the question."""
+
+    payload = json.dumps([[message.role, message.content] for message in history_messages] + [question])
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CondensationCache:
+    """In-process LRU cache of the standalone queries of past (history, question) pairs."""
+
+    def __init__(self, max_entries: int = CONDENSATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            standalone_query = self._entries.get(key)
+
+            if standalone_query is not None:
+                self._entries.move_to_end(key)
+
+            return standalone_query
+
+    def set(self, key: str, standalone_query: str) -> None:
+        with self._lock:
+            self._entries[key] = standalone_query
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
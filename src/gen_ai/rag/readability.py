@@ -0,0 +1,140 @@
+from typing import Iterable, List, Tuple
+import json
+import math
+import re
+
+import textstat
+
+
+# Sentences as textstat counts them: from a word boundary up to the next run of terminators
+_SENTENCE_PATTERN = re.compile(r'\b[^.!?]+[.!?]*', re.UNICODE)
+_TERMINATOR_PATTERN = re.compile(r'[.!?]')
+_WORD_CHARACTER_PATTERN = re.compile(r'\w', re.UNICODE)
+
+# Flesch reading ease constants of English, the language textstat is set to
+_FRE_BASE = 206.835
+_FRE_SENTENCE_LENGTH = 1.015
+_FRE_SYLLABLES_PER_WORD = 84.6
+
+
+def readability_counts(text: str) -> dict:
+    """Counts the words, syllables and sentences of a chunk the way textstat does, computed once at indexing time.
+
+    Sentences are kept as their word counts, with whether the chunk starts or
+    ends inside a sentence, because a sentence cut by the chunking is counted
+    once when the chunks are joined, and textstat leaves short sentences out.
+
+    Args:
+        text (str): The text of the chunk.
+
+    Returns:
+        dict: The "words", "syllables" and "sentences" (word count of every sentence) of the chunk, and
+            "has_terminator", "open_start" and "open_end", which tell how its sentences join with the next chunks.
+    """
+
+    sentences = _SENTENCE_PATTERN.findall(text)
+    first_terminator = _TERMINATOR_PATTERN.search(text)
+    head = text[:first_terminator.start()] if first_terminator else text
+
+    return {
+        "words": textstat.lexicon_count(text),
+        "syllables": textstat.syllable_count(text),
+        "sentences": [textstat.lexicon_count(sentence) for sentence in sentences],
+        "has_terminator": first_terminator is not None,
+        "open_start": bool(_WORD_CHARACTER_PATTERN.search(head)),
+        "open_end": bool(sentences) and not _TERMINATOR_PATTERN.match(sentences[-1][-1])
+    }
+
+
+def chunk_readability(match: dict) -> dict:
+    """Returns the readability counts of a retrieved match, counted now for chunks indexed before they were stored."""
+
+    counts = match["metadata"].get("readability")
+
+    if counts is None:
+        return readability_counts(match["metadata"]["text"])
+
+    # vectors that keep their text in the metadata keep the counts as JSON
+    return json.loads(counts) if isinstance(counts, str) else counts
+
+
+def combine_readability_counts(chunk_counts: Iterable[dict]) -> Tuple[int, int, int]:
+    """Returns the words, sentences and syllables textstat counts in the chunks joined by spaces, in the given order.
+
+    A chunk that ends inside a sentence continues it into the next chunks, up to
+    the first terminator. Sentences of two words or less are not counted, and
+    there is at least one sentence, as in textstat.
+
+    Args:
+        chunk_counts (Iterable[dict]): The readability counts of the chunks, as returned by `readability_counts`.
+
+    Returns:
+        Tuple[int, int, int]: The number of words, sentences and syllables.
+    """
+
+    words = 0
+    syllables = 0
+    sentence_words: List[int] = []
+    # word count of a sentence that continues into the next chunk
+    pending = None
+
+    for counts in chunk_counts:
+        words += counts["words"]
+        syllables += counts["syllables"]
+        sentences = list(counts["sentences"])
+
+        if pending is not None:
+            if not counts["has_terminator"]:
+                # the whole chunk is part of the sentence
+                pending += sum(sentences)
+                continue
+
+            if counts["open_start"]:
+                sentences[0] += pending
+            else:
+                sentence_words.append(pending)
+
+            pending = None
+
+        if counts["open_end"]:
+            pending = sentences.pop()
+
+        sentence_words.extend(sentences)
+
+    if pending is not None:
+        sentence_words.append(pending)
+
+    return words, max(1, sum(1 for num_words in sentence_words if num_words > 2)), syllables
+
+
+def _legacy_round(number: float, points: int) -> float:
+    # textstat rounds half away from zero
+    p = 10 ** points
+    return float(math.floor((number * p) + math.copysign(0.5, number))) / p
+
+
+def flesch_reading_ease(chunk_counts: Iterable[dict]) -> float:
+    """Returns the Flesch reading ease of chunks joined by spaces from their readability counts.
+
+    The result is the one of textstat.flesch_reading_ease on the joined text,
+    with the same rounding of the averages, without counting syllables again.
+
+    Args:
+        chunk_counts (Iterable[dict]): The readability counts of the chunks, in the order they are joined.
+
+    Returns:
+        float: The Flesch reading ease score.
+    """
+
+    words, sentences, syllables = combine_readability_counts(chunk_counts)
+
+    average_sentence_length = _legacy_round(float(words / sentences), 1)
+    average_syllables_per_word = _legacy_round(float(syllables) / float(words), 1) if words else 0.0
+
+    flesch = (
+        _FRE_BASE
+        - float(_FRE_SENTENCE_LENGTH * average_sentence_length)
+        - float(_FRE_SYLLABLES_PER_WORD * average_syllables_per_word)
+    )
+
+    return _legacy_round(flesch, 2)
@@ -0,0 +1,87 @@
+from typing import List
+
+import numpy as np
+
+from src.config import (
+    MMR_LAMBDA,
+    MMR_DUPLICATE_SIMILARITY,
+    MMR_RELEVANCE_MARGIN,
+    MMR_MAX_KEYWORD_MATCHES
+)
+
+
+def _match_values(match):
+    # Pinecone matches raise an AttributeError for fields that were not returned
+    try:
+        return match['values'] or None
+    except (KeyError, AttributeError):
+        return None
+
+
+def select_diverse_matches(matches: list,
+                           max_matches: int,
+                           lambda_mult: float = MMR_LAMBDA,
+                           duplicate_similarity: float = MMR_DUPLICATE_SIMILARITY,
+                           relevance_margin: float = MMR_RELEVANCE_MARGIN,
+                           max_keyword_matches: int = MMR_MAX_KEYWORD_MATCHES) -> List:
+    """Selects the smallest set of relevant and diverse matches with maximal marginal relevance.
+
+    Matches are picked one at a time by `lambda_mult * relevance - (1 - lambda_mult) * redundancy`,
+    where the relevance is the cosine similarity score of the match and the redundancy
+    its highest cosine similarity with the matches already picked. The selection
+    stops early, with fewer than `max_matches` matches, once every candidate left
+    is either more than `relevance_margin` below the best score or a near duplicate,
+    more similar than `duplicate_similarity` to a picked match, such as the
+    overlapping neighbours of a chunk.
+
+    Matches need their vector values. Matches without values or without a cosine
+    score, found by keyword search only, can not be compared: they are kept, at
+    most `max_keyword_matches` of them, only when their fused rank is ahead of
+    the lowest ranked match picked by MMR. When no match can be compared, the
+    best `max_matches` are kept.
+
+    Args:
+        matches (list): The candidate matches with id, score, values and metadata, best first.
+        max_matches (int): Maximum number of matches to select.
+        lambda_mult (float, optional): Weight of relevance against diversity, between 0 and 1. Default is MMR_LAMBDA.
+        duplicate_similarity (float, optional): Similarity above which a candidate is a duplicate of a picked match. Default is MMR_DUPLICATE_SIMILARITY.
+        relevance_margin (float, optional): Largest gap below the best score a candidate may have. Default is MMR_RELEVANCE_MARGIN.
+        max_keyword_matches (int, optional): Maximum number of keyword only matches to keep. Default is MMR_MAX_KEYWORD_MATCHES.
+
+    Returns:
+        List: The selected matches, in the order they were picked, then the keyword only matches kept.
+    """
+
+    # fused rank of every match, matches are ranked best first
+    ranks = {id(match): rank for rank, match in enumerate(matches)}
+    comparable = [match for match in matches if _match_values(match) is not None and match['score'] is not None]
+    others = [match for match in matches if _match_values(match) is None or match['score'] is None]
+
+    if not comparable:
+        return others[:max_matches]
+
+    vectors = np.array([_match_values(match) for match in comparable], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    relevance = np.array([match['score'] for match in comparable], dtype=np.float32)
+
+    similarities = vectors @ vectors.T
+    redundancy = np.zeros(len(comparable), dtype=np.float32)
+    remaining = relevance >= relevance.max() - relevance_margin
+    selected = []
+
+    while len(selected) < max_matches and remaining.any():
+        mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        mmr_scores[~remaining] = -np.inf
+
+        best = int(mmr_scores.argmax())
+        selected.append(best)
+
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, similarities[best])
+        remaining &= redundancy < duplicate_similarity
+
+    picked = [comparable[row] for row in selected]
+    lowest_picked_rank = max(ranks[id(match)] for match in picked)
+    keyword_matches = [match for match in others if ranks[id(match)] < lowest_picked_rank]
+
+    return picked + keyword_matches[:max(0, min(max_keyword_matches, max_matches - len(picked)))]
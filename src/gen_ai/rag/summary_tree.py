@@ -0,0 +1,315 @@
+from typing import Dict, List, Optional
+import hashlib
+import logging
+import re
+
+from src.config import (
+    SUMMARY_SECTION_MAX_TOKENS,
+    SUMMARY_REDUCE_MAX_TOKENS,
+    SUMMARY_RESPONSE_LENGTHS,
+    SUMMARY_MAX_CONCURRENT_CALLS
+)
+from src.gen_ai.rag.chain_registry import chain_registry
+from src.gen_ai.rag.prompt_budget import TokenCounter, token_counter
+from src.gen_ai.rag.prompt_template import (
+    SUMMARIZE_DOCUMENT_SECTION_TEMPLATE,
+    COMBINE_SECTION_SUMMARIES_TEMPLATE,
+    SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE
+)
+
+
+# Levels of the summary tree, from the leaves to the root
+SECTION = "section"
+GROUP = "group"
+DOCUMENT = "document"
+
+# Words that ask for a summary of the whole document on their own
+_SUMMARY_WORDS = frozenset({
+    "summary", "summaries", "summarize", "summarise", "summarization", "overview",
+    "gist", "outline", "recap", "synopsis", "tldr", "takeaways"
+})
+
+# "main points", "key ideas" and the like
+_MAIN_WORDS = frozenset({"main", "key", "important", "major"})
+_POINT_WORDS = frozenset({"point", "points", "idea", "ideas", "topic", "topics", "theme", "themes", "concepts"})
+
+_DOCUMENT_NOUNS = frozenset({
+    "document", "doc", "pdf", "file", "paper", "book", "report", "text", "content", "contents"
+})
+
+# Words that do not narrow a request for a summary down to a topic
+_FILLER_WORDS = frozenset({
+    "a", "an", "the", "this", "that", "it", "its", "of", "in", "on", "for", "to", "and", "with",
+    "me", "us", "i", "you", "we", "please", "can", "could", "would", "will", "want", "need",
+    "give", "provide", "write", "make", "create", "tell", "show", "what", "whats", "is", "are",
+    "does", "do", "s", "about", "all", "whole", "entire", "overall", "general", "high", "level",
+    "brief", "briefly", "short", "quick", "long", "detailed", "medium", "tl", "dr", "cover", "covers"
+})
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def is_broad_summary_query(query: str) -> bool:
+    """Tells whether a query asks for a summary of the whole document rather than of one topic.
+
+    "Summarize this document", "What are the main points?" and "What is this
+    document about?" are broad, "Summarize the chapter on parsing" is not: every
+    word of a broad query is a summary word, a document noun or a filler word.
+
+    Args:
+        query (str): The standalone query.
+
+    Returns:
+        bool: True when the query can be answered from the summary of the whole document.
+    """
+
+    words = _WORD_PATTERN.findall(query.lower())
+    word_set = set(words)
+
+    asks_for_summary = (
+        bool(word_set & _SUMMARY_WORDS)
+        or bool(word_set & _MAIN_WORDS and word_set & _POINT_WORDS)
+        or ("about" in word_set and bool(word_set & _DOCUMENT_NOUNS))
+    )
+
+    if not asks_for_summary:
+        return False
+
+    allowed = _SUMMARY_WORDS | _MAIN_WORDS | _POINT_WORDS | _DOCUMENT_NOUNS | _FILLER_WORDS
+
+    return all(word in allowed for word in words)
+
+
+def node_id(level: str, child_ids: List[str], response_length: str = "") -> str:
+    """Derives the id of a summary node from its level and the ids of its children, so unchanged nodes keep their id."""
+
+    payload = "\n".join([level, response_length] + child_ids)
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def merge_chunk_texts(chunks: List[dict]) -> str:
+    """Joins consecutive chunks into the text they were split from, leaving out the overlap of every chunk with the previous one."""
+
+    parts = []
+    previous_end = None
+
+    for chunk in chunks:
+        overlap = max(previous_end - chunk["start"], 0) if previous_end is not None else 0
+        parts.append(chunk["text"][overlap:])
+        previous_end = chunk["end"]
+
+    return "".join(parts)
+
+
+def group_by_tokens(items: List[dict],
+                    max_tokens: int,
+                    counter: TokenCounter,
+                    min_items: int = 1) -> List[List[dict]]:
+    """Splits items with a text into consecutive groups of at most `max_tokens` tokens, and at least `min_items` items."""
+
+    groups = []
+    group = []
+    group_tokens = 0
+
+    for item in items:
+        tokens = counter.count(item["text"])
+
+        if group and group_tokens + tokens > max_tokens and len(group) >= min_items:
+            groups.append(group)
+            group = []
+            group_tokens = 0
+
+        group.append(item)
+        group_tokens += tokens
+
+    if group:
+        # a last group that is too small joins the previous one
+        if len(group) < min_items and groups:
+            groups[-1].extend(group)
+        else:
+            groups.append(group)
+
+    return groups
+
+
+def build_summary_tree(chunks: List[dict],
+                       llm,
+                       existing_nodes: Optional[Dict[str, dict]] = None,
+                       response_lengths: List[str] = SUMMARY_RESPONSE_LENGTHS,
+                       section_max_tokens: int = SUMMARY_SECTION_MAX_TOKENS,
+                       reduce_max_tokens: int = SUMMARY_REDUCE_MAX_TOKENS,
+                       max_concurrency: int = SUMMARY_MAX_CONCURRENT_CALLS,
+                       counter: TokenCounter = token_counter) -> List[dict]:
+    """Builds the map-reduce summary tree of a document.
+
+    Consecutive chunks are grouped into sections of at most `section_max_tokens`
+    tokens, and every section is summarized (map). Section summaries are then
+    combined, a few consecutive ones at a time, until they fit in
+    `reduce_max_tokens` tokens (reduce), and the document summary is written
+    from them once for every response length.
+
+    Nodes whose children are unchanged, found in `existing_nodes` by id, keep
+    their summary, so re-indexing a revised document only summarizes again the
+    sections that changed and the nodes above them.
+
+    Args:
+        chunks (List[dict]): The chunks of the document in document order, with id, text, start and end keys.
+        llm: The chat model that writes the summaries.
+        existing_nodes (Optional[Dict[str, dict]], optional): The current nodes of the document by id. Default is None.
+        response_lengths (List[str], optional): The response lengths of the document summaries. Default is SUMMARY_RESPONSE_LENGTHS.
+        section_max_tokens (int, optional): The maximum size of a section. Default is SUMMARY_SECTION_MAX_TOKENS.
+        reduce_max_tokens (int, optional): The maximum size of the input of a combining call. Default is SUMMARY_REDUCE_MAX_TOKENS.
+        max_concurrency (int, optional): The maximum number of concurrent LLM calls. Default is SUMMARY_MAX_CONCURRENT_CALLS.
+        counter (TokenCounter, optional): The token counter. Default is the shared counter.
+
+    Returns:
+        List[dict]: The nodes, with id, level, position, response_length, text, start and end keys.
+    """
+
+    existing_nodes = existing_nodes or {}
+    num_summarized = 0
+
+    def summarize(template, nodes, inputs):
+        # fills in the text of the nodes, reusing the summaries of unchanged nodes
+        nonlocal num_summarized
+        missing = [position for position, node in enumerate(nodes) if node["id"] not in existing_nodes]
+
+        if missing:
+            summaries = chain_registry.chain(template, llm).batch(
+                [inputs[position] for position in missing], max_concurrency=max_concurrency)
+            for position, summary in zip(missing, summaries):
+                nodes[position]["text"] = summary
+            num_summarized += len(missing)
+
+        for node in nodes:
+            if node["id"] in existing_nodes:
+                node["text"] = existing_nodes[node["id"]]["text"]
+
+        return nodes
+
+    if not chunks:
+        return []
+
+    # Map: summarize the sections of the document
+    sections = group_by_tokens(chunks, section_max_tokens, counter)
+    current = summarize(
+        SUMMARIZE_DOCUMENT_SECTION_TEMPLATE,
+        [
+            {
+                "id": node_id(SECTION, [chunk["id"] for chunk in section]),
+                "level": SECTION,
+                "position": position,
+                "response_length": "",
+                "start": section[0]["start"],
+                "end": section[-1]["end"]
+            }
+            for position, section in enumerate(sections)
+        ],
+        [{"text": merge_chunk_texts(section)} for section in sections])
+    tree = list(current)
+
+    # Reduce: combine consecutive summaries until they fit in one call
+    num_groups = 0
+
+    while len(current) > 1 and sum(counter.count(node["text"]) for node in current) > reduce_max_tokens:
+        groups = group_by_tokens(current, reduce_max_tokens, counter, min_items=2)
+        current = summarize(
+            COMBINE_SECTION_SUMMARIES_TEMPLATE,
+            [
+                {
+                    "id": node_id(GROUP, [node["id"] for node in group]),
+                    "level": GROUP,
+                    "position": num_groups + position,
+                    "response_length": "",
+                    "start": group[0]["start"],
+                    "end": group[-1]["end"]
+                }
+                for position, group in enumerate(groups)
+            ],
+            [{"text": "\n\n".join(node["text"] for node in group)} for group in groups])
+        num_groups += len(groups)
+        tree.extend(current)
+
+    # Root: the summary of the whole document at every response length
+    text = "\n\n".join(node["text"] for node in current)
+    tree.extend(summarize(
+        SUMMARIZE_WHOLE_DOCUMENT_TEMPLATE,
+        [
+            {
+                "id": node_id(DOCUMENT, [node["id"] for node in current], response_length),
+                "level": DOCUMENT,
+                "position": position,
+                "response_length": response_length,
+                "start": current[0]["start"],
+                "end": current[-1]["end"]
+            }
+            for position, response_length in enumerate(response_lengths)
+        ],
+        [{"text": text, "preferred_response_length": response_length} for response_length in response_lengths]))
+
+    logging.info(f"summary tree of {len(chunks)} chunks: {len(tree)} nodes, {num_summarized} summarized, "
+                 f"{len(tree) - num_summarized} reused")
+
+    return tree
+
+
+def top_summary_nodes(nodes: List[dict]) -> List[dict]:
+    """Returns the nodes the document summaries are written from, in document order.
+
+    These are the groups of the last reduce round, or the sections when they
+    fit in one call without being combined. Together they cover the whole
+    document within `reduce_max_tokens` tokens.
+
+    Args:
+        nodes (List[dict]): The nodes of the summary tree of a document.
+
+    Returns:
+        List[dict]: The nodes of the top level below the document summaries.
+    """
+
+    sections = sorted((node for node in nodes if node["level"] == SECTION), key=lambda node: node["position"])
+    groups = sorted((node for node in nodes if node["level"] == GROUP), key=lambda node: node["position"])
+
+    if not groups or not sections:
+        return sections
+
+    # Rounds are numbered one after the other, and only the first group of a round starts with the document
+    top = []
+
+    for group in reversed(groups):
+        top.append(group)
+
+        if group["start"] <= sections[0]["start"]:
+            break
+
+    return top[::-1]
+
+
+def build_document_summaries(doc_key: str,
+                             document_store,
+                             llm) -> None:
+    """
+    Rebuilds the summary tree of a document from the chunks in the document store, and stores it there.
+
+    When the summaries can not be built, the previous ones are dropped so that
+    summarization queries fall back to retrieval instead of using a stale tree.
+
+    Args:
+        doc_key (str): A unique identifier for the document.
+        document_store (DocumentStore): The store that keeps the chunk text and the summaries.
+        llm: The chat model that writes the summaries.
+
+    Returns:
+        None
+    """
+
+    try:
+        existing_nodes = {node["id"]: node for node in document_store.get_summaries(doc_key)}
+        nodes = build_summary_tree(document_store.get_document_chunks(doc_key), llm, existing_nodes=existing_nodes)
+    except Exception:
+        logging.exception(f"failed to build the summaries of document {doc_key}, summarization queries use retrieval")
+        document_store.put_summaries(doc_key, [])
+        return
+
+    document_store.put_summaries(doc_key, nodes)
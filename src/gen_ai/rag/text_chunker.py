@@ -0,0 +1,143 @@
+from collections import deque
+from typing import List, Sequence, Tuple
+
+
+# Same separators, tried in the same order, as LangChain's RecursiveCharacterTextSplitter
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+def split_text_spans(text: str,
+                     chunk_size: int = 512,
+                     chunk_overlap: int = 50,
+                     separators: Sequence[str] = DEFAULT_SEPARATORS) -> List[Tuple[int, int]]:
+    """
+    Splits a text into overlapping chunks and returns their (start, end) character offsets.
+
+    The chunk boundaries are the same as those of LangChain's RecursiveCharacterTextSplitter
+    with `keep_separator=True` and `strip_whitespace=True`, but the text is never copied:
+    pieces are tracked as offsets into the original text, separators are found with plain
+    substring search instead of regular expressions, and merged chunks are never joined.
+    `text[start:end]` is the chunk.
+
+    Args:
+        text (str): The input text to be split.
+        chunk_size (int, optional): The maximum size of each text chunk. Default is 512.
+        chunk_overlap (int, optional): The number of overlapping characters between consecutive chunks. Default is 50.
+        separators (Sequence[str], optional): Separators to split on, from the coarsest to the finest. Default is DEFAULT_SEPARATORS.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, end) offsets of every chunk, in text order.
+    """
+
+    if chunk_overlap > chunk_size:
+        raise ValueError(
+            f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+            f"({chunk_size}), should be smaller.")
+
+    spans = []
+    _split_spans(text, 0, len(text), list(separators), chunk_size, chunk_overlap, spans)
+
+    return spans
+
+
+def _split_spans(text: str,
+                 start: int,
+                 end: int,
+                 separators: List[str],
+                 chunk_size: int,
+                 chunk_overlap: int,
+                 spans: List[Tuple[int, int]]) -> None:
+    # Use the coarsest separator present in this piece of text
+    separator = separators[-1]
+    finer_separators = []
+
+    for i, candidate in enumerate(separators):
+        if candidate == "":
+            separator = candidate
+            break
+        if text.find(candidate, start, end) != -1:
+            separator = candidate
+            finer_separators = separators[i + 1:]
+            break
+
+    good_splits = []
+
+    for split in _iter_splits(text, start, end, separator):
+        if split[1] - split[0] < chunk_size:
+            good_splits.append(split)
+            continue
+
+        if good_splits:
+            _merge_splits(text, good_splits, chunk_size, chunk_overlap, spans)
+            good_splits = []
+
+        if not finer_separators:
+            spans.append(split)
+        else:
+            _split_spans(text, split[0], split[1], finer_separators, chunk_size, chunk_overlap, spans)
+
+    if good_splits:
+        _merge_splits(text, good_splits, chunk_size, chunk_overlap, spans)
+
+
+def _iter_splits(text: str,
+                 start: int,
+                 end: int,
+                 separator: str):
+    # Every separator starts a new split, so it is kept at the start of the split that follows it
+    if separator == "":
+        for position in range(start, end):
+            yield position, position + 1
+        return
+
+    split_start = start
+    position = text.find(separator, start, end)
+
+    while position != -1:
+        if position > split_start:
+            yield split_start, position
+        split_start = position
+        position = text.find(separator, position + len(separator), end)
+
+    if end > split_start:
+        yield split_start, end
+
+
+def _merge_splits(text: str,
+                  splits: List[Tuple[int, int]],
+                  chunk_size: int,
+                  chunk_overlap: int,
+                  spans: List[Tuple[int, int]]) -> None:
+    # Splits are contiguous, so a run of splits is the span from the first start to the last end
+    current = deque()
+    total = 0
+
+    for split in splits:
+        length = split[1] - split[0]
+
+        if total + length > chunk_size and current:
+            _append_stripped(text, current[0][0], current[-1][1], spans)
+
+            # Keep the tail of the current chunk as the overlap of the next one
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                dropped = current.popleft()
+                total -= dropped[1] - dropped[0]
+
+        current.append(split)
+        total += length
+
+    if current:
+        _append_stripped(text, current[0][0], current[-1][1], spans)
+
+
+def _append_stripped(text: str,
+                     start: int,
+                     end: int,
+                     spans: List[Tuple[int, int]]) -> None:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+
+    if end > start:
+        spans.append((start, end))
@@ -0,0 +1,594 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from src.config import (
+    PINECONE_API_KEY,
+    PINECONE_INDEX,
+    PINECONE_MAX_CONCURRENT_UPSERTS,
+    VECTOR_STORE_BACKEND,
+    LOCAL_VECTOR_STORE_PATH,
+    LOCAL_VECTOR_STORE_QUANTIZATION,
+    LOCAL_VECTOR_STORE_PQ_SUBSPACES,
+    LOCAL_VECTOR_STORE_RESCORE_FACTOR
+)
+from src.gen_ai.rag.quantization import update_quantized_vectors
+
+
+class VectorStore(ABC):
+    """The subset of the Pinecone index API used by ingestion and retrieval.
+
+    Backends return query results shaped like Pinecone's, a dictionary whose
+    "matches" are dictionaries with an id, a score, the metadata and, when asked
+    for, the values, so the retrieval code does not depend on the backend.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[dict], async_req: bool = False):
+        """Inserts or replaces vectors given as dictionaries with id, values and metadata keys.
+
+        With `async_req` the call returns an object whose `get()` waits for the request.
+        """
+
+    @abstractmethod
+    def list(self, prefix: str) -> Iterator[List[str]]:
+        """Yields pages of the ids that start with the prefix."""
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        """Deletes the vectors with the given ids."""
+
+    @abstractmethod
+    def query(self,
+              vector: List[float],
+              filter: Optional[dict] = None,
+              top_k: int = 10,
+              include_metadata: bool = True,
+              include_values: bool = False) -> dict:
+        """Returns the `top_k` vectors most similar to the query vector among those matching the filter."""
+
+
+class PineconeVectorStore(VectorStore):
+    """Vector store backed by a Pinecone index."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors: List[dict], async_req: bool = False):
+        return self.index.upsert(vectors=vectors, async_req=async_req)
+
+    def list(self, prefix: str) -> Iterator[List[str]]:
+        return self.index.list(prefix=prefix)
+
+    def delete(self, ids: List[str]) -> None:
+        self.index.delete(ids=ids)
+
+    def query(self,
+              vector: List[float],
+              filter: Optional[dict] = None,
+              top_k: int = 10,
+              include_metadata: bool = True,
+              include_values: bool = False) -> dict:
+        return self.index.query(
+            vector=vector,
+            filter=filter,
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values)
+
+
+class _CompletedRequest:
+    """Result of a local request, which is already done when it is returned."""
+
+    def get(self):
+        return None
+
+
+def filter_mask(columns: Dict[str, np.ndarray],
+                filter: Optional[dict],
+                num_rows: int) -> np.ndarray:
+    """Evaluates a Pinecone style filter of equality, `$eq`, `$ne` and `$in` conditions on metadata columns.
+
+    Args:
+        columns (Dict[str, np.ndarray]): The value of every metadata field for every row.
+        filter (Optional[dict]): The filter, None matches everything.
+        num_rows (int): The number of rows.
+
+    Returns:
+        np.ndarray: A boolean mask of the rows that match every condition of the filter.
+    """
+
+    mask = np.ones(num_rows, dtype=bool)
+
+    for field, condition in (filter or {}).items():
+        column = columns[field]
+
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                mask &= column == operand
+            elif operator == "$ne":
+                mask &= column != operand
+            elif operator == "$in":
+                mask &= np.isin(column, list(operand))
+            else:
+                raise ValueError(f"unsupported filter operator {operator}")
+
+    return mask
+
+
+class _LocalPartition:
+    """The vectors of one document, stored in an append-only pair of files.
+
+    `vectors.f32` holds the unit-normalized float32 rows and is memory-mapped for
+    queries. `rows.jsonl` holds one line per appended row, with its id, metadata
+    and norm, and one line per deleted id. A replaced or deleted row stays in the
+    files until the partition is compacted.
+
+    Several workers may share the files: appends, deletes and compaction hold an
+    exclusive `flock` on the `lock` file of the partition and reloads a shared
+    one, so rows are never interleaved between the two files nor read half
+    written, and compaction never drops rows appended by another worker.
+
+    The compressed copy of the vectors is kept across reloads and follows the
+    files: rows appended since it was built are encoded, and it is only encoded
+    again as a whole once the files are compacted.
+    """
+
+    def __init__(self, directory: str, doc_key: str):
+        self.directory = directory
+        self.doc_key = doc_key
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.rows_path = os.path.join(directory, "rows.jsonl")
+        self.lock_path = os.path.join(directory, "lock")
+        self.dimension = None
+        self.ids: List[str] = []
+        self.metadata: List[dict] = []
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        self.rows_by_id: Dict[str, int] = {}
+        self.vectors = None
+        self.columns: Dict[str, np.ndarray] = {}
+        # Identifies the rows file, which compaction replaces
+        self.file_id = None
+        # The compressed copy, with the file id, number of rows and last id of the version it was built from
+        self._quantized = None
+        self._quantize_lock = threading.Lock()
+        self._loaded_version = None
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        # Held across processes, the lock of the store only covers the threads of this one
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _version(self) -> Optional[tuple]:
+        # Changes whenever rows are appended or deleted, or the files are compacted
+        if not os.path.exists(self.rows_path):
+            return None
+
+        stat = os.stat(self.rows_path)
+
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def refresh(self) -> None:
+        # Unchanged files need no lock, a write in progress only shows once its rows are written
+        if self._version() == self._loaded_version:
+            return
+
+        with self._file_lock(exclusive=False):
+            self._reload()
+
+    def _reload(self) -> None:
+        # Reload when the files were changed, by this process or another worker
+        version = self._version()
+        size = version[1] if version else 0
+
+        if version == self._loaded_version:
+            return
+
+        ids, metadata, norms, rows_by_id = [], [], [], {}
+        dimension = None
+
+        if size:
+            with open(self.rows_path, encoding="utf-8") as rows_file:
+                for line in rows_file:
+                    row = json.loads(line)
+
+                    if "deleted" in row:
+                        rows_by_id.pop(row["deleted"], None)
+                        continue
+
+                    dimension = row["dimension"]
+                    rows_by_id[row["id"]] = len(ids)
+                    ids.append(row["id"])
+                    metadata.append(row["metadata"])
+                    norms.append(row["norm"])
+
+        live = np.zeros(len(ids), dtype=bool)
+        live[list(rows_by_id.values())] = True
+
+        self.dimension = dimension
+        self.ids = ids
+        self.metadata = metadata
+        self.norms = np.asarray(norms, dtype=np.float32)
+        self.live = live
+        self.rows_by_id = rows_by_id
+        self.vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(ids), dimension)) if ids else None
+        self.columns = {}
+        self.file_id = version[0] if version else None
+        self._loaded_version = version
+
+    def column(self, field: str) -> np.ndarray:
+        """Returns the value of a metadata field for every row, built on first use."""
+
+        column = self.columns.get(field)
+
+        if column is None:
+            column = np.empty(len(self.metadata), dtype=object)
+            column[:] = [metadata.get(field) for metadata in self.metadata]
+            self.columns[field] = column
+
+        return column
+
+    @property
+    def quantized(self):
+        """The latest compressed copy of the vectors, None before the first quantized query."""
+
+        return self._quantized[3] if self._quantized is not None else None
+
+    def quantized_vectors(self,
+                          quantization: str,
+                          num_subspaces: int,
+                          ids: List[str],
+                          vectors: np.ndarray,
+                          file_id: int):
+        """Returns the compressed copy of a loaded version of the vectors, updated from the copy of an earlier version.
+
+        It is called outside of the store lock with the ids, vectors and file id of
+        the version, so that while it is built other queries and writes go on, and
+        only the queries of this partition wait for it.
+        """
+
+        with self._quantize_lock:
+            quantized = None
+            rows_appended = True
+
+            if self._quantized is not None:
+                quantized_file_id, num_rows, last_id, quantized = self._quantized
+
+                if quantized_file_id == file_id and num_rows == len(ids) and last_id == ids[-1]:
+                    return quantized
+
+                # ids are only appended to the rows file until it is compacted into a new file
+                rows_appended = quantized_file_id == file_id and num_rows < len(ids) and ids[num_rows - 1] == last_id
+
+            quantized = update_quantized_vectors(
+                quantized,
+                vectors,
+                quantization,
+                num_subspaces=num_subspaces,
+                rows_appended=rows_appended)
+            self._quantized = (file_id, len(ids), ids[-1], quantized)
+
+            return quantized
+
+    def append(self, vectors: List[dict]) -> None:
+        values = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1)
+        values /= np.maximum(norms, 1e-12)[:, None]
+
+        if self.dimension is not None and values.shape[1] != self.dimension:
+            raise ValueError(f"vector dimension {values.shape[1]} does not match {self.dimension} of document {self.doc_key}")
+
+        with self._file_lock(exclusive=True):
+            with open(self.vectors_path, "ab") as vectors_file:
+                vectors_file.write(values.tobytes())
+
+            with open(self.rows_path, "a", encoding="utf-8") as rows_file:
+                for vector, norm in zip(vectors, norms):
+                    rows_file.write(json.dumps({
+                        "id": vector["id"],
+                        "metadata": vector.get("metadata", {}),
+                        "norm": float(norm),
+                        "dimension": int(values.shape[1])
+                    }) + "\n")
+
+    def delete(self, ids: List[str]) -> None:
+        with self._file_lock(exclusive=True):
+            with open(self.rows_path, "a", encoding="utf-8") as rows_file:
+                for vector_id in ids:
+                    rows_file.write(json.dumps({"deleted": vector_id}) + "\n")
+
+    def compact(self) -> None:
+        with self._file_lock(exclusive=True):
+            # Rows appended by another worker since the last reload are kept
+            self._reload()
+            self._compact()
+
+    def _compact(self) -> None:
+        # Rewrite the live rows only, then swap the files in
+        live_rows = sorted(self.rows_by_id.values())
+        vectors = np.asarray(self.vectors[live_rows]) if live_rows else np.zeros((0, 0), dtype=np.float32)
+
+        with open(self.vectors_path + ".tmp", "wb") as vectors_file:
+            vectors_file.write(vectors.tobytes())
+
+        with open(self.rows_path + ".tmp", "w", encoding="utf-8") as rows_file:
+            for row in live_rows:
+                rows_file.write(json.dumps({
+                    "id": self.ids[row],
+                    "metadata": self.metadata[row],
+                    "norm": float(self.norms[row]),
+                    "dimension": self.dimension
+                }) + "\n")
+
+        self.vectors = None
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.rows_path + ".tmp", self.rows_path)
+        self._loaded_version = None
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store that keeps the float32 embeddings of every document in memory-mapped files.
+
+    Vectors are partitioned by the doc_key in their metadata, so a query filtered
+    on one document only scores that document's rows. Scoring is a brute-force
+    cosine similarity over the unit-normalized rows with a vectorized NumPy
+    product, and the top k are selected with argpartition. It needs no network,
+    which makes it usable for single-node deployments, tests and benchmarks.
+
+    With quantization, queries score a compressed in-memory copy of the vectors
+    instead, int8 codes (4 times smaller) or product quantization codes (64 times
+    smaller with the default 96 subspaces), and only re-score the best
+    `rescore_factor * top_k` candidates exactly against the float32 rows. The
+    float32 file is then only read for the shortlisted rows, and its pages stay
+    in the shared, evictable page cache rather than in the memory of every worker.
+    Product quantization codebooks are learned per partition, about 1.5 MB for
+    1536 dimensions, so partitions of less than about a thousand vectors, most
+    documents, keep int8 codes, which are then smaller.
+
+    Vector ids must start with the doc_key of their document, as chunk ids do,
+    followed by "#" or "_", so that `list` and `delete` can find the partition
+    of an id without going through the other partitions.
+    """
+
+    def __init__(self,
+                 path: str = LOCAL_VECTOR_STORE_PATH,
+                 quantization: str = LOCAL_VECTOR_STORE_QUANTIZATION,
+                 pq_subspaces: int = LOCAL_VECTOR_STORE_PQ_SUBSPACES,
+                 rescore_factor: int = LOCAL_VECTOR_STORE_RESCORE_FACTOR):
+        if quantization not in ("none", "int8", "pq"):
+            raise ValueError(f"unknown quantization {quantization}")
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.quantization = quantization
+        self.pq_subspaces = pq_subspaces
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._partitions: Dict[str, _LocalPartition] = {}
+        # doc_key of every partition directory, a directory keeps its doc_key for good
+        self._doc_keys_by_directory: Dict[str, str] = {}
+
+    def _partition_directory(self, doc_key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(doc_key.encode("utf-8")).hexdigest()[:32])
+
+    def _partition(self, doc_key: str, create: bool = False) -> Optional[_LocalPartition]:
+        partition = self._partitions.get(doc_key)
+
+        if partition is None:
+            directory = self._partition_directory(doc_key)
+
+            if not os.path.isdir(directory):
+                if not create:
+                    return None
+                # another worker may create it at the same time
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, "doc_key"), "w", encoding="utf-8") as doc_key_file:
+                    doc_key_file.write(doc_key)
+
+            partition = self._partitions[doc_key] = _LocalPartition(directory, doc_key)
+
+        partition.refresh()
+
+        return partition
+
+    def _doc_keys(self) -> List[str]:
+        # Only the partitions created since the last call, by this process or another worker, are read
+        for name in os.listdir(self.path):
+            if name in self._doc_keys_by_directory:
+                continue
+
+            doc_key_path = os.path.join(self.path, name, "doc_key")
+
+            if os.path.exists(doc_key_path):
+                with open(doc_key_path, encoding="utf-8") as doc_key_file:
+                    self._doc_keys_by_directory[name] = doc_key_file.read()
+
+        return list(self._doc_keys_by_directory.values())
+
+    def _ids_by_doc_key(self, ids: List[str]) -> Dict[str, List[str]]:
+        # Every prefix of an id that ends before a "#" or "_" may be the doc_key of its partition
+        ids_by_doc_key: Dict[str, List[str]] = {}
+
+        for vector_id in ids:
+            for position, character in enumerate(vector_id):
+                if character in "#_":
+                    ids_by_doc_key.setdefault(vector_id[:position], []).append(vector_id)
+
+        return ids_by_doc_key
+
+    def upsert(self, vectors: List[dict], async_req: bool = False):
+        vectors_by_doc_key: Dict[str, List[dict]] = {}
+
+        for vector in vectors:
+            doc_key = vector.get("metadata", {}).get("doc_key")
+
+            if doc_key is None:
+                raise ValueError(f"vector {vector['id']} has no doc_key in its metadata")
+
+            vectors_by_doc_key.setdefault(doc_key, []).append(vector)
+
+        with self._lock:
+            for doc_key, doc_vectors in vectors_by_doc_key.items():
+                self._partition(doc_key, create=True).append(doc_vectors)
+
+        return _CompletedRequest() if async_req else None
+
+    def list(self, prefix: str) -> Iterator[List[str]]:
+        with self._lock:
+            for doc_key in self._doc_keys():
+                if not (prefix.startswith(doc_key) or doc_key.startswith(prefix)):
+                    continue
+
+                partition = self._partition(doc_key)
+                ids = [vector_id for vector_id in partition.rows_by_id if vector_id.startswith(prefix)]
+
+                # Same page size as Pinecone
+                for start in range(0, len(ids), 100):
+                    yield ids[start:start + 100]
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            # Only the partitions the ids belong to are touched
+            for doc_key, candidate_ids in self._ids_by_doc_key(ids).items():
+                partition = self._partition(doc_key)
+
+                if partition is None:
+                    continue
+
+                doc_ids = [vector_id for vector_id in candidate_ids if vector_id in partition.rows_by_id]
+
+                if not doc_ids:
+                    continue
+
+                partition.delete(doc_ids)
+                partition.refresh()
+
+                # Reclaim the space of deleted rows once they outnumber the live ones
+                if len(partition.ids) > 2 * len(partition.rows_by_id):
+                    partition.compact()
+
+    def query(self,
+              vector: List[float],
+              filter: Optional[dict] = None,
+              top_k: int = 10,
+              include_metadata: bool = True,
+              include_values: bool = False) -> dict:
+        query_vector = np.asarray(vector, dtype=np.float32)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+
+        doc_key = (filter or {}).get("doc_key")
+        if isinstance(doc_key, dict) and list(doc_key) == ["$eq"]:
+            doc_key = doc_key["$eq"]
+
+        candidates = []
+
+        with self._lock:
+            doc_keys = [doc_key] if isinstance(doc_key, str) else self._doc_keys()
+
+            # Refresh swaps in new arrays rather than changing them, so these stay consistent without the lock
+            snapshots = []
+            for partition in map(self._partition, doc_keys):
+                if partition is None or partition.vectors is None:
+                    continue
+                mask = partition.live & filter_mask(
+                    {field: partition.column(field) for field in (filter or {})},
+                    filter,
+                    len(partition.ids))
+                use_quantized = self.quantization != "none" and int(mask.sum()) > top_k * self.rescore_factor
+                snapshots.append((partition, partition.ids, partition.metadata, partition.norms, partition.vectors,
+                                  partition.file_id, mask, use_quantized))
+
+        for partition, ids, metadata, norms, vectors, file_id, mask, use_quantized in snapshots:
+            num_matching = int(mask.sum())
+            if not num_matching:
+                continue
+
+            k = min(top_k, num_matching)
+
+            # The compressed copy is built or updated outside of the store lock
+            quantized = partition.quantized_vectors(
+                self.quantization, self.pq_subspaces, ids, vectors, file_id) if use_quantized else None
+
+            if quantized is None:
+                rows = np.arange(len(mask))
+                scores = np.asarray(vectors @ query_vector)
+            else:
+                # Shortlist on the compressed vectors, then score the shortlist exactly
+                approximate_scores = quantized.scores(query_vector)
+                approximate_scores[~mask] = -np.inf
+
+                num_candidates = top_k * self.rescore_factor
+                rows = np.sort(np.argpartition(-approximate_scores, num_candidates - 1)[:num_candidates])
+                scores = np.asarray(vectors[rows]) @ query_vector
+
+            scores[~mask[rows]] = -np.inf
+
+            # Only sort the k best rows
+            best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+
+            for i in best:
+                if mask[rows[i]]:
+                    candidates.append((float(scores[i]), int(rows[i]), ids, metadata, norms, vectors))
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        matches = []
+        for score, row, ids, metadata, norms, vectors in candidates[:top_k]:
+            match = {"id": ids[row], "score": score}
+
+            if include_metadata:
+                # a copy, so that callers can add fields such as the chunk text
+                match["metadata"] = dict(metadata[row])
+            if include_values:
+                match["values"] = (np.asarray(vectors[row]) * norms[row]).tolist()
+
+            matches.append(match)
+
+        return {"matches": matches}
+
+
+def create_vector_store(backend: str = VECTOR_STORE_BACKEND) -> VectorStore:
+    """Creates the vector store configured by VECTOR_STORE_BACKEND.
+
+    Args:
+        backend (str, optional): "pinecone" or "local". Default is VECTOR_STORE_BACKEND.
+
+    Returns:
+        VectorStore: The vector store.
+    """
+
+    if backend == "local":
+        logging.info(f"using the local vector store in {LOCAL_VECTOR_STORE_PATH}")
+        return LocalVectorStore()
+
+    if backend != "pinecone":
+        raise ValueError(f"unknown vector store backend {backend}")
+
+    from pinecone import Pinecone
+
+    pinecone_instance = Pinecone(api_key=PINECONE_API_KEY)
+
+    return PineconeVectorStore(
+        pinecone_instance.Index(PINECONE_INDEX, pool_threads=PINECONE_MAX_CONCURRENT_UPSERTS))
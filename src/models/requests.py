@@ -36,4 +36,5 @@ class ChatMessagesRequest(BaseModel):
         ]
     )
     preferred_response_length: Optional[str] = Field(default="medium", example="short")
+    stream: Optional[bool] = Field(default=False, example=False)
  
\ No newline at end of file
@@ -9,11 +9,6 @@ from src.config import AWS_BUCKET_NAME
 
 def get_file(s3_client,doc_key):
     try:
-        response = s3_client.list_objects_v2(Bucket=AWS_BUCKET_NAME, Prefix='louis_anh_tran/')
-        
-        for obj in response.get('Contents', []):
-            print("object_aws: ",obj['Key'])
-
         # Download file from S3
         response = s3_client.get_object(
             Bucket=AWS_BUCKET_NAME,
@@ -22,9 +17,11 @@ def get_file(s3_client,doc_key):
 
         logging.info("response_from_s3: ",response)
         
-        # Return the file content
+        # Read the body once, the stream is empty after the first read
+        file_bytes = response['Body'].read()
 
-        return BytesIO(response['Body'].read()),response['Body'].read()
+        # Return the file content
+        return BytesIO(file_bytes),file_bytes
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'NoSuchKey':
@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import logging
+import threading
+import time
+import uuid
+
+from src.config import (
+    INGESTION_MAX_CONCURRENT_JOBS,
+    INGESTION_MAX_RETAINED_JOBS
+)
+
+
+@dataclass
+class IngestionJob:
+    """State of one background document indexing job."""
+    
+    job_id: str
+    doc_key: str
+    filename: str
+    state: str = "queued"
+    chunks_reused: int = 0
+    chunks_embedded: int = 0
+    chunks_upserted: int = 0
+    chunks_deleted: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    
+    def to_dict(self) -> dict:
+        """Returns the job state, progress and timings as a JSON serializable dictionary."""
+        
+        now = time.time()
+        
+        return {
+            "job_id": self.job_id,
+            "doc_key": self.doc_key,
+            "filename": self.filename,
+            "state": self.state,
+            "progress": {
+                "chunks_reused": self.chunks_reused,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_upserted": self.chunks_upserted,
+                "chunks_deleted": self.chunks_deleted
+            },
+            "error": self.error,
+            "timings": {
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "queued_seconds": (self.started_at or now) - self.created_at,
+                "running_seconds": (self.finished_at or now) - self.started_at if self.started_at else None
+            }
+        }
+
+
+class IngestionJobManager:
+    """Runs document indexing jobs on a bounded thread pool and keeps track of their state.
+
+    Indexing is CPU and network bound and would otherwise run inside the request,
+    blocking the event loop for every other user. Jobs are only tracked in the 
+    memory of the current process.
+    """
+    
+    def __init__(self,
+                 max_concurrent_jobs: int = INGESTION_MAX_CONCURRENT_JOBS,
+                 max_retained_jobs: int = INGESTION_MAX_RETAINED_JOBS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs,
+            thread_name_prefix="ingestion")
+        self._jobs: Dict[str, IngestionJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_retained_jobs = max_retained_jobs
+    
+    def submit(self,
+               doc_key: str,
+               filename: str,
+               task: Callable[[Callable[[str, int], None]], None]) -> IngestionJob:
+        """Queues an indexing task and returns its job immediately.
+
+        Args:
+            doc_key (str): Unique document key of the document being indexed.
+            filename (str): Name of the uploaded file.
+            task (Callable): Runs the indexing, called with a progress callback taking a stage 
+                ("reused", "embedded", "upserted" or "deleted") and a number of chunks.
+
+        Returns:
+            IngestionJob: The queued job.
+        """
+        
+        job = IngestionJob(
+            job_id=uuid.uuid4().hex,
+            doc_key=doc_key,
+            filename=filename)
+        
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict_finished_jobs()
+        
+        self._executor.submit(self._run, job, task)
+        
+        return job
+    
+    def submit_bulk(self,
+                    documents: List[Tuple[str, str]],
+                    task: Callable[[List[Tuple[Callable[[str, int], None], Callable[[Optional[Exception]], None]]]], None]) -> List[IngestionJob]:
+        """Queues one indexing task for several documents, with a job per document, and returns the jobs immediately.
+
+        Args:
+            documents (List[Tuple[str, str]]): The (doc_key, filename) pair of every document.
+            task (Callable): Runs the indexing of all documents, called with one (on_progress, on_done) 
+                pair per document, in order. `on_done` takes None once the document is indexed, or the 
+                error that stopped it. Documents still unfinished when the task returns or raises fail.
+
+        Returns:
+            List[IngestionJob]: The queued jobs, in the order of the documents.
+        """
+        
+        jobs = [
+            IngestionJob(
+                job_id=uuid.uuid4().hex,
+                doc_key=doc_key,
+                filename=filename)
+            for doc_key, filename in documents
+        ]
+        
+        with self._lock:
+            for job in jobs:
+                self._jobs[job.job_id] = job
+            self._evict_finished_jobs()
+        
+        self._executor.submit(self._run_bulk, jobs, task)
+        
+        return jobs
+    
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        """Returns the job with the given id, or None if it is unknown."""
+        
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def _progress_callback(self, job: IngestionJob) -> Callable[[str, int], None]:
+        
+        def on_progress(stage: str, num_chunks: int) -> None:
+            with self._lock:
+                counter = f"chunks_{stage}"
+                setattr(job, counter, getattr(job, counter) + num_chunks)
+        
+        return on_progress
+    
+    def _run(self, 
+             job: IngestionJob, 
+             task: Callable[[Callable[[str, int], None]], None]) -> None:
+        
+        on_progress = self._progress_callback(job)
+        
+        job.state = "running"
+        job.started_at = time.time()
+        
+        logging.info(f"ingestion job {job.job_id} started for document {job.doc_key}")
+        
+        try:
+            task(on_progress)
+            job.state = "succeeded"
+            logging.info(f"ingestion job {job.job_id} succeeded")
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            logging.exception(f"ingestion job {job.job_id} failed")
+        finally:
+            job.finished_at = time.time()
+    
+    def _evict_finished_jobs(self) -> None:
+        # Forget the oldest finished jobs once too many are retained, running jobs are always kept
+        excess = len(self._jobs) - self._max_retained_jobs
+        
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at][:max(0, excess)]:
+            del self._jobs[job_id]
+    
+    def _run_bulk(self,
+                  jobs: List[IngestionJob],
+                  task: Callable) -> None:
+        
+        def done_callback(job: IngestionJob) -> Callable[[Optional[Exception]], None]:
+            
+            def on_done(error: Optional[Exception]) -> None:
+                if job.finished_at:
+                    return
+                
+                if error is None:
+                    job.state = "succeeded"
+                    logging.info(f"ingestion job {job.job_id} succeeded")
+                else:
+                    job.state = "failed"
+                    job.error = str(error)
+                    logging.info(f"ingestion job {job.job_id} failed: {error}")
+                
+                job.finished_at = time.time()
+            
+            return on_done
+        
+        started_at = time.time()
+        
+        for job in jobs:
+            job.state = "running"
+            job.started_at = started_at
+        
+        logging.info(f"bulk ingestion of {len(jobs)} documents started")
+        
+        error = RuntimeError("document was not indexed")
+        
+        try:
+            task([(self._progress_callback(job), done_callback(job)) for job in jobs])
+        except Exception as e:
+            error = e
+            logging.exception("bulk ingestion failed")
+        finally:
+            for job in jobs:
+                done_callback(job)(error)
@@ -0,0 +1,72 @@
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import json
+import logging
+
+
+# Keep proxies such as nginx from buffering the stream, and clients from caching it
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+def format_sse_event(data: dict,
+                     event: Optional[str] = None) -> str:
+    """Formats one Server-Sent Event with a JSON payload.
+
+    Args:
+        data (dict): The payload of the event.
+        event (Optional[str], optional): The event type, None for the default "message" type. Default is None.
+
+    Returns:
+        str: The event, terminated by a blank line.
+    """
+
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_response_events(pieces: AsyncIterator[str],
+                                 on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+                                 metadata: Optional[dict] = None) -> AsyncIterator[str]:
+    """Streams the pieces of a response as Server-Sent Events.
+
+    Every piece is sent as a default event with a "token" field as soon as it is
+    generated. Once the response is complete, `on_complete` is awaited with the
+    full text and a "done" event with the full text in a "response" field, and
+    `metadata` in a "metadata" field when given, ends the stream. An error ends the stream with an "error" event instead, and
+    `on_complete` is not called.
+
+    Args:
+        pieces (AsyncIterator[str]): The pieces of the response.
+        on_complete (Optional[Callable[[str], Awaitable[None]]], optional): Awaited with the full text. Default is None.
+        metadata (Optional[dict], optional): Details of the request sent with the "done" event. Default is None.
+
+    Yields:
+        str: The formatted events.
+    """
+
+    text_pieces = []
+
+    try:
+        async for piece in pieces:
+            text_pieces.append(piece)
+            yield format_sse_event({"token": piece})
+    except Exception:
+        logging.exception("failed to stream the response")
+        yield format_sse_event({"detail": "Internal Error server"}, event="error")
+        return
+
+    text = "".join(text_pieces)
+
+    if on_complete:
+        await on_complete(text)
+
+    done = {"response": text}
+
+    if metadata is not None:
+        done["metadata"] = metadata
+
+    yield format_sse_event(done, event="done")
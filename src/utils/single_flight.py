@@ -0,0 +1,148 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import time
+import uuid
+
+from src.config import (
+    SINGLE_FLIGHT_LOCK_TTL_MS,
+    SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS,
+    SINGLE_FLIGHT_POLL_INTERVAL_SECONDS
+)
+
+
+# Deletes the lock only when it is still held by the same owner, so an expired lock taken over by another worker is kept
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key into one.
+
+    Within a worker, the requests that arrive while a computation of their key
+    is in flight await its result. Across workers, the worker that takes the
+    Redis lock of the key (SET NX PX) computes, and the others poll `lookup`,
+    typically the response cache the computation writes to, until the result
+    shows up.
+
+    Waiting is bounded by `wait_timeout`: a request that waited longer, or
+    whose leader failed or let its lock go without a result, computes on its
+    own. Without Redis, or when Redis fails, only requests of the same worker
+    are coalesced.
+    """
+
+    def __init__(self,
+                 lock_ttl_ms: int = SINGLE_FLIGHT_LOCK_TTL_MS,
+                 wait_timeout: float = SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS,
+                 poll_interval: float = SINGLE_FLIGHT_POLL_INTERVAL_SECONDS,
+                 prefix: str = "single-flight"):
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def run(self,
+                  key: str,
+                  compute: Callable[[], Awaitable[Any]],
+                  lookup: Optional[Callable[[], Awaitable[Any]]] = None,
+                  redis_client=None) -> Tuple[Any, str]:
+        """Returns the result of `compute` for a key, shared with the concurrent requests of the same key.
+
+        Args:
+            key (str): The key of the computation, such as the response cache key.
+            compute (Callable[[], Awaitable[Any]]): Computes the result, and stores it where `lookup` finds it.
+            lookup (Optional[Callable[[], Awaitable[Any]]], optional): Returns the stored result, or None. Default is None.
+            redis_client (optional): Async Redis client of the cross-worker lock, None to coalesce within the worker only.
+
+        Returns:
+            Tuple[Any, str]: The result, and how it was obtained: "computed" by this request, "coalesced"
+                from another request of this worker, "coalesced_across_workers" from another worker, or
+                "timeout" when computed after waiting in vain, or after the computation it waited for failed.
+        """
+
+        in_flight = self._in_flight.get(key)
+
+        if in_flight is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(in_flight), self.wait_timeout), "coalesced"
+            except asyncio.TimeoutError:
+                logging.warning(f"single-flight wait for {key} timed out, computing independently")
+                return await compute(), "timeout"
+            except asyncio.CancelledError:
+                # the leader was cancelled, this request is not
+                if not in_flight.cancelled():
+                    raise
+                return await compute(), "timeout"
+            except Exception as e:
+                # a transient error of the leader does not fail every request it was computing for
+                logging.warning(f"single-flight computation of {key} failed in another request ({e}), computing independently")
+                return await compute(), "timeout"
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            result, outcome = await self._run_across_workers(key, compute, lookup, redis_client)
+            future.set_result(result)
+            return result, outcome
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # the waiters retrieve it, this keeps asyncio from reporting it as never retrieved
+                future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self._in_flight.pop(key, None)
+
+    async def _run_across_workers(self, key, compute, lookup, redis_client) -> Tuple[Any, str]:
+        if redis_client is None or lookup is None:
+            return await compute(), "computed"
+
+        lock_key = f"{self.prefix}:{key}"
+        token = uuid.uuid4().hex
+
+        try:
+            acquired = await redis_client.set(lock_key, token, nx=True, px=self.lock_ttl_ms)
+        except Exception as e:
+            logging.info(f"There is error with Redis server, can not coordinate the computation with other workers: {e}")
+            return await compute(), "computed"
+
+        if acquired:
+            try:
+                return await compute(), "computed"
+            finally:
+                try:
+                    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logging.info(f"can not release the single-flight lock, it expires on its own: {e}")
+
+        # another worker computes the result, wait until it is stored
+        deadline = time.monotonic() + self.wait_timeout
+
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+
+                # the lock is checked first, a result stored just before the lock was released is still found
+                lock_held = await redis_client.exists(lock_key)
+                result = await lookup()
+
+                if result is not None:
+                    return result, "coalesced_across_workers"
+
+                # the lock was released without a result, the other worker failed
+                if not lock_held:
+                    break
+        except Exception as e:
+            logging.info(f"There is error with Redis server, can not wait for the other worker: {e}")
+
+        logging.warning(f"single-flight wait for {key} across workers gave no result, computing independently")
+
+        return await compute(), "timeout"
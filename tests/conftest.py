@@ -0,0 +1,18 @@
+import importlib
+
+import pytest
+
+from src.gen_ai.rag import vector_store
+from src.gen_ai.rag.vector_store import LocalVectorStore
+from src.utils.ingestion_jobs import IngestionJobManager
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    # the app opens its stores when it is imported, keep them out of the working directory and off Pinecone
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(vector_store, "create_vector_store", lambda: LocalVectorStore(str(tmp_path / "vectors")))
+    app_module = importlib.import_module("src.api.v1.app")
+    monkeypatch.setattr(app_module, "ingestion_job_manager", IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=10))
+    monkeypatch.setattr(app_module, "answer_cache", None)
+    return app_module
@@ -0,0 +1,40 @@
+from src.gen_ai.rag.answer_cache import SemanticAnswerCache
+
+
+def test_similar_queries_share_answers_until_the_document_is_reindexed(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    answer_cache = SemanticAnswerCache(path, threshold=0.95)
+
+    answer_cache.put("doc", "semantic_search", "what is this document about", [1.0, 0.0, 0.1], "An overview.")
+
+    assert answer_cache.get("doc", "semantic_search", [0.99, 0.0, 0.12]) == "An overview."
+    assert answer_cache.get("doc", "semantic_search", [0.5, 0.8, 0.0]) is None
+    assert answer_cache.get("doc", "summarization:short", [1.0, 0.0, 0.1]) is None
+    assert answer_cache.get("other", "semantic_search", [1.0, 0.0, 0.1]) is None
+
+    # another worker sees the invalidation
+    SemanticAnswerCache(path).invalidate("doc")
+
+    assert answer_cache.get("doc", "semantic_search", [1.0, 0.0, 0.1]) is None
+    assert answer_cache.stats()["hits"] == 1
+
+
+def test_least_recently_used_answers_are_evicted(tmp_path):
+    answer_cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite3"), threshold=0.99, max_entries=2)
+
+    answer_cache.put("doc", "semantic_search", "a", [1.0, 0.0, 0.0], "answer a")
+    answer_cache.put("doc", "semantic_search", "b", [0.0, 1.0, 0.0], "answer b")
+    assert answer_cache.get("doc", "semantic_search", [1.0, 0.0, 0.0]) == "answer a"
+    answer_cache.put("doc", "semantic_search", "c", [0.0, 0.0, 1.0], "answer c")
+
+    assert answer_cache.get("doc", "semantic_search", [1.0, 0.0, 0.0]) == "answer a"
+    assert answer_cache.get("doc", "semantic_search", [0.0, 1.0, 0.0]) is None
+    assert answer_cache.get("doc", "semantic_search", [0.0, 0.0, 1.0]) == "answer c"
+
+
+def test_expired_answers_are_not_returned(tmp_path):
+    answer_cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite3"), ttl_seconds=-1)
+
+    answer_cache.put("doc", "semantic_search", "a", [1.0, 0.0], "answer a")
+
+    assert answer_cache.get("doc", "semantic_search", [1.0, 0.0]) is None
@@ -0,0 +1,62 @@
+import threading
+import pytest
+
+from src.gen_ai.rag.doc_processing import iter_embedded_vectors
+
+
+class FlakyEmbedder:
+    def __init__(self, failing_batches):
+        # number of times each batch (identified by its first text) fails before succeeding
+        self.failures_left = dict(failing_batches)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.calls.append(tuple(texts))
+            if self.failures_left.get(texts[0], 0) > 0:
+                self.failures_left[texts[0]] -= 1
+                raise RuntimeError("transient embedding error")
+        return [[float(text.split("-")[1])] for text in texts]
+
+
+def embed_chunks(num_chunks, embedding_model, **kwargs):
+    new_chunks = (
+        {"id": f"doc#{i}", "doc_key": "doc", "text": f"chunk-{i}", "page": 1, "start": 0, "end": 0}
+        for i in range(num_chunks)
+    )
+
+    return [vector["values"] for vector in iter_embedded_vectors("tenant", new_chunks, embedding_model, **kwargs)]
+
+
+def test_embedded_vectors_keep_chunk_order():
+    vectors = embed_chunks(103, FlakyEmbedder({}), batch_size=10, max_concurrent_batches=4)
+
+    assert vectors == [[float(i)] for i in range(103)]
+
+
+def test_embedded_vectors_only_retry_failed_batch():
+    embedder = FlakyEmbedder({"chunk-10": 2})
+
+    vectors = embed_chunks(
+        30,
+        embedder,
+        batch_size=10,
+        max_concurrent_batches=3,
+        max_retries=3,
+        retry_backoff_seconds=0)
+
+    assert vectors == [[float(i)] for i in range(30)]
+    assert [call[0] for call in embedder.calls].count("chunk-0") == 1
+    assert [call[0] for call in embedder.calls].count("chunk-10") == 3
+    assert [call[0] for call in embedder.calls].count("chunk-20") == 1
+
+
+def test_embedded_vectors_raise_after_max_retries():
+    with pytest.raises(RuntimeError):
+        embed_chunks(
+            5,
+            FlakyEmbedder({"chunk-0": 5}),
+            batch_size=5,
+            max_retries=2,
+            retry_backoff_seconds=0)
@@ -0,0 +1,105 @@
+import threading
+
+import fitz
+
+from src.gen_ai.rag import doc_processing
+from src.gen_ai.rag.doc_processing import (
+    IndexingRequest,
+    init_pinecone_and_bulk_doc_indexing
+)
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.requests = 0
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        return [[float(len(text))] for text in texts]
+
+
+def create_pdf(num_pages, label):
+    document = fitz.open()
+    for page_number in range(num_pages):
+        page = document.new_page()
+        page.insert_text((50, 100), f"{label} page {page_number} " * 5)
+    return document.tobytes()
+
+
+def test_bulk_indexing_shares_batches_and_reports_every_document(tmp_path):
+    vector_store = LocalVectorStore(str(tmp_path / "vectors"))
+    embedder = CountingEmbedder()
+    done = {}
+    progress = {}
+
+    def request(doc_key, load_file_bytes):
+        return IndexingRequest(
+            doc_key=doc_key,
+            load_file_bytes=load_file_bytes,
+            on_progress=lambda stage, n: progress.setdefault(doc_key, {}).update(
+                {stage: progress.get(doc_key, {}).get(stage, 0) + n}),
+            on_done=lambda error: done.__setitem__(doc_key, error))
+
+    def missing_file():
+        raise FileNotFoundError("missing.pdf")
+
+    init_pinecone_and_bulk_doc_indexing(
+        username="tenant",
+        documents=[
+            request("tenant/a.pdf", lambda: create_pdf(3, "alpha")),
+            request("tenant/missing.pdf", missing_file),
+            request("tenant/b.pdf", lambda: create_pdf(2, "beta"))
+        ],
+        embedding_model=embedder,
+        vector_store=vector_store)
+
+    assert done["tenant/a.pdf"] is None and done["tenant/b.pdf"] is None
+    assert isinstance(done["tenant/missing.pdf"], FileNotFoundError)
+    assert progress["tenant/a.pdf"] == {"embedded": 3, "upserted": 3}
+    assert progress["tenant/b.pdf"] == {"embedded": 2, "upserted": 2}
+    # the chunks of both documents fit in a single embedding request
+    assert embedder.requests == 1
+    assert sum(len(ids) for ids in vector_store.list(prefix="tenant/")) == 5
+
+
+def test_upserts_of_the_next_document_continue_while_a_document_is_summarized(tmp_path, monkeypatch):
+    # one vector per upsert request and one request in flight, so every upsert waits for the previous one to be handled
+    monkeypatch.setattr(doc_processing, "PINECONE_UPSERT_BATCH_SIZE", 1)
+    monkeypatch.setattr(doc_processing, "PINECONE_MAX_CONCURRENT_UPSERTS", 1)
+
+    b_upserted = threading.Event()
+    summarized = {}
+
+    class RecordingVectorStore(LocalVectorStore):
+        num_b_vectors = 0
+
+        def upsert(self, vectors, **kwargs):
+            result = super().upsert(vectors=vectors, **kwargs)
+            self.num_b_vectors += sum(vector["metadata"]["doc_key"] == "tenant/b.pdf" for vector in vectors)
+            if self.num_b_vectors == 4:
+                b_upserted.set()
+            return result
+
+    def build_document_summaries(doc_key, document_store, llm):
+        # summarizing document a lasts until all the vectors of document b are upserted
+        summarized[doc_key] = b_upserted.wait(timeout=10) if doc_key == "tenant/a.pdf" else True
+
+    monkeypatch.setattr(doc_processing, "build_document_summaries", build_document_summaries)
+    done = {}
+
+    init_pinecone_and_bulk_doc_indexing(
+        username="tenant",
+        documents=[
+            IndexingRequest(doc_key=doc_key, load_file_bytes=lambda label=label, pages=pages: create_pdf(pages, label),
+                            on_done=lambda error, doc_key=doc_key: done.__setitem__(doc_key, error))
+            for doc_key, label, pages in [("tenant/a.pdf", "alpha", 2), ("tenant/b.pdf", "beta", 4)]
+        ],
+        embedding_model=CountingEmbedder(),
+        vector_store=RecordingVectorStore(str(tmp_path / "vectors")),
+        document_store=DocumentStore(str(tmp_path / "documents.sqlite3")),
+        summary_llm=object())
+
+    assert summarized == {"tenant/a.pdf": True, "tenant/b.pdf": True}
+    assert done == {"tenant/a.pdf": None, "tenant/b.pdf": None}
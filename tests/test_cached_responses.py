@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+class BytesRedisBackend:
+    """A Redis backend that returns every cached answer as bytes, as Redis does."""
+
+    def __init__(self, value):
+        self.value = value
+        self.keys = []
+
+    async def get(self, key):
+        self.keys.append(key)
+        return self.value
+
+    async def set(self, key, value, expire=None):
+        raise AssertionError("a cache hit is not cached again")
+
+
+class RecordingS3Client:
+    def __init__(self):
+        self.calls = []
+
+    def list_objects_v2(self, Bucket, Prefix):
+        self.calls.append(Prefix)
+        return {}
+
+
+@pytest.mark.parametrize("endpoint", ["/semantic_search/report.pdf", "/generate_summarization/report.pdf"])
+def test_streamed_cache_hit_is_replayed_as_one_event(app_module, monkeypatch, endpoint):
+    cache = BytesRedisBackend("The cached answer".encode())
+    s3_client = RecordingS3Client()
+    condensed = []
+
+    async def condense_and_retrieve(*args, **kwargs):
+        condensed.append(args)
+        raise AssertionError("a cache hit calls no LLM")
+
+    monkeypatch.setattr(app_module, "s3_client", s3_client)
+    monkeypatch.setattr(app_module, "condense_and_retrieve", condense_and_retrieve)
+
+    app = FastAPI()
+    app.include_router(app_module.api_router)
+    app.dependency_overrides[app_module.get_redis_cache] = lambda: cache
+
+    message = {"role": "user", "content": "What is the exam policy?", "timestamp": "2023-07-17T12:34:56"}
+    response = TestClient(app).post(endpoint, json={"list_of_messages": [message], "stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == f'event: done\ndata: {json.dumps({"response": "The cached answer"})}\n\n'
+    assert len(cache.keys) == 1
+    assert s3_client.calls == [] and condensed == []
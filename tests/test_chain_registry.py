@@ -0,0 +1,19 @@
+import asyncio
+
+from langchain_core.language_models import FakeListChatModel
+
+from src.gen_ai.rag.chain_registry import ChainRegistry
+from src.gen_ai.rag.prompt_template import CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE
+
+
+def test_pipelines_are_built_once_per_template_and_llm():
+    registry = ChainRegistry()
+    llm = FakeListChatModel(responses=["standalone question"])
+    other_llm = FakeListChatModel(responses=["other"])
+
+    chain = registry.chain(CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE, llm)
+
+    assert registry.chain(CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE, llm) is chain
+    assert registry.chain(CONDENSE_HISTORY_TO_STANDALONE_QUERY_TEMPLATE, other_llm) is not chain
+    assert registry.prompt("Answer {question}") is registry.prompt("Answer {question}")
+    assert asyncio.run(chain.ainvoke({"chat_history": "Human: hi", "question": "why?"})) == "standalone question"
@@ -0,0 +1,49 @@
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.pinecone_operation import load_chunk_texts
+
+
+def test_document_store_round_trip(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+
+    document_store.put_many([
+        {"id": "doc#a", "doc_key": "doc", "text": "first chunk", "page": 1, "start": 0, "end": 11},
+        {"id": "doc#b", "doc_key": "doc", "text": "second chunk", "page": 2, "start": 9, "end": 21}
+    ])
+    document_store.delete_many(["doc#a"])
+
+    assert document_store.get_many(["doc#a", "doc#b", "doc#c"]) == {
+        "doc#b": {"doc_key": "doc", "text": "second chunk", "page": 2, "start": 9, "end": 21, "readability": None}
+    }
+
+
+def test_document_store_keeps_readability_of_reused_chunks(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    counts = {"words": 2, "syllables": 3, "sentences": [2], "has_terminator": False, "open_start": True, "open_end": True}
+
+    document_store.put_many([
+        {"id": "doc#a", "doc_key": "doc", "text": "first chunk", "page": 1, "start": 0, "end": 11, "readability": counts}
+    ])
+    # a reused chunk is stored again with its new position only
+    document_store.put_many([
+        {"id": "doc#a", "doc_key": "doc", "text": "first chunk", "page": 2, "start": 40, "end": 51}
+    ])
+
+    assert document_store.get_many(["doc#a"]) == {
+        "doc#a": {"doc_key": "doc", "text": "first chunk", "page": 2, "start": 40, "end": 51, "readability": counts}
+    }
+
+
+def test_load_chunk_texts_keeps_text_of_legacy_vectors(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    document_store.put_many([
+        {"id": "doc#a", "doc_key": "doc", "text": "stored text", "page": 1, "start": 0, "end": 11}
+    ])
+
+    matches = [
+        {"id": "doc#a", "score": 0.9, "metadata": {"doc_key": "doc", "page": 1}},
+        {"id": "doc_0", "score": 0.8, "metadata": {"doc_key": "doc", "page": 1, "text": "legacy text"}}
+    ]
+
+    load_chunk_texts(matches, document_store)
+
+    assert [match["metadata"]["text"] for match in matches] == ["stored text", "legacy text"]
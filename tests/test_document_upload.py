@@ -0,0 +1,109 @@
+import io
+import threading
+import time
+
+import fitz
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src.utils.aws_operation import get_file
+
+
+def create_pdf(num_pages):
+    document = fitz.open()
+    for page_number in range(num_pages):
+        document.new_page().insert_text((50, 100), f"page {page_number}")
+    return document.tobytes()
+
+
+class SingleReadBody:
+    """An S3 response body, a stream that is empty after the first read."""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self):
+        return self.stream.read()
+
+
+class StubS3Client:
+    def __init__(self, objects=None, on_put=None):
+        self.objects = objects or {}
+        self.on_put = on_put
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": SingleReadBody(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        if self.on_put:
+            self.on_put()
+        self.objects[Key] = Body
+
+
+def wait_until_finished(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_get_file_reads_the_body_once():
+    file_bytes = create_pdf(2)
+    file_object, content = get_file(StubS3Client({"tenant/a.pdf": file_bytes}), "tenant/a.pdf")
+
+    assert content == file_bytes
+    assert file_object.read() == file_bytes
+
+    with pytest.raises(HTTPException) as error:
+        get_file(StubS3Client(), "tenant/missing.pdf")
+    assert error.value.status_code == 404
+
+
+def test_upload_is_parsed_once_and_put_to_s3_while_indexing(app_module, monkeypatch):
+    file_bytes = create_pdf(3)
+    put_started = threading.Event()
+    indexing_started = threading.Event()
+    overlaps = []
+    indexed = []
+
+    def put_object():
+        put_started.set()
+        # the upload only finishes once indexing has started
+        overlaps.append(indexing_started.wait(timeout=5))
+
+    def index(username, doc_key, file_bytes, pdf_document, on_progress, **kwargs):
+        indexing_started.set()
+        overlaps.append(put_started.wait(timeout=5))
+        indexed.append((doc_key, file_bytes, pdf_document.page_count))
+
+    opened = []
+    fitz_open = fitz.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(kwargs.get("stream"))
+        return fitz_open(*args, **kwargs)
+
+    s3_client = StubS3Client(on_put=put_object)
+    monkeypatch.setattr(app_module, "s3_client", s3_client)
+    monkeypatch.setattr(app_module, "init_pinecone_and_doc_indexing", index)
+    monkeypatch.setattr(fitz, "open", counting_open)
+
+    app = FastAPI()
+    app.include_router(app_module.api_router)
+    response = TestClient(app).post(
+        "/upload_document_and_trigger_indexing",
+        files={"file": ("report.pdf", file_bytes, "application/pdf")})
+
+    assert response.status_code == 200
+    job = app_module.ingestion_job_manager.get(response.json()["job_id"])
+    wait_until_finished(job)
+
+    doc_key = f"{app_module.MAIN_TENANT}/report.pdf"
+    assert job.state == "succeeded", job.error
+    assert opened == [file_bytes]
+    assert indexed == [(doc_key, file_bytes, 3)]
+    assert overlaps == [True, True]
+    assert s3_client.objects == {doc_key: file_bytes}
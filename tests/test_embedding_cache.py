@@ -0,0 +1,95 @@
+import asyncio
+
+from src.gen_ai.rag.embedding_cache import (
+    CachedEmbeddings,
+    QueryEmbeddingCache,
+    SQLiteEmbeddingCache
+)
+
+
+class CountingEmbedder:
+    model = "fake-embedding-model"
+
+    def __init__(self):
+        self.embedded_texts = []
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+class DictRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+def test_cached_embeddings_only_embeds_missing_texts(tmp_path):
+    embedder = CountingEmbedder()
+    cached_embeddings = CachedEmbeddings(
+        embedding_model=embedder,
+        cache=SQLiteEmbeddingCache(str(tmp_path / "cache.sqlite3")))
+
+    assert cached_embeddings.embed_documents(["footer", "body", "footer"]) == [[6.0, 1.0], [4.0, 1.0], [6.0, 1.0]]
+    assert cached_embeddings.embed_documents(["footer  ", "new"]) == [[6.0, 1.0], [3.0, 1.0]]
+    assert cached_embeddings.embed_query("body") == [4.0, 1.0]
+
+    assert embedder.embedded_texts == ["footer", "body", "new"]
+    assert cached_embeddings.stats()["hits"] == 2
+
+
+def test_sqlite_embedding_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteEmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=8)
+
+    cache.set_many({"a": b"1234"})
+    cache.set_many({"b": b"5678"})
+    cache.get_many(["a"])
+    cache.set_many({"c": b"9012"})
+
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_query_embedding_cache_is_shared_through_redis_and_expires(tmp_path):
+    embedder = CountingEmbedder()
+    redis_client = DictRedis()
+    worker_caches = [QueryEmbeddingCache(redis_client, max_entries=1, ttl_seconds=60) for _ in range(2)]
+    workers = [CachedEmbeddings(embedding_model=embedder, query_cache=cache) for cache in worker_caches]
+
+    assert workers[0].embed_query("What is  the Total?") == [19.0, 1.0]
+    assert workers[0].embed_query("what is the total?") == [19.0, 1.0]
+    assert workers[1].embed_query("What is the total?") == [19.0, 1.0]
+    assert embedder.embedded_texts == ["What is  the Total?"]
+
+    assert worker_caches[0].stats()["memory_hits"] == 1
+    assert worker_caches[1].stats()["redis_hits"] == 1
+
+    expired_cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=0)
+    expired_cache.set("query", b"1234")
+    assert expired_cache.get("query") is None
+    assert expired_cache.stats()["hit_rate"] == 0.0
+
+
+def test_async_query_embedding_shares_the_cache(tmp_path):
+    embedder = CountingEmbedder()
+    cached_embeddings = CachedEmbeddings(
+        embedding_model=embedder,
+        cache=SQLiteEmbeddingCache(str(tmp_path / "cache.sqlite3")),
+        query_cache=QueryEmbeddingCache())
+
+    assert asyncio.run(cached_embeddings.aembed_query("body")) == [4.0, 1.0]
+    assert cached_embeddings.embed_query("Body") == [4.0, 1.0]
+    assert asyncio.run(cached_embeddings.aembed_query("body")) == [4.0, 1.0]
+
+    assert embedder.embedded_texts == ["body"]
+    assert cached_embeddings.stats()["query_cache"]["memory_hits"] == 2
@@ -0,0 +1,78 @@
+import fitz
+
+from src.gen_ai.rag.doc_processing import init_pinecone_and_doc_indexing, list_document_vector_ids
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+DOC_KEY = "tenant/report.pdf"
+
+
+class RecordingEmbedder:
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+
+def create_pdf(page_labels):
+    document = fitz.open()
+    for label in page_labels:
+        page = document.new_page()
+        page.insert_text((50, 100), f"{label} section " * 5)
+    return document.tobytes()
+
+
+def index(file_bytes, embedding_model, vector_store, document_store):
+    progress = {}
+    init_pinecone_and_doc_indexing(
+        username="tenant",
+        doc_key=DOC_KEY,
+        file_bytes=file_bytes,
+        embedding_model=embedding_model,
+        vector_store=vector_store,
+        on_progress=lambda stage, n: progress.__setitem__(stage, progress.get(stage, 0) + n),
+        document_store=document_store)
+    return progress
+
+
+def test_reindexing_only_embeds_new_chunks_and_deletes_removed_ones(tmp_path):
+    vector_store = LocalVectorStore(str(tmp_path / "vectors"))
+    document_store = DocumentStore(str(tmp_path / "documents.db"))
+
+    first = RecordingEmbedder()
+    assert index(create_pdf(["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]),
+                 first, vector_store, document_store) == {"embedded": 6, "upserted": 6}
+    first_ids = list_document_vector_ids(vector_store, DOC_KEY)
+
+    # vectors indexed before ids were content based, and an id that only shares the prefix
+    vector_store.upsert([
+        {"id": vector_id, "values": [1.0], "metadata": {"doc_key": DOC_KEY}}
+        for vector_id in [f"{DOC_KEY}_0", f"{DOC_KEY}_1", f"{DOC_KEY}_2", f"{DOC_KEY}_draft"]
+    ])
+    assert list_document_vector_ids(vector_store, DOC_KEY) == first_ids | {f"{DOC_KEY}_0", f"{DOC_KEY}_1", f"{DOC_KEY}_2"}
+
+    # "epsilon" is edited, "zeta" is removed and "eta" is added
+    second = RecordingEmbedder()
+    progress = index(create_pdf(["alpha", "beta", "gamma", "delta", "epsilon revised", "eta"]),
+                     second, vector_store, document_store)
+
+    assert progress == {"reused": 4, "embedded": 2, "upserted": 2, "deleted": 5}
+    assert sorted(text.split()[0] for text in second.texts) == ["epsilon", "eta"]
+
+    second_ids = list_document_vector_ids(vector_store, DOC_KEY)
+    assert len(second_ids) == 6 and len(first_ids & second_ids) == 4
+    assert not any(vector_id.startswith(f"{DOC_KEY}_") for vector_id in second_ids)
+    assert [ids for ids in vector_store.list(f"{DOC_KEY}_draft")] == [[f"{DOC_KEY}_draft"]]
+
+    stored = document_store.get_document_chunks(DOC_KEY)
+    assert {chunk["id"] for chunk in stored} == second_ids
+    assert [chunk["text"].split()[0] for chunk in stored] == ["alpha", "beta", "gamma", "delta", "epsilon", "eta"]
+
+    # indexing the same file again embeds nothing
+    third = RecordingEmbedder()
+    assert index(create_pdf(["alpha", "beta", "gamma", "delta", "epsilon revised", "eta"]),
+                 third, vector_store, document_store) == {"reused": 6}
+    assert third.texts == []
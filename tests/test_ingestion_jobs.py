@@ -0,0 +1,117 @@
+import threading
+import time
+
+from src.utils.ingestion_jobs import IngestionJobManager
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_jobs_go_from_queued_to_running_to_finished():
+    manager = IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=10)
+    release = threading.Event()
+
+    def index(on_progress):
+        on_progress("reused", 2)
+        on_progress("embedded", 3)
+        on_progress("upserted", 3)
+        on_progress("embedded", 1)
+        release.wait(timeout=5)
+
+    def fail(on_progress):
+        raise RuntimeError("not a PDF")
+
+    running = manager.submit("tenant/a.pdf", "a.pdf", index)
+    # one job at a time, the second one waits for the first
+    queued = manager.submit("tenant/b.pdf", "b.pdf", fail)
+
+    assert wait_until(lambda: running.chunks_embedded == 4)
+    assert running.state == "running"
+    assert queued.state == "queued"
+
+    release.set()
+    assert wait_until(lambda: queued.finished_at is not None)
+
+    assert manager.get(running.job_id).to_dict()["progress"] == {
+        "chunks_reused": 2, "chunks_embedded": 4, "chunks_upserted": 3, "chunks_deleted": 0
+    }
+    assert running.state == "succeeded" and running.error is None
+    assert queued.state == "failed" and queued.error == "not a PDF"
+    assert manager.get("unknown") is None
+
+
+def test_oldest_finished_jobs_are_evicted():
+    manager = IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=2)
+    release = threading.Event()
+
+    blocked = manager.submit("tenant/a.pdf", "a.pdf", lambda on_progress: release.wait(timeout=5))
+    assert wait_until(lambda: blocked.state == "running")
+
+    finished = []
+    for name in ["b", "c"]:
+        release.set()
+        job = manager.submit(f"tenant/{name}.pdf", f"{name}.pdf", lambda on_progress: None)
+        assert wait_until(lambda: job.finished_at is not None)
+        finished.append(job)
+
+    last = manager.submit("tenant/d.pdf", "d.pdf", lambda on_progress: None)
+    assert wait_until(lambda: last.finished_at is not None)
+
+    # only the 2 most recent jobs are kept once they are finished
+    assert manager.get(blocked.job_id) is None
+    assert manager.get(finished[0].job_id) is None
+    assert manager.get(finished[1].job_id) is finished[1]
+    assert manager.get(last.job_id) is last
+
+
+def test_running_jobs_are_never_evicted():
+    manager = IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=1)
+    release = threading.Event()
+
+    running = manager.submit("tenant/a.pdf", "a.pdf", lambda on_progress: release.wait(timeout=5))
+    queued = manager.submit("tenant/b.pdf", "b.pdf", lambda on_progress: None)
+
+    assert manager.get(running.job_id) is running
+    assert manager.get(queued.job_id) is queued
+    release.set()
+
+
+def test_bulk_jobs_fail_per_document():
+    manager = IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=10)
+
+    def index_all(callbacks):
+        (on_progress_a, on_done_a), (on_progress_b, on_done_b), _ = callbacks
+        on_progress_a("upserted", 5)
+        on_done_a(None)
+        on_done_b(FileNotFoundError("b.pdf"))
+        # the third document is never reported done
+
+    jobs = manager.submit_bulk(
+        [("tenant/a.pdf", "a.pdf"), ("tenant/b.pdf", "b.pdf"), ("tenant/c.pdf", "c.pdf")],
+        index_all)
+
+    assert wait_until(lambda: all(job.finished_at is not None for job in jobs))
+    assert [job.state for job in jobs] == ["succeeded", "failed", "failed"]
+    assert jobs[0].chunks_upserted == 5
+    assert jobs[1].error == "b.pdf"
+    assert jobs[2].error == "document was not indexed"
+
+
+def test_bulk_jobs_fail_when_the_task_raises():
+    manager = IngestionJobManager(max_concurrent_jobs=1, max_retained_jobs=10)
+
+    def index_all(callbacks):
+        callbacks[0][1](None)
+        raise RuntimeError("vector store is down")
+
+    jobs = manager.submit_bulk([("tenant/a.pdf", "a.pdf"), ("tenant/b.pdf", "b.pdf")], index_all)
+
+    assert wait_until(lambda: all(job.finished_at is not None for job in jobs))
+    assert [job.state for job in jobs] == ["succeeded", "failed"]
+    assert jobs[1].error == "vector store is down"
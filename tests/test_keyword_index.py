@@ -0,0 +1,118 @@
+import asyncio
+
+from src.gen_ai.rag import chat_processing
+from src.gen_ai.rag.chat_processing import stream_semantic_search_response
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.keyword_index import (
+    KeywordIndex,
+    KeywordIndexStore,
+    reciprocal_rank_fusion
+)
+from src.gen_ai.rag.pinecone_operation import fuse_keyword_matches
+from src.gen_ai.rag.prompt_template import LLM_GENERATED_SUMMARY_FALLBACK
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+CHUNKS = [
+    ("doc#a", "Introduction to the course and its grading policy."),
+    ("doc#b", "CS-101 covers programming basics. CS-101 has weekly labs."),
+    ("doc#c", "The advanced course MATH-204 requires CS-101 as a prerequisite and a long list of other readings."),
+    ("doc#d", "Office hours are held every Tuesday.")
+]
+
+
+def test_keyword_index_ranks_chunks_with_query_identifiers_first(tmp_path):
+    index = KeywordIndex.build(CHUNKS)
+
+    results = index.search("what is CS-101?", top_k=3)
+
+    assert [vector_id for vector_id, _ in results] == ["doc#b", "doc#c"]
+    assert results[0][1] > results[1][1] > 0
+
+    keyword_index_store = KeywordIndexStore(str(tmp_path / "keyword_index"))
+    keyword_index_store.build("doc", CHUNKS)
+
+    assert keyword_index_store.get("doc").search("what is CS-101?", top_k=3) == results
+    assert keyword_index_store.get("other") is None
+
+
+def test_fused_matches_keep_cosine_scores():
+    vector_matches = [
+        {"id": "doc#d", "score": 0.71, "metadata": {"doc_key": "doc", "page": 2}},
+        {"id": "doc#c", "score": 0.69, "metadata": {"doc_key": "doc", "page": 1}}
+    ]
+    keyword_matches = [("doc#b", 2.1), ("doc#c", 1.3)]
+
+    assert [vector_id for vector_id, _ in reciprocal_rank_fusion([["x", "y"], ["y"]])] == ["y", "x"]
+
+    matches = fuse_keyword_matches(vector_matches, keyword_matches, doc_key="doc", top_k=2)
+
+    assert [match["id"] for match in matches] == ["doc#c", "doc#d"]
+    assert [match["score"] for match in matches] == [0.69, 0.71]
+
+    matches = fuse_keyword_matches(vector_matches, keyword_matches, doc_key="doc", top_k=3)
+
+    assert matches[2]["id"] == "doc#b"
+    assert matches[2]["score"] is None
+    assert matches[2]["metadata"] == {"doc_key": "doc"}
+
+
+def test_keyword_coverage_is_the_idf_weighted_share_of_query_terms():
+    index = KeywordIndex.build(CHUNKS)
+
+    # question words are left out
+    assert index.coverage("what is CS-101?") == {"doc#b": 1.0, "doc#c": 1.0}
+
+    coverage = index.coverage("CS-101 office hours")
+    assert set(coverage) == {"doc#b", "doc#c", "doc#d"}
+    assert coverage["doc#b"] < coverage["doc#d"] < 1.0
+
+    assert index.coverage("what is this about?") == {}
+
+
+class OrthogonalEmbedder:
+    """Embeds every query orthogonally to the stored chunks, as an identifier the embedding does not capture."""
+
+    async def aembed_query(self, text):
+        return [0.0, 1.0]
+
+
+def test_exact_keyword_match_skips_the_fallback_summary(tmp_path, monkeypatch):
+    doc_key = "tenant/doc.pdf"
+    chunks = [(f"{doc_key}#{vector_id[4:]}", text) for vector_id, text in CHUNKS]
+
+    vector_store = LocalVectorStore(str(tmp_path / "vectors"))
+    vector_store.upsert([
+        {"id": vector_id, "values": [1.0, 0.0], "metadata": {"username": "tenant", "doc_key": doc_key}}
+        for vector_id, _ in chunks
+    ])
+    document_store = DocumentStore(str(tmp_path / "documents.db"))
+    document_store.put_many([
+        {"id": vector_id, "doc_key": doc_key, "text": text, "page": 1, "start": 100 * i, "end": 100 * i + len(text)}
+        for i, (vector_id, text) in enumerate(chunks)
+    ])
+    keyword_index_store = KeywordIndexStore(str(tmp_path / "keyword_index"))
+    keyword_index_store.build(doc_key, chunks)
+
+    templates = []
+
+    async def stream_llm_response(llm, template, inputs):
+        templates.append(template)
+        yield "answer"
+
+    monkeypatch.setattr(chat_processing, "stream_llm_response", stream_llm_response)
+
+    async def answer(keyword_index_store):
+        pieces = stream_semantic_search_response(
+            llm=None, embedding_model=OrthogonalEmbedder(), standalone_query="What is CS-101?", username="tenant",
+            history_messages=[], doc_key=doc_key, top_k=2, pinecone_index=vector_store,
+            document_store=document_store, keyword_index_store=keyword_index_store)
+        return [piece async for piece in pieces]
+
+    # the vector search alone finds nothing similar enough
+    asyncio.run(answer(keyword_index_store=None))
+    assert templates == [LLM_GENERATED_SUMMARY_FALLBACK]
+
+    templates.clear()
+    asyncio.run(answer(keyword_index_store))
+    assert LLM_GENERATED_SUMMARY_FALLBACK not in templates
@@ -0,0 +1,56 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+from src.gen_ai.rag import doc_processing
+from src.gen_ai.rag.doc_processing import iter_pages_from_pdf
+
+
+def create_pdf(num_pages):
+    document = fitz.open()
+    for page_number in range(num_pages):
+        page = document.new_page()
+        page.insert_text((50, 100), f"text of page {page_number}")
+    return document.tobytes()
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """Runs the tasks in threads, and records the size of every task as it would be sent to a worker process."""
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.task_sizes = []
+        self.paths = []
+
+    def submit(self, function, *args, **kwargs):
+        self.task_sizes.append(len(pickle.dumps((function, args, kwargs))))
+        self.paths.append(function.args[0])
+        return super().submit(function, *args, **kwargs)
+
+
+def test_parallel_extraction_returns_pages_in_order():
+    file_bytes = create_pdf(7)
+
+    serial_pages = list(iter_pages_from_pdf(file_bytes, parallel=False))
+    # ranges of 2 pages extracted by 2 worker processes, the last range is shorter
+    parallel_pages = list(iter_pages_from_pdf(file_bytes, parallel=True, max_workers=2, pages_per_task=2))
+
+    assert parallel_pages == serial_pages
+    assert [page.strip() for page in serial_pages] == [f"text of page {page_number}" for page_number in range(7)]
+
+
+def test_parallel_extraction_does_not_send_the_file_with_every_range(monkeypatch):
+    file_bytes = create_pdf(40)
+    executor = RecordingExecutor()
+    monkeypatch.setattr(doc_processing, "get_pdf_extraction_pool", lambda: executor)
+
+    pages = list(iter_pages_from_pdf(file_bytes, parallel=True, max_workers=2, pages_per_task=4))
+    executor.shutdown()
+
+    assert pages == list(iter_pages_from_pdf(file_bytes, parallel=False))
+    assert len(executor.task_sizes) == 10
+    assert max(executor.task_sizes) < len(file_bytes) / 10
+    # the file the workers read is removed once the pages are extracted
+    assert len(set(executor.paths)) == 1 and not os.path.exists(executor.paths[0])
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from src.gen_ai.rag.doc_processing import map_in_order, prefetch
+
+
+class CountingItems:
+    """Yields numbers and records how many were pulled."""
+
+    def __init__(self, num_items, fail_at=None):
+        self.num_items = num_items
+        self.fail_at = fail_at
+        self.pulled = 0
+
+    def __iter__(self):
+        for item in range(self.num_items):
+            if item == self.fail_at:
+                raise ValueError(f"item {item} failed")
+            self.pulled += 1
+            yield item
+
+
+def wait_for_threads(threads_before, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if set(threading.enumerate()) <= threads_before:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_map_in_order_yields_results_in_input_order():
+    # later items complete first
+    def slow_for_early_items(item):
+        time.sleep(0.01 * (10 - item))
+        return item * item
+
+    assert list(map_in_order(slow_for_early_items, range(10), max_in_flight=4)) == [item * item for item in range(10)]
+
+
+def test_map_in_order_bounds_items_in_flight_and_raises_errors():
+    items = CountingItems(100)
+    results = map_in_order(lambda item: item, items, max_in_flight=3)
+
+    assert next(results) == 0
+    # the first result was handed over, one more item was pulled
+    assert items.pulled == 4
+
+    def fail_on_five(item):
+        if item == 5:
+            raise ValueError("item 5 failed")
+        return item
+
+    with pytest.raises(ValueError, match="item 5 failed"):
+        list(map_in_order(fail_on_five, range(10), max_in_flight=3))
+
+
+def test_prefetch_is_bounded_and_raises_producer_errors():
+    items = CountingItems(100)
+    prefetched = prefetch(items, max_size=2)
+
+    assert next(prefetched) == 0
+    time.sleep(0.2)
+    # two items in the queue, and one pulled by the producer waiting for room
+    assert items.pulled <= 4
+    prefetched.close()
+
+    with pytest.raises(ValueError, match="item 3 failed"):
+        list(prefetch(CountingItems(10, fail_at=3), max_size=2))
+
+
+def test_prefetch_producer_stops_when_the_consumer_stops_early():
+    threads_before = set(threading.enumerate())
+    items = CountingItems(1000)
+
+    for item in prefetch(items, max_size=2):
+        if item == 5:
+            break
+
+    assert wait_for_threads(threads_before)
+    pulled = items.pulled
+    time.sleep(0.2)
+    assert items.pulled == pulled < 1000
+
+
+def test_map_in_order_stops_pulling_items_when_the_consumer_stops_early():
+    items = CountingItems(1000)
+    results = map_in_order(lambda item: item, items, max_in_flight=3)
+
+    for result in results:
+        if result == 5:
+            break
+    results.close()
+
+    assert items.pulled <= 5 + 1 + 3
@@ -0,0 +1,51 @@
+from src.gen_ai.rag.prompt_budget import TokenCounter, assemble_chat_history, assemble_context
+from src.models.requests import SingleChatMessageRequest
+
+
+class WordCounter(TokenCounter):
+    """Counts every word as one token."""
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, max_tokens):
+        return " ".join(text.split()[:max_tokens])
+
+
+def message(role, content):
+    return SingleChatMessageRequest(role=role, content=content, timestamp="2023-07-17T12:34:56")
+
+
+def passage(text):
+    return {"id": text, "score": 0.9, "metadata": {"text": text}}
+
+
+def test_oldest_messages_are_dropped_first():
+    history = [
+        message("user", "first question about the syllabus"),
+        message("assistant", "first answer"),
+        message("user", "second question"),
+        message("assistant", "second answer")
+    ]
+
+    text, tokens, kept = assemble_chat_history(history, max_tokens=11, counter=WordCounter())
+
+    assert text == "AI: first answer\nHuman: second question\nAI: second answer"
+    assert (tokens, kept) == (11, 3)
+    assert assemble_chat_history([message("user", "one two three four five")], max_tokens=3, counter=WordCounter())[0] == "Human: one ..."
+
+
+def test_best_passages_are_packed_first():
+    matches = [passage("best passage"), passage("a very long second passage that does not fit"), passage("third passage")]
+
+    text, tokens, kept = assemble_context(matches, max_tokens=5, counter=WordCounter())
+
+    assert text == "best passage\n\nthird passage"
+    assert (tokens, kept) == (5, 2)
+
+
+def test_token_counts_are_estimated_without_the_tokenizer():
+    counter = TokenCounter(encoding_name="missing-encoding")
+
+    assert counter.count("a" * 10) == 3
+    assert counter.truncate("a" * 10, 2) == "a" * 8
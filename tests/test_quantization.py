@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+import pytest
+
+from src.gen_ai.rag import vector_store as vector_store_module
+from src.gen_ai.rag.quantization import (
+    ProductQuantizedVectors,
+    ScalarQuantizedVectors,
+    quantize_vectors,
+    update_quantized_vectors
+)
+from src.gen_ai.rag.vector_store import LocalVectorStore
+
+
+def clustered_vectors(num_vectors=600, dimension=64, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(20, dimension))
+    return (topics[rng.integers(20, size=num_vectors)] + 0.5 * rng.normal(size=(num_vectors, dimension))).astype(np.float32)
+
+
+def test_quantized_vectors_approximate_inner_products():
+    vectors = clustered_vectors()
+    query = vectors[0]
+
+    scalar = ScalarQuantizedVectors.from_vectors(vectors, block_size=128)
+    product = ProductQuantizedVectors.from_vectors(vectors, num_subspaces=16)
+
+    exact = vectors @ query
+    assert np.corrcoef(scalar.scores(query), exact)[0, 1] > 0.999
+    assert np.corrcoef(product.scores(query), exact)[0, 1] > 0.95
+    assert scalar.codes.nbytes == vectors.nbytes // 4
+    assert product.codes.shape == (600, 16)
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+def test_quantized_local_vector_store_rescores_shortlist_exactly(tmp_path, quantization):
+    # enough vectors for product quantization to be smaller than int8 codes
+    vectors = clustered_vectors(num_vectors=1400)
+    queries = clustered_vectors(num_vectors=20, seed=1)
+    LocalVectorStore(str(tmp_path)).upsert([
+        {"id": f"doc#{i}", "values": vector.tolist(), "metadata": {"doc_key": "doc"}}
+        for i, vector in enumerate(vectors)
+    ])
+
+    exact_store = LocalVectorStore(str(tmp_path))
+    quantized_store = LocalVectorStore(str(tmp_path), quantization=quantization, pq_subspaces=16, rescore_factor=10)
+
+    for query in queries:
+        exact = exact_store.query(vector=query.tolist(), filter={"doc_key": "doc"}, top_k=5)["matches"]
+        approximate = quantized_store.query(vector=query.tolist(), filter={"doc_key": "doc"}, top_k=5)["matches"]
+
+        assert [match["id"] for match in approximate] == [match["id"] for match in exact]
+        assert np.allclose([match["score"] for match in approximate], [match["score"] for match in exact])
+
+
+def test_appended_rows_are_encoded_without_learning_the_codebooks_again():
+    vectors = clustered_vectors()
+    product = ProductQuantizedVectors.from_vectors(vectors[:400], num_subspaces=16)
+    scalar = ScalarQuantizedVectors.from_vectors(vectors[:400])
+
+    updated_product = update_quantized_vectors(product, vectors, "pq", num_subspaces=16)
+    updated_scalar = update_quantized_vectors(scalar, vectors, "int8")
+
+    assert updated_product.codebooks is product.codebooks
+    assert np.array_equal(updated_product.codes, product.reencoded(vectors).codes)
+    assert np.array_equal(updated_scalar.codes, ScalarQuantizedVectors.from_vectors(vectors).codes)
+
+    # compacted rows are encoded again with the same codebooks
+    assert update_quantized_vectors(product, vectors[200:], "pq", num_subspaces=16, rows_appended=False).codebooks is product.codebooks
+    # codebooks learned on the first rows are learned again once the rows more than double
+    assert update_quantized_vectors(product, clustered_vectors(num_vectors=900), "pq", num_subspaces=16).num_trained == 900
+
+
+def test_short_partitions_keep_int8_codes_until_product_quantization_is_smaller():
+    vectors = clustered_vectors(num_vectors=1400)
+
+    # the codebooks of 16 subspaces of 64 dimensions outweigh the int8 codes of up to 1260 vectors
+    short = quantize_vectors(vectors[:600], "pq", num_subspaces=16)
+    assert isinstance(short, ScalarQuantizedVectors)
+    assert isinstance(update_quantized_vectors(short, vectors[:1200], "pq", num_subspaces=16), ScalarQuantizedVectors)
+
+    grown = update_quantized_vectors(short, vectors, "pq", num_subspaces=16)
+    assert isinstance(grown, ProductQuantizedVectors)
+    assert grown.nbytes < ScalarQuantizedVectors.from_vectors(vectors).nbytes
+
+
+def test_quantized_copy_is_built_outside_of_the_store_lock(tmp_path, monkeypatch):
+    vectors = clustered_vectors()
+    store = LocalVectorStore(str(tmp_path), quantization="pq", pq_subspaces=16)
+    store.upsert([{"id": f"a#{i}", "values": vector.tolist(), "metadata": {"doc_key": "a"}} for i, vector in enumerate(vectors)])
+    store.upsert([{"id": "b#0", "values": vectors[0].tolist(), "metadata": {"doc_key": "b"}}])
+
+    building = threading.Event()
+    release = threading.Event()
+    update = vector_store_module.update_quantized_vectors
+
+    def slow_update(*args, **kwargs):
+        building.set()
+        release.wait(timeout=10)
+        return update(*args, **kwargs)
+
+    monkeypatch.setattr(vector_store_module, "update_quantized_vectors", slow_update)
+
+    query = threading.Thread(target=store.query, kwargs={"vector": vectors[0].tolist(), "filter": {"doc_key": "a"}, "top_k": 5})
+    query.start()
+    assert building.wait(timeout=10)
+
+    # writes and queries of other documents go on while the copy of document a is built
+    store.upsert([{"id": "b#1", "values": vectors[1].tolist(), "metadata": {"doc_key": "b"}}])
+    assert len(store.query(vector=vectors[1].tolist(), filter={"doc_key": "b"}, top_k=5)["matches"]) == 2
+    assert not release.is_set()
+
+    release.set()
+    query.join()
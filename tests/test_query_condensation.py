@@ -0,0 +1,79 @@
+import asyncio
+from typing import List
+
+from langchain_core.language_models import FakeListChatModel
+
+from src.gen_ai.rag.chat_processing import condense_query, condense_query_with_speculative_retrieval
+from src.gen_ai.rag.query_condensation import CondensationCache, is_self_contained
+from src.models.requests import SingleChatMessageRequest
+
+
+class RecordingChatModel(FakeListChatModel):
+    prompts: List[str] = []
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(messages[-1].content)
+        return super()._call(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+class KeywordEmbedder:
+    """Embeds a query as the presence of a few keywords."""
+
+    keywords = ("compiler", "language", "grading")
+
+    async def aembed_query(self, text):
+        return [float(keyword in text.lower()) for keyword in self.keywords] + [0.01]
+
+
+def message(role, content):
+    return SingleChatMessageRequest(role=role, content=content, timestamp="2023-07-17T12:34:56")
+
+
+def test_only_questions_referring_back_need_condensation():
+    assert is_self_contained("What is the grading policy of the course?")
+    assert is_self_contained("What is this document about?")
+    assert not is_self_contained("Why is that?")
+    assert not is_self_contained("What does it say about compilers?")
+    assert not is_self_contained("And what about the final exam?")
+    assert not is_self_contained("Tell me more")
+
+
+def test_condensation_is_skipped_or_memoized():
+    llm = RecordingChatModel(responses=["What is the relationship between compilers and programming languages?"])
+    condensation_cache = CondensationCache()
+    history = [
+        message("user", "Tell me the overview of this document"),
+        message("assistant", "The document is about compiler design")
+    ]
+
+    standalone_query = asyncio.run(condense_query(llm, message("user", "How does it relate to programming languages?"), history, condensation_cache))
+    asyncio.run(condense_query(llm, message("user", "How does it relate to programming languages?"), history, condensation_cache))
+    self_contained_query = asyncio.run(condense_query(llm, message("user", "What is the grading policy of the course?"), history, condensation_cache))
+
+    assert standalone_query == "What is the relationship between compilers and programming languages?"
+    assert self_contained_query == "What is the grading policy of the course?"
+    assert len(llm.prompts) == 1
+    # the prompt holds the formatted history and the question text
+    assert "The document is about compiler design" in llm.prompts[0]
+    assert "FOLLOWUP QUESTION: How does it relate to programming languages?" in llm.prompts[0]
+
+
+def test_speculative_retrieval_is_reused_only_for_close_queries():
+    retrieved = []
+
+    async def retrieve(query):
+        retrieved.append(query)
+        return [{"id": query}]
+
+    history = [message("user", "Tell me the overview of this document"), message("assistant", "The document is about compilers")]
+
+    def run(question, condensed):
+        return asyncio.run(condense_query_with_speculative_retrieval(
+            FakeListChatModel(responses=[condensed]), message("user", question), history, retrieve, KeywordEmbedder()))
+
+    assert run("What is the grading policy of the course?", "unused") == (
+        "What is the grading policy of the course?", [{"id": "What is the grading policy of the course?"}], "not_needed")
+    assert run("What does it say about compilers?", "What does the document say about compilers?") == (
+        "What does the document say about compilers?", [{"id": "What does it say about compilers?"}], "hit")
+    # the results of the raw question are dropped, they are retrieved again for the standalone query
+    assert run("Why is that?", "Why is the grading policy strict?") == ("Why is the grading policy strict?", None, "miss")
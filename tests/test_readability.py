@@ -0,0 +1,40 @@
+import itertools
+import json
+
+import textstat
+
+from src.gen_ai.rag.readability import chunk_readability, flesch_reading_ease, readability_counts
+from src.gen_ai.rag.text_chunker import split_text_spans
+
+
+TEXT = (
+    "Retrieval augmented generation grounds the answers of a language model in the passages of a document. "
+    "The document is split into overlapping chunks, and every chunk is embedded once! "
+    "Why? Queries are embedded too, and the closest chunks are retrieved. "
+    "Short ones count less. E.g. a reply. "
+    "A passage that is hard to read is rephrased by the model before it reaches the user, "
+    "an easy one is returned as it is"
+)
+
+
+def test_flesch_reading_ease_of_chunks_matches_textstat():
+    chunks = [TEXT[start:end] for start, end in split_text_spans(TEXT, chunk_size=90, chunk_overlap=20)]
+    # chunks cut sentences in the middle, and retrieval returns them in any order
+    samples = [chunks, chunks[::-1]] + [list(pair) for pair in itertools.permutations(chunks[:5], 2)]
+    samples += [
+        ["", "no terminator here", "and none here either", "until the end. Done"],
+        ["it goes on", "... and stops", "?! then goes on again"],
+        ["one", "two", "three words here."],
+        ["A sentence. ", " -- ", "continues here. And here"]
+    ]
+
+    for texts in samples:
+        assert flesch_reading_ease([readability_counts(text) for text in texts]) == textstat.flesch_reading_ease(" ".join(texts))
+
+
+def test_chunk_readability_of_stored_and_legacy_chunks():
+    counts = readability_counts("The chunk is counted at indexing time.")
+
+    assert chunk_readability({"metadata": {"text": "", "readability": counts}}) == counts
+    assert chunk_readability({"metadata": {"text": "", "readability": json.dumps(counts)}}) == counts
+    assert chunk_readability({"metadata": {"text": "The chunk is counted at indexing time."}}) == counts
@@ -0,0 +1,46 @@
+from src.gen_ai.rag.reranking import select_diverse_matches
+
+
+def match(vector_id, score, values):
+    return {"id": vector_id, "score": score, "values": values, "metadata": {}}
+
+
+def test_near_duplicates_and_weak_matches_are_left_out():
+    matches = [
+        match("a", 0.86, [1.0, 0.0, 0.0]),
+        # overlapping neighbour of "a"
+        match("a-overlap", 0.85, [0.99, 0.1, 0.0]),
+        match("b", 0.84, [0.6, 0.8, 0.0]),
+        match("c", 0.83, [0.6, 0.0, 0.8]),
+        match("weak", 0.70, [0.0, 0.0, 1.0])
+    ]
+
+    selected = select_diverse_matches(matches, max_matches=8)
+
+    assert [m["id"] for m in selected] == ["a", "b", "c"]
+    assert [m["id"] for m in select_diverse_matches(matches, max_matches=2)] == ["a", "b"]
+
+
+def test_keyword_only_matches_are_kept_by_fused_rank():
+    matches = [
+        match("a", 0.86, [1.0, 0.0]),
+        {"id": "keyword", "score": None, "metadata": {}},
+        match("b", 0.85, [0.0, 1.0]),
+        {"id": "keyword-2", "score": None, "metadata": {}},
+        match("a-overlap", 0.84, [1.0, 0.01]),
+        {"id": "keyword-low", "score": None, "metadata": {}}
+    ]
+
+    assert [m["id"] for m in select_diverse_matches(matches, max_matches=8)] == ["a", "b", "keyword"]
+    assert [m["id"] for m in select_diverse_matches(matches, max_matches=8, max_keyword_matches=0)] == ["a", "b"]
+
+
+def test_keyword_only_matches_do_not_refill_places_left_by_mmr():
+    matches = [
+        match("a", 0.86, [1.0, 0.0]),
+        {"id": "keyword", "score": None, "metadata": {}},
+        match("a-overlap", 0.85, [1.0, 0.01])
+    ]
+
+    # MMR stops after "a", the keyword only match ranked below it is not kept
+    assert [m["id"] for m in select_diverse_matches(matches, max_matches=3)] == ["a"]
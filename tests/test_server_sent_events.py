@@ -0,0 +1,43 @@
+import asyncio
+
+from src.utils.server_sent_events import stream_response_events
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+def test_streamed_pieces_end_with_the_full_response():
+    completed = []
+
+    async def pieces():
+        for piece in ["The ", "answer"]:
+            yield piece
+
+    async def on_complete(text):
+        completed.append(text)
+
+    events = asyncio.run(collect(stream_response_events(pieces(), on_complete)))
+
+    assert events == [
+        'data: {"token": "The "}\n\n',
+        'data: {"token": "answer"}\n\n',
+        'event: done\ndata: {"response": "The answer"}\n\n'
+    ]
+    assert completed == ["The answer"]
+
+
+def test_failed_stream_is_not_completed():
+    completed = []
+
+    async def pieces():
+        yield "partial"
+        raise RuntimeError("connection reset")
+
+    async def on_complete(text):
+        completed.append(text)
+
+    events = asyncio.run(collect(stream_response_events(pieces(), on_complete)))
+
+    assert events[-1].startswith("event: error\n")
+    assert completed == []
@@ -0,0 +1,109 @@
+import asyncio
+
+from src.utils.single_flight import SingleFlight
+
+
+class FakeRedis:
+    """Async Redis stand-in with the commands of the single-flight lock, without expiry."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def eval(self, script, num_keys, key, token):
+        if self.values.get(key) == token:
+            del self.values[key]
+            return 1
+        return 0
+
+
+def test_concurrent_requests_of_a_worker_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        single_flight = SingleFlight()
+        return await asyncio.gather(*(single_flight.run("doc#question", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert results == [("answer", "computed")] + [("answer", "coalesced")] * 4
+
+
+def test_workers_wait_for_the_result_of_the_lock_holder():
+    redis_client = FakeRedis()
+    responses = {}
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        responses["doc#question"] = "answer"
+        return "answer"
+
+    async def lookup():
+        return responses.get("doc#question")
+
+    async def main():
+        # one SingleFlight per worker, sharing Redis
+        workers = [SingleFlight(poll_interval=0.01) for _ in range(2)]
+        return await asyncio.gather(*(
+            worker.run("doc#question", compute, lookup=lookup, redis_client=redis_client) for worker in workers
+        ))
+
+    assert asyncio.run(main()) == [("answer", "computed"), ("answer", "coalesced_across_workers")]
+    assert len(calls) == 1
+    # the lock is released
+    assert redis_client.values == {}
+
+
+def test_waiting_times_out_into_an_independent_computation():
+    redis_client = FakeRedis()
+    # a lock held by a worker that never stores a result
+    redis_client.values["single-flight:doc#question"] = "other-worker"
+
+    async def compute():
+        return "answer"
+
+    async def lookup():
+        return None
+
+    single_flight = SingleFlight(wait_timeout=0.05, poll_interval=0.01)
+
+    assert asyncio.run(single_flight.run("doc#question", compute, lookup=lookup, redis_client=redis_client)) == ("answer", "timeout")
+
+
+def test_requests_compute_on_their_own_when_the_leader_fails():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("rate limited")
+        return "answer"
+
+    async def main():
+        single_flight = SingleFlight()
+        return await asyncio.gather(
+            *(single_flight.run("doc#question", compute) for _ in range(3)), return_exceptions=True)
+
+    leader, *waiters = asyncio.run(main())
+
+    # only the request that computed fails, the waiters compute again
+    assert isinstance(leader, RuntimeError)
+    assert waiters == [("answer", "timeout")] * 2
+    assert len(calls) == 3
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from typing import List
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+from src.gen_ai.rag.chat_processing import generate_summarized_response, load_summary_nodes
+from src.gen_ai.rag.document_store import DocumentStore
+from src.gen_ai.rag.prompt_budget import TokenCounter
+from src.gen_ai.rag.summary_tree import build_summary_tree, is_broad_summary_query, merge_chunk_texts, top_summary_nodes
+
+
+class WordCounter(TokenCounter):
+    def count(self, text):
+        return len(text.split())
+
+
+_prompts_lock = threading.Lock()
+
+
+class SummarizingChatModel(FakeListChatModel):
+    """Answers every prompt with a short summary naming the input, and records the prompts."""
+
+    prompts: List[str] = []
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        with _prompts_lock:
+            self.prompts.append(prompt)
+        return f"summary of {len(prompt)} characters"
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield ChatGenerationChunk(message=AIMessageChunk(content=self._call(messages)))
+
+
+def chunk(position, text):
+    return {"id": f"doc#{text}", "text": text, "page": 1, "start": position * 10, "end": position * 10 + len(text)}
+
+
+def test_broad_queries_are_told_from_topical_ones():
+    assert is_broad_summary_query("Summarize this document")
+    assert is_broad_summary_query("What is this document about?")
+    assert is_broad_summary_query("Give me a brief overview of the whole paper")
+    assert is_broad_summary_query("What are the main points?")
+    assert not is_broad_summary_query("Summarize the chapter on parsing")
+    assert not is_broad_summary_query("What is a compiler?")
+
+
+def test_overlapping_chunks_are_merged():
+    chunks = [{"text": "abcdef", "start": 0, "end": 6}, {"text": "efghij", "start": 4, "end": 10}]
+
+    assert merge_chunk_texts(chunks) == "abcdefghij"
+
+
+def test_only_changed_nodes_are_summarized_again():
+    llm = SummarizingChatModel(responses=["unused"], prompts=[])
+    chunks = [chunk(position, f"chunk {position} text") for position in range(8)]
+
+    def build(chunks, existing_nodes=None):
+        return build_summary_tree(chunks, llm, existing_nodes=existing_nodes, response_lengths=["short", "long"],
+                                  section_max_tokens=6, reduce_max_tokens=8, counter=WordCounter())
+
+    tree = build(chunks)
+    levels = [node["level"] for node in tree]
+
+    # 4 sections of 2 chunks, combined into 2 groups, then a document summary per length
+    assert levels == ["section"] * 4 + ["group"] * 2 + ["document"] * 2
+    assert top_summary_nodes(tree) == tree[4:6]
+    assert len(llm.prompts) == 8
+    assert [node["response_length"] for node in tree if node["level"] == "document"] == ["short", "long"]
+
+    llm.prompts.clear()
+    chunks[0] = chunk(0, "revised 0 text")
+    revised_tree = build(chunks, existing_nodes={node["id"]: node for node in tree})
+
+    # the first section, the group above it and the document summaries
+    assert len(llm.prompts) == 4
+    assert [node["id"] for node in revised_tree][1:4] == [node["id"] for node in tree][1:4]
+
+
+def test_broad_summarization_queries_use_the_stored_summaries(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    document_store.put_summaries("tenant/doc.pdf", [
+        {"id": "s", "level": "section", "position": 0, "response_length": "", "text": "section summary", "start": 0, "end": 9},
+        {"id": "d", "level": "document", "position": 0, "response_length": "short", "text": "short document summary", "start": 0, "end": 9}
+    ])
+    llm = SummarizingChatModel(responses=["unused"], prompts=[])
+
+    def summarize(preferred_response_length, metadata):
+        # no vector store or embedding model, retrieval would fail
+        return asyncio.run(generate_summarized_response(
+            llm=llm, embedding_model=None, standalone_query="Summarize this document", username="tenant",
+            history_messages=[], doc_key="tenant/doc.pdf", top_k=8, preferred_response_length=preferred_response_length,
+            pinecone_index=None, document_store=document_store, metadata=metadata))
+
+    metadata = {}
+    assert summarize("Short", metadata) == "short document summary"
+    assert metadata["summary_source"] == "document_summary"
+    assert llm.prompts == []
+
+    metadata = {}
+    summarize("two sentences", metadata)
+    assert metadata["summary_source"] == "section_summaries"
+    assert "section summary" in llm.prompts[0] and "two sentences" in llm.prompts[0]
+
+
+def test_other_response_lengths_are_written_from_the_top_level_of_the_whole_document(tmp_path):
+    # more section summaries than the context budget holds, combined in two reduce rounds
+    sections = [
+        {"id": f"s{i}", "level": "section", "position": i, "response_length": "",
+         "text": f"section {i} " + "detail " * 400, "start": 100 * i, "end": 100 * i + 99}
+        for i in range(12)
+    ]
+    first_round = [
+        {"id": f"g{i}", "level": "group", "position": i, "response_length": "",
+         "text": f"group {i}", "start": 200 * i, "end": 200 * i + 199}
+        for i in range(6)
+    ]
+    second_round = [
+        {"id": f"g{6 + i}", "level": "group", "position": 6 + i, "response_length": "",
+         "text": f"group {6 + i}", "start": 400 * i, "end": 400 * i + 399}
+        for i in range(3)
+    ]
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    document_store.put_summaries("tenant/doc.pdf", sections + first_round + second_round)
+    llm = SummarizingChatModel(responses=["unused"], prompts=[])
+
+    assert [node["id"] for node in top_summary_nodes(document_store.get_summaries("tenant/doc.pdf"))] == ["g6", "g7", "g8"]
+    assert top_summary_nodes(sections) == sections
+
+    asyncio.run(generate_summarized_response(
+        llm=llm, embedding_model=None, standalone_query="Summarize this document", username="tenant",
+        history_messages=[], doc_key="tenant/doc.pdf", top_k=8, preferred_response_length="one paragraph",
+        pinecone_index=None, document_store=document_store, metadata={}))
+
+    # the end of the document is summarized too
+    assert "group 6\n\ngroup 7\n\ngroup 8" in llm.prompts[0]
+    assert "section 0 " not in llm.prompts[0]
+
+
+def test_summary_nodes_are_loaded_only_for_broad_queries(tmp_path):
+    document_store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    nodes = [{"id": "d", "level": "document", "position": 0, "response_length": "short", "text": "summary", "start": 0, "end": 9}]
+    document_store.put_summaries("tenant/doc.pdf", nodes)
+
+    def load(query, doc_key="tenant/doc.pdf"):
+        return asyncio.run(load_summary_nodes(query, doc_key, document_store))
+
+    # the summarization endpoint only retrieves when no summary nodes are returned
+    assert [node["id"] for node in load("Summarize this document")] == ["d"]
+    assert load("Summarize the chapter on parsing") == []
+    assert load("Summarize this document", doc_key="tenant/other.pdf") == []
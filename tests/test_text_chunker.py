@@ -0,0 +1,43 @@
+import random
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.gen_ai.rag.text_chunker import split_text_spans
+
+
+def generate_text(seed, num_tokens=3000):
+    rng = random.Random(seed)
+    tokens = []
+    for _ in range(num_tokens):
+        roll = rng.random()
+        if roll < 0.03:
+            tokens.append("\n\n")
+        elif roll < 0.10:
+            tokens.append("\n")
+        elif roll < 0.12:
+            tokens.append("   ")
+        elif roll < 0.14:
+            # long unbroken words force the character level fallback
+            tokens.append("x" * rng.randint(50, 700))
+        else:
+            tokens.append(rng.choice(["lorem", "ipsum", "dolor", "sit", "amet", "CS1010", "42.", "é"]))
+        tokens.append(" " if rng.random() < 0.8 else "")
+    return "".join(tokens)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(512, 50), (100, 0), (64, 32), (1000, 200)])
+def test_split_text_spans_matches_recursive_character_text_splitter(seed, chunk_size, chunk_overlap):
+    text = generate_text(seed)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    spans = split_text_spans(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    assert [text[start:end] for start, end in spans] == splitter.split_text(text)
+
+
+@pytest.mark.parametrize("text", ["", "   \n\n  ", "short", "\n\n\n\nword\n\n\n", "a" * 2000])
+def test_split_text_spans_matches_on_edge_cases(text):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+
+    assert [text[start:end] for start, end in split_text_spans(text)] == splitter.split_text(text)
@@ -0,0 +1,126 @@
+import multiprocessing
+
+import numpy as np
+
+from src.gen_ai.rag.vector_store import LocalVectorStore, _LocalPartition
+
+
+def random_vectors(num_vectors, dimension=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(num_vectors, dimension)).astype(np.float32)
+
+
+def upsert_document(vector_store, username, doc_key, values):
+    vector_store.upsert([
+        {"id": f"{doc_key}#{i}", "values": vector.tolist(), "metadata": {"username": username, "doc_key": doc_key, "page": i}}
+        for i, vector in enumerate(values)
+    ])
+
+
+def test_local_vector_store_returns_exact_cosine_top_k(tmp_path):
+    vector_store = LocalVectorStore(str(tmp_path))
+    values = random_vectors(500)
+    upsert_document(vector_store, "tenant", "tenant/a.pdf", values)
+    upsert_document(vector_store, "tenant", "tenant/b.pdf", random_vectors(50, seed=1))
+    query = random_vectors(1, seed=2)[0]
+
+    results = vector_store.query(
+        vector=query.tolist(),
+        filter={"username": {"$eq": "tenant"}, "doc_key": "tenant/a.pdf"},
+        top_k=5,
+        include_metadata=True,
+        include_values=True)
+
+    cosine = values @ query / (np.linalg.norm(values, axis=1) * np.linalg.norm(query))
+    expected = np.argsort(-cosine)[:5]
+
+    assert [match["id"] for match in results["matches"]] == [f"tenant/a.pdf#{i}" for i in expected]
+    assert np.allclose([match["score"] for match in results["matches"]], cosine[expected], atol=1e-5)
+    assert np.allclose(results["matches"][0]["values"], values[expected[0]], atol=1e-5)
+    assert results["matches"][0]["metadata"]["page"] == expected[0]
+
+
+def test_local_vector_store_filters_deletes_and_persists(tmp_path):
+    vector_store = LocalVectorStore(str(tmp_path))
+    values = random_vectors(10)
+    upsert_document(vector_store, "tenant", "tenant/a.pdf", values)
+
+    vector_store.delete(["tenant/a.pdf#0", "tenant/a.pdf#1"])
+    # replacing a vector keeps a single row for its id
+    vector_store.upsert([{"id": "tenant/a.pdf#2", "values": values[2].tolist(), "metadata": {"username": "tenant", "doc_key": "tenant/a.pdf", "page": 2}}])
+
+    reopened = LocalVectorStore(str(tmp_path))
+
+    assert sorted(id for ids in reopened.list(prefix="tenant/a.pdf#") for id in ids) == [f"tenant/a.pdf#{i}" for i in range(2, 10)]
+    assert reopened.query(vector=values[0].tolist(), filter={"username": {"$eq": "other"}, "doc_key": "tenant/a.pdf"}, top_k=3)["matches"] == []
+    assert len(reopened.query(vector=values[0].tolist(), filter={"doc_key": "tenant/a.pdf"}, top_k=20)["matches"]) == 8
+
+
+def test_local_vector_store_deletes_only_touch_the_partitions_of_the_ids(tmp_path, monkeypatch):
+    vector_store = LocalVectorStore(str(tmp_path))
+    for doc in range(10):
+        upsert_document(vector_store, "tenant", f"tenant/doc_{doc}.pdf", random_vectors(3, seed=doc))
+    # a positional id of a document indexed before ids were content based
+    vector_store.upsert([{"id": "tenant/doc_3.pdf_0", "values": random_vectors(1)[0].tolist(), "metadata": {"doc_key": "tenant/doc_3.pdf"}}])
+
+    touched = []
+    refresh = _LocalPartition.refresh
+
+    def recording_refresh(partition):
+        touched.append(partition.doc_key)
+        refresh(partition)
+
+    def doc_keys(self):
+        raise AssertionError("the partitions are not listed")
+
+    monkeypatch.setattr(_LocalPartition, "refresh", recording_refresh)
+    monkeypatch.setattr(LocalVectorStore, "_doc_keys", doc_keys)
+
+    vector_store.delete(["tenant/doc_3.pdf#0", "tenant/doc_3.pdf_0", "tenant/doc_3.pdf#missing", "tenant/other.pdf#0"])
+
+    assert set(touched) == {"tenant/doc_3.pdf"}
+
+    monkeypatch.undo()
+
+    assert sorted(id for ids in vector_store.list(prefix="tenant/doc_3.pdf") for id in ids) == ["tenant/doc_3.pdf#1", "tenant/doc_3.pdf#2"]
+    # a query without a doc_key filter still goes through every partition
+    assert len(vector_store.query(vector=random_vectors(1)[0].tolist(), top_k=100)["matches"]) == 29
+
+
+def row_values(worker, batch, row):
+    return [float(worker + 1), float(batch + 1), float(row + 1), 1.0]
+
+
+def write_rows(path, worker, num_batches, delete):
+    vector_store = LocalVectorStore(path)
+
+    for batch in range(num_batches):
+        ids = [f"doc#{worker}-{batch}-{row}" for row in range(20)]
+        vector_store.upsert([
+            {"id": vector_id, "values": row_values(worker, batch, row), "metadata": {"doc_key": "doc"}}
+            for row, vector_id in enumerate(ids)
+        ])
+        if delete:
+            # deleted rows soon outnumber the live ones, which compacts the files
+            vector_store.delete(ids)
+
+
+def test_local_vector_store_files_are_shared_by_workers(tmp_path):
+    path = str(tmp_path)
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=write_rows, args=(path, worker, 30, worker == 3))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    matches = LocalVectorStore(path).query(
+        vector=[1.0, 1.0, 1.0, 1.0], filter={"doc_key": "doc"}, top_k=10000, include_values=True)["matches"]
+
+    assert len(matches) == 3 * 30 * 20
+    for match in matches:
+        worker, batch, row = map(int, match["id"].split("#")[1].split("-"))
+        assert np.allclose(match["values"], row_values(worker, batch, row), atol=1e-5)